@@ -0,0 +1,5 @@
+"""Run the offline benchmark, see benchmark.run"""
+
+from crops_growth_analysis.benchmark.run import cli
+
+cli()
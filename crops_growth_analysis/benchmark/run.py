@@ -0,0 +1,237 @@
+"""
+Module to benchmark the pipeline offline, on synthetic items
+Every case (parcels, assets, method, storage) runs in a new process, so
+that its peak memory is its own, and reports the time of each stage, the
+peak memory, and the size of results and stored data
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from crops_growth_analysis import main
+from crops_growth_analysis.benchmark import storages, synthetic
+from crops_growth_analysis.extract import cache, csv, sentinel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics, peak_rss
+from crops_growth_analysis.process import tile_cache
+from crops_growth_analysis.store import encoding
+
+# Directory of synthetic data, stored outputs and results
+DATA_DIR = Path(".cache/benchmark")
+
+# Default parameters of benchmark cases
+PARCELS = [1, 10]
+ASSETS = [1, 3]
+METHODS = ["manual", "external"]
+STORAGES = ["none", "files", "zarr"]
+ENCODER = "netcdf"
+
+# Set to True to read through the tile cache, warm after the first case
+TILE_CACHE = False
+
+
+class Case(NamedTuple):
+    """A benchmark case"""
+
+    parcels: int
+    assets: int
+    method: str
+    storage: str
+    encoder: str = ENCODER
+
+    @property
+    def name(self) -> str:
+        """Name of the case"""
+        return "-".join(map(str, self))
+
+
+def read_parcels(count: int) -> list[csv.Parcel]:
+    """Read count parcels, alternating maize and sunflower parcels"""
+    parcels = [
+        parcel
+        for pair in zip(csv.read_maize(), csv.read_tournesol())
+        for parcel in pair
+    ]
+    return parcels[:count]
+
+
+def run_case(
+    case: Case, data_dir: Path, compare_encoders: bool = False
+) -> dict[str, Any]:
+    """
+    Run the pipeline for a case, on the synthetic items of data_dir
+    With compare_encoders, every encoder is also run on processed parcels
+    Return the time of each stage, peak memory and output sizes
+    """
+    cache.CACHE_ENABLED = False
+    tile_cache.CACHE_ENABLED = TILE_CACHE
+    sentinel.catalog = synthetic.RecordedCatalog(
+        synthetic.load(data_dir / "items")
+    )
+    main.PROCESSING_METHOD = case.method
+    main.ASSETS_LIMIT = case.assets
+    main.CLOUD_FILTER = False
+    metrics.clear()
+
+    output_dir = data_dir / "output" / case.name
+    shutil.rmtree(output_dir, ignore_errors=True)
+    storage = storages.open_storage(case.storage, output_dir, case.encoder)
+
+    parcels = main.run_stage(
+        "extract", main.search, read_parcels(case.parcels)
+    )
+    parcels = main.run_stage("process", main.process, parcels)
+    encoders = (
+        encoding.benchmark(
+            parcel.timeseries for parcel in parcels if parcel.timeseries.ndim
+        )
+        if compare_encoders
+        else {}
+    )
+    if storage is not None:
+        main.run_stage("store", storage.store_parcels, parcels)
+        storage.close()
+    main.run_stage("display", main.display, parcels)
+
+    summary = metrics.summary()
+    return {
+        **case._asdict(),
+        **{
+            stage: summary.get(f"stage.{stage}", {}).get("total", 0.0)
+            for stage in ("extract", "process", "store", "display")
+        },
+        "peak_rss": peak_rss(),
+        "result_bytes": sum(parcel.timeseries.nbytes for parcel in parcels),
+        "stored_bytes": (
+            storages.directory_size(output_dir) if output_dir.exists() else 0
+        ),
+        "read_bytes": sum(
+            step["nbytes"]
+            for name, step in summary.items()
+            if name.startswith("band_read.")
+        ),
+        "encoders": encoders,
+    }
+
+
+def run(
+    cases: list[Case],
+    data_dir: Path = DATA_DIR,
+    compare_encoders: bool = False,
+) -> list[dict]:
+    """
+    Generate synthetic items, then run every case in a new process
+    """
+    synthetic.generate(
+        read_parcels(max(case.parcels for case in cases)),
+        max(case.assets for case in cases),
+        data_dir / "items",
+    )
+    # Display without a window
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    results = []
+    for case in cases:
+        log.info("--- Benchmark %s ---", case.name)
+        with ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results.append(
+                pool.submit(
+                    run_case, case, data_dir, compare_encoders
+                ).result()
+            )
+    return results
+
+
+def log_results(results: list[dict]):
+    """Log results as a table"""
+    log.info(
+        "| %-8s | %-7s | %-6s | %-7s | %8s | %8s | %8s | %8s | %8s | %10s |",
+        "Method",
+        "Parcels",
+        "Assets",
+        "Storage",
+        "Extract",
+        "Process",
+        "Store",
+        "Display",
+        "RSS (MB)",
+        "Stored (KB)",
+    )
+    for result in results:
+        log.info(
+            "| %-8s | %7d | %6d | %-7s | %8.2f | %8.2f | %8.2f | %8.2f "
+            "| %8.1f | %10.1f |",
+            result["method"],
+            result["parcels"],
+            result["assets"],
+            result["storage"],
+            result["extract"],
+            result["process"],
+            result["store"],
+            result["display"],
+            result["peak_rss"] / 1024**2,
+            result["stored_bytes"] / 1024,
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        prog="python -m crops_growth_analysis.benchmark",
+        description="Benchmark the pipeline offline, on synthetic items",
+    )
+    parser.add_argument("--parcels", type=int, nargs="+", default=PARCELS)
+    parser.add_argument("--assets", type=int, nargs="+", default=ASSETS)
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        default=METHODS,
+        choices=["manual", "external"],
+    )
+    parser.add_argument(
+        "--storages",
+        nargs="+",
+        default=STORAGES,
+        choices=storages.STORAGES,
+    )
+    parser.add_argument(
+        "--encoder", default=ENCODER, choices=["netcdf", "compact"]
+    )
+    parser.add_argument(
+        "--compare-encoders",
+        action="store_true",
+        help="Also compare the size and speed of every encoder",
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="JSON results file, data-dir/results.json by default",
+    )
+    return parser.parse_args()
+
+
+def cli():
+    """Run the benchmark from the command line"""
+    args = parse_args()
+    cases = [
+        Case(*parameters, args.encoder)
+        for parameters in itertools.product(
+            args.parcels, args.assets, args.methods, args.storages
+        )
+    ]
+    results = run(cases, args.data_dir, args.compare_encoders)
+    log_results(results)
+    output = args.output or args.data_dir / "results.json"
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    log.info("Results written to %s", output)
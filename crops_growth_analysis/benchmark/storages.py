@@ -0,0 +1,141 @@
+"""
+Module of local storages, stand-ins for database backends in benchmarks
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.store import zarr
+from crops_growth_analysis.store.common import (
+    BATCH_SIZE,
+    ENCODER,
+    AbstractParcelStorage,
+    DatasetRecord,
+    processed_datetimes,
+    record_data,
+    to_records,
+)
+from crops_growth_analysis.store.encoding import Encoder
+
+# Available storages
+STORAGES = ("none", "files", "zarr")
+
+
+class FileStorage(AbstractParcelStorage):
+    """
+    Parcel storage writing datasets as files, like objects in Minio, and
+    parcels information as json files, like documents in MongoDB
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        batch_size: int = BATCH_SIZE,
+        encoder: str | Encoder = ENCODER,
+    ):
+        super().__init__(batch_size, encoder)
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def info_path(self, parcel_id: str) -> Path:
+        """Path of the json file of a parcel"""
+        return self.root / f"{parcel_id}.json"
+
+    def store_parcel_info(self, parcel: Parcel):
+        """
+        Store parcel information as a json file
+        Processed datetimes are added to the stored ones
+        """
+        datetimes = self.stored_datetimes([parcel.id]).get(parcel.id, set())
+        datetimes.update(processed_datetimes(parcel))
+        with open(self.info_path(parcel.id), "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "id": parcel.id,
+                    "polygon": parcel.polygon.wkt,
+                    "processed_datetimes": [
+                        time.isoformat() for time in sorted(datetimes)
+                    ],
+                },
+                file,
+            )
+
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """Processed datetimes of the json files of many parcels"""
+        datetimes = {}
+        for parcel_id in parcel_ids:
+            path = self.info_path(parcel_id)
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as file:
+                    datetimes[parcel_id] = {
+                        datetime.fromisoformat(time)
+                        for time in json.load(file)["processed_datetimes"]
+                    }
+        return datetimes
+
+    def store_ds(
+        self,
+        parcel_id: str,
+        index_type: str,
+        time: datetime,
+        data: bytes | None = None,
+        url: str | None = None,
+    ):
+        """Store a single timeserie dataset as a file"""
+        self.store_many([DatasetRecord(parcel_id, index_type, time, data)])
+
+    def store_many(self, records: list[DatasetRecord]):
+        """Store many timeserie datasets as files"""
+        for record in records:
+            directory = self.root / record.parcel_id / record.index_type
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / (
+                f"{record.time:%Y%m%dT%H%M%S}"
+                f".{self.extension(record.index_type)}"
+            )
+            path.write_bytes(record_data(record))
+
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """Read the dataset files of a parcel and index type"""
+        directory = self.root / parcel_id / index_type
+        if not directory.exists():
+            return []
+        return to_records(
+            parcel_id,
+            index_type,
+            (
+                (
+                    datetime.strptime(path.stem, "%Y%m%dT%H%M%S"),
+                    path.read_bytes(),
+                )
+                for path in sorted(directory.iterdir())
+            ),
+        )
+
+    def close(self):
+        """Flush pending writes"""
+        self.flush()
+
+
+def open_storage(
+    storage: str, root: str | Path, encoder: str = ENCODER
+) -> AbstractParcelStorage | None:
+    """Open a local storage by name, in root"""
+    if storage == "files":
+        return FileStorage(root, encoder=encoder)
+    if storage == "zarr":
+        return zarr.ParcelStorage(str(root), encoder=encoder)
+    return None
+
+
+def directory_size(root: str | Path) -> int:
+    """Size of the files of a directory, in bytes"""
+    return sum(
+        path.stat().st_size for path in Path(root).rglob("*") if path.is_file()
+    )
@@ -0,0 +1,299 @@
+"""
+Module to generate synthetic Sentinel-2 items over real parcels
+Parcels close to each other share a tile, each tile being written as one
+tiled GeoTIFF per band and date, and described by a recorded STAC item,
+so that the pipeline runs without network
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy
+import rasterio
+import shapely
+from pystac import Asset, Item, ItemCollection
+from rasterio.transform import from_origin
+from shapely import Polygon
+
+from crops_growth_analysis import projection
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+
+# Bands generated, and their resolution in meters
+BANDS = {
+    "B02": 10,
+    "B03": 10,
+    "B04": 10,
+    "B08": 10,
+    "B11": 20,
+    "SCL": 20,
+}
+
+# Margin around parcels, in meters, a multiple of 60
+TILE_MARGIN = 600
+
+# First acquisition date, and days between acquisitions
+START_DATE = datetime(2024, 6, 1, 10, 30, tzinfo=timezone.utc)
+REVISIT_DAYS = 5
+
+# Reflectance ranges of generated bands
+REFLECTANCES = {
+    "B02": (300, 1000),
+    "B03": (400, 1200),
+    "B04": (300, 1500),
+    "B08": (2000, 4500),
+    "B11": (1000, 2500),
+}
+
+
+def utm_epsg(polygon: Polygon) -> int:
+    """EPSG of the UTM zone (north) of a parcels CRS polygon"""
+    longitude = shapely.get_x(
+        projection.project(
+            polygon.centroid, projection.PARCEL_EPSG, projection.CATALOG_EPSG
+        )
+    )
+    return 32601 + int((longitude + 180) // 6)
+
+
+def tiles(parcels: list[Parcel]) -> list[tuple[int, tuple[float, ...]]]:
+    """
+    Group parcels in tiles, return the EPSG and bounds of every tile
+    Parcels whose margins overlap end up in the same tile, so every parcel
+    intersecting a tile is fully inside it
+    """
+    boxes: list[tuple[int, Polygon]] = []
+    for parcel in parcels:
+        epsg = utm_epsg(parcel.polygon)
+        box = shapely.box(
+            *projection.project(parcel.polygon, projection.PARCEL_EPSG, epsg)
+            .buffer(TILE_MARGIN)
+            .bounds
+        )
+        # Merge with every overlapping tile of the same CRS
+        overlapping = [
+            other
+            for other in boxes
+            if other[0] == epsg and other[1].intersects(box)
+        ]
+        for other in overlapping:
+            boxes.remove(other)
+            box = shapely.box(*shapely.union(box, other[1]).bounds)
+        boxes.append((epsg, box))
+    return [(epsg, snap(box.bounds)) for epsg, box in boxes]
+
+
+def snap(bounds: tuple[float, ...]) -> tuple[float, ...]:
+    """Snap bounds outwards to the 60 meters grid of Sentinel-2 tiles"""
+    return (
+        numpy.floor(bounds[0] / 60) * 60,
+        numpy.floor(bounds[1] / 60) * 60,
+        numpy.ceil(bounds[2] / 60) * 60,
+        numpy.ceil(bounds[3] / 60) * 60,
+    )
+
+
+def band_data(
+    band: str, shape: tuple[int, int], cloud_cover: float, seed: int
+) -> numpy.ndarray:
+    """
+    Random band values, reproducible by seed
+    SCL is vegetation (4), except a cloud_cover percent of clouds (8 to 10)
+    """
+    rng = numpy.random.default_rng(seed)
+    if band == "SCL":
+        cloudy = rng.random(shape) < cloud_cover / 100
+        return numpy.where(cloudy, rng.integers(8, 11, shape), 4).astype(
+            "uint8"
+        )
+    low, high = REFLECTANCES[band]
+    return rng.integers(low, high, shape).astype("uint16")
+
+
+def write_band(
+    path: Path,
+    data: numpy.ndarray,
+    epsg: int,
+    transform,
+):
+    """Write a band as a tiled, compressed GeoTIFF"""
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        crs=f"EPSG:{epsg}",
+        transform=transform,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    ) as dst:
+        dst.write(data, 1)
+
+
+def tile_item(
+    directory: Path,
+    tile_id: str,
+    epsg: int,
+    bounds: tuple[float, ...],
+    date: datetime,
+) -> Item:
+    """Write the bands of a tile at date, return its STAC item"""
+    item_id = f"S2SYN_{date:%Y%m%d}_{tile_id}"
+    seed = int(hashlib.sha256(item_id.encode()).hexdigest()[:8], 16)
+    cloud_cover = float(numpy.random.default_rng(seed).integers(0, 60))
+    assets: dict[str, Asset] = {}
+    for band, resolution in BANDS.items():
+        shape = (
+            int((bounds[3] - bounds[1]) // resolution),
+            int((bounds[2] - bounds[0]) // resolution),
+        )
+        transform = from_origin(bounds[0], bounds[3], resolution, resolution)
+        path = directory / f"{item_id}_{band}.tif"
+        if not path.exists():
+            write_band(
+                path,
+                band_data(band, shape, cloud_cover, seed + len(assets)),
+                epsg,
+                transform,
+            )
+        assets[band] = Asset(
+            str(path.resolve()),
+            media_type="image/tiff; application=geotiff",
+            extra_fields={
+                "proj:shape": list(shape),
+                "proj:transform": list(transform)[:6],
+                "proj:epsg": epsg,
+            },
+        )
+    footprint = projection.project(
+        shapely.box(*bounds), epsg, projection.CATALOG_EPSG
+    )
+    return Item(
+        item_id,
+        shapely.geometry.mapping(footprint),
+        list(footprint.bounds),
+        date,
+        {"proj:epsg": epsg, "eo:cloud_cover": cloud_cover},
+        assets=assets,
+    )
+
+
+def generate(
+    parcels: list[Parcel], dates: int, directory: str | Path
+) -> ItemCollection:
+    """
+    Generate synthetic items of parcels, for dates acquisitions
+    Bands already generated in directory are reused, and items are recorded
+    in directory/items.json
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    items = []
+    parcel_tiles = tiles(parcels)
+    log.info(
+        "Generating %d tiles of %d dates in %s",
+        len(parcel_tiles),
+        dates,
+        directory,
+    )
+    for epsg, bounds in parcel_tiles:
+        tile_id = f"{epsg}_{int(bounds[0])}_{int(bounds[1])}"
+        for i in range(dates):
+            date = START_DATE + timedelta(days=i * REVISIT_DAYS)
+            items.append(tile_item(directory, tile_id, epsg, bounds, date))
+    collection = ItemCollection(items)
+    with open(directory / "items.json", "w", encoding="utf-8") as file:
+        json.dump(collection.to_dict(transform_hrefs=False), file)
+    return collection
+
+
+def load(directory: str | Path) -> ItemCollection:
+    """Load recorded items"""
+    with open(Path(directory) / "items.json", "r", encoding="utf-8") as file:
+        return ItemCollection.from_dict(json.load(file))
+
+
+class RecordedCatalog:
+    """
+    Catalog searching recorded items, a stand-in for the STAC client
+    """
+
+    def __init__(self, items: ItemCollection):
+        self.items = list(items)
+        self.footprints = numpy.array(
+            [shapely.geometry.shape(item.geometry) for item in self.items]
+        )
+
+    def search(
+        self,
+        collections: list[str] | None = None,
+        intersects: Polygon | None = None,
+        bbox: tuple[float, ...] | None = None,
+        datetime: str | None = None,  # pylint: disable=redefined-outer-name
+    ) -> "RecordedCatalog":
+        """
+        Search recorded items of collections intersecting a polygon or bbox,
+        acquired within a datetime range
+        Items without collection are found in every collection
+        """
+        if intersects is not None:
+            geometry = intersects
+        elif bbox is not None:
+            geometry = shapely.box(*bbox)
+        else:
+            raise ValueError("Searches need a polygon or a bbox")
+        matches = shapely.intersects(self.footprints, geometry)
+        return RecordedCatalog(
+            ItemCollection(
+                item
+                for item, match in zip(self.items, matches)
+                if match
+                and (
+                    collections is None
+                    or item.collection_id is None
+                    or item.collection_id in collections
+                )
+                and (datetime is None or in_range(item, datetime))
+            )
+        )
+
+    def item_collection(self) -> ItemCollection:
+        """Found items"""
+        return ItemCollection(self.items)
+
+
+def in_range(item: Item, datetime_range: str) -> bool:
+    """
+    Whether an item is acquired within a STAC datetime range, "start/end" or
+    a single datetime
+    Open ends are ".." or empty, and dates without time cover their day
+    Items without datetime are always within range
+    """
+    if item.datetime is None:
+        return True
+    start, _, end = datetime_range.partition("/")
+    if "/" not in datetime_range:
+        end = start
+    if start not in ("", "..") and item.datetime < parse_bound(start):
+        return False
+    return end in ("", "..") or item.datetime <= parse_bound(end, end=True)
+
+
+def parse_bound(value: str, end: bool = False) -> datetime:
+    """
+    Datetime of a range bound, in UTC if without timezone
+    End dates without time are the last microsecond of their day
+    """
+    bound = datetime.fromisoformat(value)
+    if bound.tzinfo is None:
+        bound = bound.replace(tzinfo=timezone.utc)
+    if end and "T" not in value.upper():
+        bound += timedelta(days=1, microseconds=-1)
+    return bound
@@ -1,5 +1,7 @@
 """Basic matplotlib display functions for parcels"""
 
+import functools
+
 import matplotlib.pyplot as plt
 import numpy
 import stackstac
@@ -7,6 +9,7 @@ import xarray
 from matplotlib.axes import Axes
 
 from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.process import tile_cache
 
 # Limit the number of parcels
 PARCEL_LIMIT = 3
@@ -14,15 +17,28 @@ PARCEL_LIMIT = 3
 # Limit the number of time to display
 TIME_LIMIT = 5
 
+# Range of values of each index, mapped on the color table
+INDEX_RANGES = {
+    "ndvi": (-1.0, 1.0),
+    "ndmi": (-1.0, 1.0),
+}
+
+# Number of colors of the color tables
+COLOR_TABLE_SIZE = 256
+
 
 def display_parcels(parcels: list[Parcel]):
     """
     Display parcels
-    For now, we just display the first parcel
+    Only timeseries and quicklooks are needed, parcels read back from a
+    storage are displayed without reading imagery
     """
     # Process limits
     parcel_nb = min(PARCEL_LIMIT, len(parcels))
-    time_nb = min(TIME_LIMIT, len(parcels[0].sentinel_items))
+    time_nb = min(
+        TIME_LIMIT,
+        max(len(parcel.timeseries["time"]) for parcel in parcels[:parcel_nb]),
+    )
 
     # Init plot
     ax: list[list[Axes]]
@@ -35,10 +51,9 @@ def display_parcels(parcels: list[Parcel]):
     for i in range(parcel_nb):
         display_parcel(parcels[i], ax[i, :])
 
-    for i in range(time_nb):
-        ax[-1][i].set_xlabel(
-            f"{parcels[-1].sentinel_items[i].datetime.strftime('%Y-%m-%d')}"
-        )
+    last_times = parcels[parcel_nb - 1].timeseries["time"].values[:time_nb]
+    for i, time in enumerate(last_times):
+        ax[-1][i].set_xlabel(numpy.datetime_as_string(time, unit="D"))
 
     plt.show()
 
@@ -52,27 +67,45 @@ def display_parcel(parcel: Parcel, ax: list[Axes]):
     # Process limits
     time_nb = min(TIME_LIMIT, len(processed_time))
 
+    # Color every displayed time at once
+    overlays = apply_color_function(
+        parcel.timeseries.sel(index_type="ndvi").sel(
+            time=processed_time[:time_nb]
+        )
+    )
+
     # Display timeseries
     ax[0].set_ylabel(f"Parcel {parcel.id}")
     for i, time in enumerate(processed_time[:time_nb]):
-        display_parcel_at_time(parcel, time, ax[i])
+        display_parcel_at_time(parcel, time, ax[i], overlays[i])
 
 
-def display_parcel_at_time(parcel: Parcel, time: numpy.datetime64, ax: Axes):
+def display_parcel_at_time(
+    parcel: Parcel,
+    time: numpy.datetime64,
+    ax: Axes,
+    ndvi_color_overlay: numpy.ndarray | None = None,
+):
     """
     Display parcel indexes at provided time.
     For now, we just display NDVI.
-    Ideally we would read from databases.
-    For now, we just take the previously computed values.
+    The background is the parcel quicklook if any, else the visual image
+    read from its items, if any.
+    The NDVI overlay may be provided, already colored.
     """
     # Get images arrays
-    visual = get_visual(parcel, time)
+    visual: numpy.ndarray | None = None
+    if parcel.quicklooks.ndim:
+        visual = parcel.quicklooks.sel(time=time, method="nearest").values
+    elif len(parcel.sentinel_items):
+        visual = get_visual(parcel, time)
     ndvi: xarray.DataArray = parcel.timeseries.sel(index_type="ndvi").sel(
         time=time, method="nearest"
     )
 
     # Apply color function to every pixel
-    ndvi_color_overlay = apply_color_function(ndvi)
+    if ndvi_color_overlay is None:
+        ndvi_color_overlay = apply_color_function(ndvi)
     extent = [
         ndvi.coords["x"].min(),
         ndvi.coords["x"].max(),
@@ -84,7 +117,8 @@ def display_parcel_at_time(parcel: Parcel, time: numpy.datetime64, ax: Axes):
     x, y = parcel.polygon.exterior.xy
 
     # Plot
-    ax.imshow(visual, interpolation="none", extent=extent)
+    if visual is not None:
+        ax.imshow(visual, interpolation="none", extent=extent)
     ax.imshow(ndvi_color_overlay, interpolation="none", extent=extent)
     ax.plot(x, y, color="blue", linewidth=2)
     ax.set_yticks([])
@@ -108,6 +142,7 @@ def get_visual(parcel: Parcel, time: numpy.datetime64) -> numpy.array:
         assets=["B04", "B03", "B02"],
         bounds=parcel.polygon.bounds,
         epsg=2154,
+        reader=tile_cache.CachedRioReader,
     ).isel(time=0)
 
     # Create RGB image from xarray DataArray
@@ -123,12 +158,53 @@ def get_visual(parcel: Parcel, time: numpy.datetime64) -> numpy.array:
     )
 
 
-def apply_color_function(ndvi: xarray.DataArray) -> numpy.array:
+def apply_color_function(
+    index: xarray.DataArray, index_type: str = "ndvi"
+) -> numpy.ndarray:
+    """
+    Apply color function to index values, of any shape (time, y, x, ...)
+    Values are looked up in the color table of the index, in a single array
+    operation. NaN values are transparent
+    Return RGBA colors, of shape index.shape + (4,)
+    """
+    low, high = INDEX_RANGES[index_type]
+    values = numpy.asarray(index)
+    nan = numpy.isnan(values)
+    positions = numpy.rint(
+        (numpy.clip(numpy.where(nan, low, values), low, high) - low)
+        / (high - low)
+        * (COLOR_TABLE_SIZE - 1)
+    ).astype(numpy.intp)
+    # The last color of the table is the transparent NaN color
+    positions[nan] = COLOR_TABLE_SIZE
+    return color_table(index_type)[positions]
+
+
+def color_table(index_type: str) -> numpy.ndarray:
+    """
+    Color table of an index, COLOR_TABLE_SIZE colors evenly spread over its
+    range, followed by a transparent color for NaN
+    """
+    low, high = INDEX_RANGES[index_type]
+    return build_color_table(index_type, low, high, COLOR_TABLE_SIZE)
+
+
+@functools.cache
+def build_color_table(
+    index_type: str, low: float, high: float, size: int
+) -> numpy.ndarray:
     """
-    Apply color function to NDVI
-    This is basically a fancy way of applying a color map to the NDVI values
+    Color table of an index, size colors evenly spread from low to high,
+    followed by a transparent color for NaN
+    Tables are cached by range and size as well, so that changed ranges
+    build new tables
     """
-    return numpy.stack(numpy.vectorize(ndvi_to_color)(ndvi.values), axis=-1)
+    color_function = COLOR_FUNCTIONS[index_type]
+    return numpy.array(
+        [color_function(value) for value in numpy.linspace(low, high, size)]
+        + [(0, 0, 0, 0)],
+        dtype=float,
+    )
 
 
 def ndvi_to_color(ndvi_value: float) -> tuple[float, float, float, float]:
@@ -142,3 +218,22 @@ def ndvi_to_color(ndvi_value: float) -> tuple[float, float, float, float]:
     else:
         # Return green gradiant
         return (0, ndvi_value, 0, opacity)
+
+
+def ndmi_to_color(ndmi_value: float) -> tuple[float, float, float, float]:
+    """
+    Convert NDMI value to color
+    """
+    opacity = 1
+    if ndmi_value < 0:
+        # Return black
+        return (0, 0, 0, opacity)
+    # Return blue gradiant
+    return (0, 0, ndmi_value, opacity)
+
+
+# Color function of each index, used to build color tables
+COLOR_FUNCTIONS = {
+    "ndvi": ndvi_to_color,
+    "ndmi": ndmi_to_color,
+}
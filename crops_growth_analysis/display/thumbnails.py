@@ -0,0 +1,197 @@
+"""
+Headless export of parcel thumbnails, for previews generated in batch
+Every (parcel, date) NDVI overlay is rendered as a small image, and all
+dates of a parcel are tiled in a contact sheet
+Figures are drawn with the Agg canvas, without pyplot, and reused by every
+thumbnail of a worker
+Thumbnails never read imagery: missing quicklooks are computed once per
+parcel by its worker, and used as background of every date
+"""
+
+import dataclasses
+import functools
+import math
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+from pystac import ItemCollection
+
+from crops_growth_analysis.display import basic
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.process import executor, quicklook
+
+# Directory of exported thumbnails, one sub directory per parcel
+THUMBNAIL_DIR = ".data/thumbnails"
+
+# Image format of thumbnails and contact sheets, "png" or "webp"
+THUMBNAIL_FORMAT = "png"
+
+# Size of thumbnails, in pixels
+THUMBNAIL_SIZE = 128
+THUMBNAIL_DPI = 64
+
+# Number of thumbnails per row of contact sheets
+SHEET_COLUMNS = 6
+
+# Executor used to export parcels, see process.executor
+# With "thread", each thread draws on its own figure
+EXECUTOR = "process"
+MAX_WORKERS = None
+
+# Maximum number of parcels exported and not yet collected
+MAX_IN_FLIGHT = 64
+
+# Figure of the current thread, reused by every thumbnail
+_figures = threading.local()
+
+
+def thumbnail_figure() -> tuple[Figure, Axes]:
+    """
+    Figure and axes of the current thread, created on first use
+    """
+    if not hasattr(_figures, "figure"):
+        figure = Figure(
+            figsize=(
+                THUMBNAIL_SIZE / THUMBNAIL_DPI,
+                THUMBNAIL_SIZE / THUMBNAIL_DPI,
+            ),
+            dpi=THUMBNAIL_DPI,
+        )
+        FigureCanvasAgg(figure)
+        _figures.figure = figure
+        _figures.ax = figure.add_axes((0, 0, 1, 1))
+    return _figures.figure, _figures.ax
+
+
+def render(
+    parcel: Parcel,
+    time: numpy.datetime64,
+    ndvi_color_overlay: numpy.ndarray | None = None,
+) -> numpy.ndarray:
+    """
+    Render the parcel at time on the reused figure
+    Return an RGB uint8 image of THUMBNAIL_SIZE pixels
+    """
+    figure, ax = thumbnail_figure()
+    ax.clear()
+    basic.display_parcel_at_time(parcel, time, ax, ndvi_color_overlay)
+    ax.set_axis_off()
+    figure.canvas.draw()
+    return numpy.array(figure.canvas.buffer_rgba())[..., :3]
+
+
+def contact_sheet(
+    images: list[numpy.ndarray], columns: int = SHEET_COLUMNS
+) -> numpy.ndarray:
+    """
+    Tile same sized images in rows of columns images, on a white background
+    """
+    height, width, bands = images[0].shape
+    columns = min(columns, len(images))
+    rows = math.ceil(len(images) / columns)
+    sheet = numpy.full((rows * height, columns * width, bands), 255, "uint8")
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        sheet[
+            slice(row * height, (row + 1) * height),
+            slice(column * width, (column + 1) * width),
+        ] = image
+    return sheet
+
+
+def save(image: numpy.ndarray, path: Path):
+    """Save an RGB image, in the format of its extension"""
+    Image.fromarray(image).save(path)
+
+
+def export_parcel(
+    parcel: Parcel,
+    directory: str | Path = THUMBNAIL_DIR,
+    image_format: str = THUMBNAIL_FORMAT,
+) -> int:
+    """
+    Export the thumbnails of every date of a parcel, and its contact sheet
+    Missing quicklooks are computed first, see with_quicklooks
+    Return the number of thumbnails
+    """
+    if not parcel.timeseries.ndim:
+        return 0
+    parcel = with_quicklooks(parcel)
+    parcel_dir = Path(directory) / parcel.id
+    parcel_dir.mkdir(parents=True, exist_ok=True)
+    times = parcel.timeseries["time"].values
+    with metrics.timer("thumbnails", parcel.id):
+        # Color every time at once
+        overlays = basic.apply_color_function(
+            parcel.timeseries.sel(index_type="ndvi").transpose("time", ...)
+        )
+        images = []
+        for time, overlay in zip(times, overlays):
+            image = render(parcel, time, overlay)
+            name = numpy.datetime_as_string(time, unit="s").replace(":", "")
+            save(image, parcel_dir / f"{name}.{image_format}")
+            images.append(image)
+        save(contact_sheet(images), parcel_dir / f"sheet.{image_format}")
+    return len(images)
+
+
+def with_quicklooks(parcel: Parcel) -> Parcel:
+    """
+    Parcel with its quicklooks, computed from its items if missing
+    Parcels without items nor quicklooks are rendered without background
+    """
+    if parcel.quicklooks.ndim or not parcel.sentinel_items:
+        return parcel
+    return dataclasses.replace(
+        parcel, quicklooks=quicklook.compute_quicklooks(parcel)
+    )
+
+
+def without_items(parcels: Iterable[Parcel]) -> Iterator[Parcel]:
+    """
+    Parcels sent to workers, without items if they already have quicklooks
+    """
+    for parcel in parcels:
+        if parcel.quicklooks.ndim and len(parcel.sentinel_items):
+            parcel = dataclasses.replace(
+                parcel, sentinel_items=ItemCollection([])
+            )
+        yield parcel
+
+
+def export_parcels(
+    parcels: Iterable[Parcel],
+    directory: str | Path = THUMBNAIL_DIR,
+    image_format: str = THUMBNAIL_FORMAT,
+    mode: str = EXECUTOR,
+    max_workers: int | None = MAX_WORKERS,
+) -> int:
+    """
+    Export thumbnails and contact sheets of many parcels, in parallel
+    Parcels are pulled from the iterable as workers get free, so that they
+    may be read lazily from a storage
+    Missing quicklooks are computed by workers, in parallel as well
+    Return the number of thumbnails
+    """
+    log.info("Exporting thumbnails to %s (%s executor)", directory, mode)
+    count = sum(
+        executor.imap_parcels(
+            functools.partial(
+                export_parcel, directory=directory, image_format=image_format
+            ),
+            without_items(parcels),
+            mode=mode,
+            max_workers=max_workers,
+            max_in_flight=MAX_IN_FLIGHT,
+        )
+    )
+    log.info("%d thumbnails exported", count)
+    return count
@@ -0,0 +1,100 @@
+"""
+Module to cache STAC search results on disk
+Item collections are stored as json files, keyed by a hash of the searched
+geometry, collection and datetime range
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import planetary_computer  # type: ignore
+import shapely
+from pystac import ItemCollection
+from shapely import Geometry
+
+from crops_growth_analysis.logger import log
+
+# Directory of the search cache
+CACHE_DIR = Path(os.environ.get("STAC_CACHE_DIR", ".cache/stac"))
+
+# Time to live of cached searches, in seconds. Set to None to never expire.
+CACHE_TTL: float | None = 7 * 24 * 3600
+
+# Set to False to disable the search cache
+CACHE_ENABLED = True
+
+
+def search_key(geometry: Geometry | tuple, collection: str, datetime: str):
+    """
+    Key of a search, hash of the geometry (or bbox), collection and datetime
+    """
+    geometry_bytes = (
+        shapely.to_wkb(shapely.normalize(geometry), hex=True).encode()
+        if isinstance(geometry, Geometry)
+        else json.dumps([round(value, 9) for value in geometry]).encode()
+    )
+    digest = hashlib.sha256(geometry_bytes)
+    digest.update(f"{collection}|{datetime}".encode())
+    return digest.hexdigest()
+
+
+def cache_path(key: str) -> Path:
+    """Path of a cached search"""
+    return CACHE_DIR / f"{key}.json"
+
+
+def unsigned_href(href: str) -> str:
+    """Remove the query string (SAS token) of an asset href"""
+    return urlunsplit(urlsplit(href)._replace(query=""))
+
+
+def load(key: str) -> ItemCollection | None:
+    """
+    Load a cached search, or None if missing or expired
+    Assets are signed again, since tokens of cached items may have expired
+    """
+    path = cache_path(key)
+    if not path.exists():
+        return None
+    if (
+        CACHE_TTL is not None
+        and time.time() - path.stat().st_mtime > CACHE_TTL
+    ):
+        log.debug("Search cache %s expired", key)
+        path.unlink(missing_ok=True)
+        return None
+    log.debug("Search cache hit %s", key)
+    with open(path, "r", encoding="utf-8") as file:
+        items = ItemCollection.from_dict(json.load(file))
+    return planetary_computer.sign(items)
+
+
+def save(key: str, items: ItemCollection):
+    """
+    Save a search in cache, without asset tokens
+    """
+    data = items.to_dict(transform_hrefs=False)
+    for feature in data["features"]:
+        for asset in feature["assets"].values():
+            asset["href"] = unsigned_href(asset["href"])
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so concurrent readers never see partial files
+    tmp_path = cache_path(key).with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    tmp_path.replace(cache_path(key))
+
+
+def invalidate(key: str | None = None):
+    """
+    Remove a cached search, or every cached search if key is None
+    """
+    if key is not None:
+        cache_path(key).unlink(missing_ok=True)
+        return
+    for path in CACHE_DIR.glob("*.json"):
+        path.unlink(missing_ok=True)
@@ -1,14 +1,41 @@
-"""Module to import parcels from csv files (and display them on a map)"""
+"""
+Module to import parcels from csv files (and display them on a map)
+Parcel files are read by batches of columns, CSV (possibly gzip'd) or
+GeoParquet, only the id, crop and geometry columns being parsed
+"""
 
-import csv
+import itertools
 from dataclasses import dataclass, field
+from typing import Iterable, Iterator
 
 import matplotlib.pyplot as plt
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+import pyarrow.parquet
 import shapely
 import xarray
 from pystac import ItemCollection
 from shapely import Polygon
 
+# Parcel files of maize and sunflower
+MAIZE_FILE = "data/maize.csv"
+TOURNESOL_FILE = "data/tournesol.csv"
+PARCEL_FILES = (MAIZE_FILE, TOURNESOL_FILE)
+
+# Columns of parcel files: the unnamed id column, the crop code, and the
+# geometry, as WKT in CSV files and WKB in GeoParquet files
+ID_COLUMN = ""
+CROP_COLUMN = "CODE_CULTU_2022"
+GEOMETRY_COLUMN = "geometry"
+
+# Size of the blocks of CSV files read at once, in bytes
+BLOCK_SIZE = 1 << 20
+
+# Number of rows of GeoParquet files read at once
+BATCH_ROWS = 10_000
+
 
 @dataclass
 class Parcel:
@@ -18,6 +45,160 @@ class Parcel:
     polygon: Polygon
     sentinel_items: ItemCollection = ItemCollection([])
     timeseries: xarray.DataArray = field(default_factory=xarray.DataArray)
+    quicklooks: xarray.DataArray = field(default_factory=xarray.DataArray)
+    projections: dict[int, Polygon] = field(default_factory=dict)
+
+
+class ParcelIndex:
+    """
+    Spatial index of parcel polygons, an STRtree
+    Queries return positions of the matching polygons, in the order they were
+    indexed, so that parcels are only built for the selected rows
+    """
+
+    def __init__(self, polygons: numpy.ndarray):
+        self.polygons = polygons
+        self.tree = shapely.STRtree(polygons)
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def query(
+        self, geometry: shapely.Geometry, predicate: str = "intersects"
+    ) -> numpy.ndarray:
+        """Positions of the polygons matching the predicate with a geometry"""
+        return numpy.sort(self.tree.query(geometry, predicate=predicate))
+
+    def query_bbox(
+        self, bbox: tuple[float, float, float, float]
+    ) -> numpy.ndarray:
+        """Positions of the polygons intersecting a bounding box"""
+        return self.query(shapely.box(*bbox))
+
+    def query_all(
+        self, geometries: numpy.ndarray, predicate: str = "intersects"
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Pairs of geometries and polygons matching the predicate
+        Return the geometry positions and the polygon positions
+        """
+        geometry_indexes, polygon_indexes = self.tree.query(
+            geometries, predicate=predicate
+        )
+        return geometry_indexes, polygon_indexes
+
+
+def iter_batches(
+    file_path: str, columns: list[str]
+) -> Iterator[pyarrow.RecordBatch]:
+    """
+    Lazily read columns of a parcel file, by batches of rows
+    GeoParquet files end with .parquet, CSV files may be compressed (e.g.
+    .csv.gz), all CSV columns being read as strings
+    """
+    if file_path.endswith(".parquet"):
+        yield from pyarrow.parquet.ParquetFile(file_path).iter_batches(
+            BATCH_ROWS, columns=columns
+        )
+        return
+    with pyarrow.input_stream(file_path, compression="detect") as stream:
+        yield from pyarrow.csv.open_csv(
+            stream,
+            read_options=pyarrow.csv.ReadOptions(block_size=BLOCK_SIZE),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=columns,
+                column_types={column: pyarrow.string() for column in columns},
+            ),
+        )
+
+
+def iter_parcels(
+    file_paths: Iterable[str] = PARCEL_FILES,
+    ids: Iterable[str] | None = None,
+    crops: Iterable[str] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> Iterator[Parcel]:
+    """
+    Lazily read parcels of many files, by batches of rows
+    Parcels are selected by ids, crop codes and bounding box (parcels CRS)
+    Ids and crops are filtered before parsing geometries, which are parsed
+    in bulk, and parcels are only built for selected rows
+    Yield parcels with an ID and a polygon
+    """
+    columns = [ID_COLUMN, GEOMETRY_COLUMN]
+    if crops is not None:
+        columns.append(CROP_COLUMN)
+    id_set = (
+        pyarrow.array(list(ids), pyarrow.string()) if ids is not None else None
+    )
+    crop_set = (
+        pyarrow.array(list(crops), pyarrow.string())
+        if crops is not None
+        else None
+    )
+    for file_path in file_paths:
+        for batch in iter_batches(file_path, columns):
+            if id_set is not None:
+                batch = batch.filter(
+                    pyarrow.compute.is_in(
+                        batch.column(ID_COLUMN).cast(pyarrow.string()),
+                        value_set=id_set,
+                    )
+                )
+            if crop_set is not None:
+                batch = batch.filter(
+                    pyarrow.compute.is_in(
+                        batch.column(CROP_COLUMN), value_set=crop_set
+                    )
+                )
+            if not batch.num_rows:
+                continue
+            parcel_ids = batch.column(ID_COLUMN).cast(pyarrow.string())
+            polygons = parse_geometries(batch.column(GEOMETRY_COLUMN))
+            check_polygons(parcel_ids, polygons)
+            selected = (
+                ParcelIndex(polygons).query_bbox(bbox)
+                if bbox is not None
+                else numpy.arange(len(polygons))
+            )
+            for parcel_id, polygon in zip(
+                parcel_ids.take(selected).to_pylist(), polygons[selected]
+            ):
+                yield Parcel(parcel_id, polygon)
+
+
+def parse_geometries(column: pyarrow.Array) -> numpy.ndarray:
+    """Parse a WKT or WKB geometry column in bulk"""
+    if pyarrow.types.is_binary(column.type) or pyarrow.types.is_large_binary(
+        column.type
+    ):
+        return shapely.from_wkb(column.to_numpy(zero_copy_only=False))
+    return shapely.from_wkt(column.to_numpy(zero_copy_only=False))
+
+
+def check_polygons(parcel_ids: pyarrow.Array, geometries: numpy.ndarray):
+    """Raise a ValueError if a geometry is not a polygon"""
+    not_polygons = numpy.flatnonzero(
+        shapely.get_type_id(geometries) != shapely.GeometryType.POLYGON
+    )
+    if len(not_polygons):
+        raise ValueError(f"{parcel_ids[not_polygons[0]]} is not a polygon")
+
+
+def load_parcels(
+    file_paths: Iterable[str] = PARCEL_FILES,
+    ids: Iterable[str] | None = None,
+    crops: Iterable[str] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    limit: int | None = None,
+) -> list[Parcel]:
+    """
+    Read the first limit selected parcels of many files, see iter_parcels
+    Files are read no further than needed
+    """
+    return list(
+        itertools.islice(iter_parcels(file_paths, ids, crops, bbox), limit)
+    )
 
 
 def read_csv(file_path: str) -> list[Parcel]:
@@ -25,19 +206,7 @@ def read_csv(file_path: str) -> list[Parcel]:
     Read a parcel csv file and keep only the id and geometry columns
     Return a list of parcels with an ID and a polygon
     """
-    parcels: list[Parcel] = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        reader = csv.reader(file)
-        # Skip header
-        next(reader, None)
-        for row in reader:
-            parcel_id = row[0]
-            geometry = shapely.from_wkt(row[7])
-            if isinstance(geometry, Polygon):
-                parcels.append(Parcel(parcel_id, geometry))
-            else:
-                raise ValueError(f"{parcel_id} is not a polygon")
-    return parcels
+    return load_parcels([file_path])
 
 
 def read_maize():
@@ -45,7 +214,7 @@ def read_maize():
     Read maize parcels from csv file
     Result is a list of parcels with an ID and a polygon
     """
-    return read_csv("data/maize.csv")
+    return read_csv(MAIZE_FILE)
 
 
 def read_tournesol():
@@ -53,7 +222,7 @@ def read_tournesol():
     Read tournesol data from csv file
     Result is a list of parcels with an ID and a polygon
     """
-    return read_csv("data/tournesol.csv")
+    return read_csv(TOURNESOL_FILE)
 
 
 def read_all():
@@ -1,29 +1,159 @@
 """Module to interact with the Sentinel-2 dataset."""
 
+import itertools
+from typing import Protocol
+
+import numpy
 import planetary_computer  # type: ignore
-import shapely.ops
-from pyproj import CRS, Transformer
+import shapely
+import shapely.geometry
 from pystac import ItemCollection
 from pystac_client import Client
 from shapely import Polygon
 
-catalog = Client.open(
-    "https://planetarycomputer.microsoft.com/api/stac/v1",
-    modifier=planetary_computer.sign_inplace,
-)
+from crops_growth_analysis import projection
+from crops_growth_analysis.extract import cache
+from crops_growth_analysis.extract.csv import Parcel, ParcelIndex
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+
+CATALOG_URL = "https://planetarycomputer.microsoft.com/api/stac/v1"
+COLLECTION = "sentinel-2-l2a"
+DATETIME = "2024-06-01/2024-06-30"
+
+# Maximum number of parcels searched in a single catalog query
+SEARCH_CHUNK_SIZE = 100
+
+
+class SearchResults(Protocol):  # pylint: disable=too-few-public-methods
+    """Results of a catalog search"""
+
+    def item_collection(self) -> ItemCollection:
+        """Found items"""
+
+
+class Catalog(Protocol):  # pylint: disable=too-few-public-methods
+    """
+    Catalog searched for items, the STAC client or a stand-in with the same
+    search method (e.g. recorded items, see benchmark.synthetic)
+    """
+
+    def search(
+        self,
+        *,
+        collections: list[str] | None = None,
+        intersects: Polygon | None = None,
+        bbox: tuple[float, ...] | None = None,
+        datetime: str | None = None,
+    ) -> SearchResults:
+        """Search items of collections intersecting a polygon or bbox"""
+
+
+# Catalog client, opened on first search
+catalog: Catalog | None = None
+
+
+def get_catalog() -> Catalog:
+    """Get the catalog client, opening it on first use"""
+    global catalog  # pylint: disable=global-statement
+    if catalog is None:
+        catalog = Client.open(
+            CATALOG_URL,
+            modifier=planetary_computer.sign_inplace,
+        )
+    return catalog
 
 
 def search_polygon(polygon: Polygon) -> ItemCollection:
     """Search for Sentinel-2 data within a polygon."""
     # Put the polygon in the same coordinate system as the catalog
-    wgs64_polygon = shapely.ops.transform(
-        Transformer.from_crs(
-            CRS("EPSG:2154"), CRS("EPSG:4326"), always_xy=True
-        ).transform,
-        polygon,
+    wgs64_polygon = projection.project(
+        polygon, projection.PARCEL_EPSG, projection.CATALOG_EPSG
+    )
+    return search(get_catalog(), intersects=wgs64_polygon)
+
+
+def search_parcels(
+    parcels: list[Parcel],
+    chunk_size: int = SEARCH_CHUNK_SIZE,
+    client: Catalog | None = None,
+) -> list[ItemCollection]:
+    """
+    Search for Sentinel-2 data of many parcels at once.
+    Parcels are split in spatially sorted chunks, each chunk is searched with
+    a single query on its bounding box, and items are assigned back to the
+    parcels they intersect.
+    Return one item collection per parcel, in the same order as parcels.
+    """
+    client = client or get_catalog()
+    polygons = projection.project_all(
+        [parcel.polygon for parcel in parcels],
+        projection.PARCEL_EPSG,
+        projection.CATALOG_EPSG,
+    )
+    # Sort parcels from west to east so chunks have small bounding boxes
+    order = numpy.argsort(shapely.get_x(shapely.centroid(polygons)))
+    results: list[ItemCollection] = [ItemCollection([])] * len(parcels)
+    for chunk_indexes in itertools.batched(order, chunk_size):
+        chunk = numpy.array(chunk_indexes)
+        log.debug("Searching items of %d parcels", len(chunk))
+        items = search(
+            client, bbox=tuple(shapely.total_bounds(polygons[chunk]))
+        )
+        for index, parcel_items in zip(
+            chunk, assign_items(polygons[chunk], items)
+        ):
+            results[index] = parcel_items
+    return results
+
+
+def search(
+    client: Catalog,
+    intersects: Polygon | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> ItemCollection:
+    """
+    Search Sentinel-2 items intersecting a WGS84 polygon or bbox.
+    Results are read from and saved to the on-disk search cache.
+    """
+    geometry = intersects if intersects is not None else bbox
+    if geometry is None:
+        raise ValueError("Searches need a polygon or a bbox")
+    key = cache.search_key(geometry, COLLECTION, DATETIME)
+    if cache.CACHE_ENABLED:
+        items = cache.load(key)
+        if items is not None:
+            return items
+    with metrics.timer("stac_search"):
+        items = client.search(
+            collections=[COLLECTION],
+            intersects=intersects,
+            bbox=bbox,
+            datetime=DATETIME,
+        ).item_collection()
+    if cache.CACHE_ENABLED:
+        cache.save(key, items)
+    return items
+
+
+def assign_items(
+    polygons: numpy.ndarray, items: ItemCollection
+) -> list[ItemCollection]:
+    """
+    Assign items to the WGS84 polygons they intersect.
+    Items keep the catalog order within each polygon collection.
+    This also allows assigning a recorded item collection, without network.
+    """
+    item_list = list(items)
+    footprints = numpy.array(
+        [shapely.geometry.shape(item.geometry) for item in item_list],
+        dtype=object,
     )
-    return catalog.search(
-        collections=["sentinel-2-l2a"],
-        intersects=wgs64_polygon,
-        datetime="2024-06-01/2024-06-30",
-    ).item_collection()
+    item_indexes, polygon_indexes = ParcelIndex(polygons).query_all(footprints)
+    assigned: list[list[int]] = [[] for _ in range(len(polygons))]
+    for polygon_index, item_index in zip(polygon_indexes, item_indexes):
+        assigned[polygon_index].append(item_index)
+    return [
+        ItemCollection([item_list[i] for i in sorted(indexes)])
+        for indexes in assigned
+    ]
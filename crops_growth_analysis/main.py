@@ -2,27 +2,114 @@
 Main script to run the crops growth analysis.
 """
 
-import time
+import dataclasses
+import functools
+import itertools
+from typing import Any, Callable, Iterable, Iterator
 
-from crops_growth_analysis.display import basic
+import pyarrow
+import xarray
+from pystac import ItemCollection
+
+from crops_growth_analysis import projection
+from crops_growth_analysis.display import basic, thumbnails
 from crops_growth_analysis.extract import csv, sentinel
 from crops_growth_analysis.logger import log
-from crops_growth_analysis.process import external, manual
-from crops_growth_analysis.store import common, minio, mongodb, postgresql
+from crops_growth_analysis.metrics import metrics, profile
+from crops_growth_analysis.process import (
+    clouds,
+    executor,
+    external,
+    images,
+    manual,
+    mask,
+    quicklook,
+    zonal,
+)
+from crops_growth_analysis.store import (
+    common,
+    minio,
+    mongodb,
+    postgresql,
+    zarr,
+)
 
 # Set the limits for parcels and assets.
 # Set to -1 to disable limits.
 PARCEL_LIMIT = 5
 ASSETS_LIMIT = 5
 
+# Parcel files, CSV (possibly gzip'd, e.g. .csv.gz) or GeoParquet (.parquet)
+PARCEL_FILES = csv.PARCEL_FILES
+# Select parcels by ids, crop codes (e.g. ["MIS", "TRN"]) or bounding box
+# (xmin, ymin, xmax, ymax) in parcels CRS.
+# Set to None to select all parcels.
+PARCEL_IDS = None
+PARCEL_CROPS = None
+PARCEL_BBOX = None
+
 # Set the processing method to use.
 # One of "manual" or "external"
 PROCESSING_METHOD = "external"
 
+# Set the executor used to process parcels.
+# One of "serial", "thread", "process" or "dask"
+# With "serial", the external method computes parcels in a single dask graph
+# and the manual method reads each item band once for all its parcels
+EXECUTOR = "serial"
+# Maximum number of parcels processed concurrently.
+# Set to None to use the number of cores.
+MAX_WORKERS = None
+# Number of parcels computed in a single dask graph by the external method.
+# Set to None to compute all parcels at once.
+BATCH_SIZE = None
+
+# Set to True to stream parcels one by one through extract, process and store.
+# Memory is then bounded by the number of parcels in flight.
+STREAMING = False
+# Maximum number of parcels processed and not yet stored when streaming.
+MAX_IN_FLIGHT = 8
+
 # Set the database to use.
-# One of "postgresql", "minio" or "mongodb"
+# One of "postgresql", "minio", "mongodb", "zarr" (local directory) or
+# "zarr-minio"
 DATABASE = None
 
+# Path of the Parquet file of parcels zonal statistics.
+# Set to None to skip statistics.
+STATISTICS_PATH = None
+
+# Set to True to skip cloudy items before processing, by cloud cover then by
+# valid fraction over each parcel (see process.clouds).
+# Skipped dates are missing from timeseries, statistics and stores.
+CLOUD_FILTER = False
+
+# Set to True to process only the items not yet stored for each parcel.
+# Parcels without new items are skipped. Requires a database.
+INCREMENTAL = False
+
+# Path of the metrics report, CSV if it ends with .csv, JSON otherwise.
+# Set to None to only log the metrics summary.
+METRICS_PATH = None
+
+# Path of the cProfile stats of the whole run.
+# Set to None to disable profiling.
+PROFILE_PATH = None
+
+# Set to True to compute downsampled RGB quicklooks at process time.
+# Quicklooks are stored with the indexes and displayed as background.
+QUICKLOOKS = False
+
+# Source of displayed parcels.
+# One of "memory" (parcels just processed) or "storage" (timeseries and
+# quicklooks read back from the database, without reading imagery)
+DISPLAY_SOURCE = "memory"
+
+# Directory of exported thumbnails and contact sheets of every displayed
+# parcel, rendered headless in parallel (see display.thumbnails).
+# Set to None to display parcels interactively instead.
+THUMBNAILS_PATH = None
+
 # Set the log level
 log.setLevel("INFO")
 
@@ -31,40 +118,41 @@ def main():
     """
     Main function to run the crops growth analysis.
     """
-    # Start Timer
-    overall_start_time = time.time()
-
-    log.info("--- Start Extract ---")
-    start_time = time.time()
-    parcels = extract()
-    extract_time = "{:.2f}".format(time.time() - start_time)
-    log.info("--- Extract Time : %s ---", extract_time)
-
-    log.info("--- Start Process ---")
-    start_time = time.time()
-    parcels = process(parcels)
-    process_time = "{:.2f}".format(time.time() - start_time)
-    log.info("--- Process Time : %s ---", process_time)
-
-    log.info("--- Start Store ---")
-    start_time = time.time()
-    store(parcels)
-    store_time = "{:.2f}".format(time.time() - start_time)
-    log.info("--- Store Time : %s ---", store_time)
-
-    log.info("--- Start Display ---")
-    start_time = time.time()
-    display(parcels)
-    display_time = "{:.2f}".format(time.time() - start_time)
-    log.info("--- Display Time : %s ---", display_time)
-
-    overall_time = "{:.2f}".format(time.time() - overall_start_time)
+    with metrics.timer("stage.overall"), profile(PROFILE_PATH):
+        if STREAMING:
+            parcels = run_stage("stream", stream)
+        else:
+            parcels = run_stage("extract", extract)
+            parcels = run_stage("process", process, parcels)
+            run_stage("store", store, parcels)
+        run_stage("display", display, parcels)
+
     log.info("--- Summary ---")
-    log.info("--- Extract Time : %s ---", extract_time)
-    log.info("--- Process Time : %s ---", process_time)
-    log.info("--- Store Time : %s ---", store_time)
-    log.info("--- Display Time : %s ---", display_time)
-    log.info("--- Overall Time : %s ---", overall_time)
+    for stage, summary in metrics.summary().items():
+        if stage.startswith("stage."):
+            log.info(
+                "--- %s Time : %.2f ---",
+                stage.removeprefix("stage.").capitalize(),
+                summary["total"],
+            )
+    metrics.log_summary()
+    if METRICS_PATH is not None:
+        log.info("Writing metrics to %s", METRICS_PATH)
+        if METRICS_PATH.endswith(".csv"):
+            metrics.to_csv(METRICS_PATH)
+        else:
+            metrics.to_json(METRICS_PATH)
+
+
+def run_stage(name: str, func: Callable, *args: Any) -> Any:
+    """
+    Run a stage of the pipeline, recording its time.
+    """
+    log.info("--- Start %s ---", name.capitalize())
+    with metrics.timer(f"stage.{name}") as timing:
+        result = func(*args)
+    log.info("--- %s Time : %.2f ---", name.capitalize(), timing["duration"])
+    return result
 
 
 def extract() -> list[csv.Parcel]:
@@ -76,65 +164,295 @@ def extract() -> list[csv.Parcel]:
         "Reading CSV %s",
         "" if PARCEL_LIMIT < 0 else f"(Limited to {PARCEL_LIMIT} parcels)",
     )
-    parcels = (csv.read_maize() + csv.read_tournesol())[:PARCEL_LIMIT]
+    parcels = csv.load_parcels(
+        PARCEL_FILES,
+        PARCEL_IDS,
+        PARCEL_CROPS,
+        PARCEL_BBOX,
+        limit=None if PARCEL_LIMIT < 0 else PARCEL_LIMIT,
+    )
 
     log.info(
         "Searching planetarium data %s",
         "" if ASSETS_LIMIT < 0 else f"(Limited to {ASSETS_LIMIT} assets)",
     )
+    storage = open_storage() if INCREMENTAL else None
+    try:
+        return search(parcels, storage)
+    finally:
+        if storage is not None:
+            storage.close()
+
+
+def search(
+    parcels: list[csv.Parcel],
+    storage: common.AbstractParcelStorage | None = None,
+) -> list[csv.Parcel]:
+    """
+    Search Sentinel-2 items of parcels and project parcels to their CRS.
+    If storage is provided, items already stored are skipped.
+    With CLOUD_FILTER, cloudy items are skipped.
+    Parcels left without items are dropped in both cases.
+    """
+    parcels_items = sentinel.search_parcels(parcels)
+    if storage is not None:
+        parcels_items = skip_stored(parcels, parcels_items, storage)
+    for parcel, items in zip(parcels, parcels_items):
+        parcel.sentinel_items = items
+    if CLOUD_FILTER:
+        clouds.filter_cloud_cover(parcels)
     for parcel in parcels:
-        parcel.sentinel_items = sentinel.search_polygon(parcel.polygon)[
-            :ASSETS_LIMIT
-        ]
+        parcel.sentinel_items = parcel.sentinel_items[:ASSETS_LIMIT]
+
+    log.debug("Projecting parcels")
+    projection.project_parcels(parcels)
+
+    if CLOUD_FILTER:
+        # SCL windows are read once projected, before any other band
+        clouds.filter_valid_fraction(parcels)
+    if storage is not None or CLOUD_FILTER:
+        parcels = [parcel for parcel in parcels if parcel.sentinel_items]
 
     return parcels
 
 
+def skip_stored(
+    parcels: list[csv.Parcel],
+    parcels_items: list[ItemCollection],
+    storage: common.AbstractParcelStorage,
+) -> list[ItemCollection]:
+    """
+    Keep only the items of parcels not yet stored.
+    """
+    stored = storage.stored_datetimes([parcel.id for parcel in parcels])
+    new_items = [
+        ItemCollection(
+            item
+            for item in items
+            if common.item_datetime(item) not in stored.get(parcel.id, set())
+        )
+        for parcel, items in zip(parcels, parcels_items)
+    ]
+    log.info(
+        "Skipping %d stored items",
+        sum(map(len, parcels_items)) - sum(map(len, new_items)),
+    )
+    return new_items
+
+
 def process(parcels: list[csv.Parcel]) -> list[csv.Parcel]:
     """
     Process parcels to calculate NDVI and NDMI.
     """
-    log.info("Calculating NDVI and NDMI")
-    for parcel in parcels:
-        log.debug("Processing parcel %s", parcel.id)
-        if PROCESSING_METHOD == "manual":
-            parcel.timeseries = manual.process_parcel(parcel)
-        else:
-            parcel.timeseries = external.process_parcel(parcel).compute()
+    log.info("Calculating NDVI and NDMI (%s executor)", EXECUTOR)
+    timeseries: list[xarray.DataArray]
+    if PROCESSING_METHOD == "external" and EXECUTOR == "serial":
+        timeseries = external.process_parcels(parcels, BATCH_SIZE)
+    elif EXECUTOR == "serial":
+        timeseries = manual.process_parcels(parcels)
+    else:
+        timeseries = executor.map_parcels(
+            functools.partial(process_parcel, method=PROCESSING_METHOD),
+            parcels,
+            mode=EXECUTOR,
+            max_workers=MAX_WORKERS,
+        )
+    for parcel, parcel_timeseries in zip(parcels, timeseries):
+        parcel.timeseries = parcel_timeseries
+        if QUICKLOOKS:
+            parcel.quicklooks = quicklook.compute_quicklooks(parcel)
+    log.info("Mask cache : %s", mask.mask_cache.stats())
+    log.info("Grid cache : %s", images.grid_cache.stats())
+
+    if STATISTICS_PATH is not None:
+        log.info("Writing zonal statistics to %s", STATISTICS_PATH)
+        zonal.write_parquet(zonal.parcels_table(parcels), STATISTICS_PATH)
 
     return parcels
 
 
+def process_parcel(parcel: csv.Parcel, method: str) -> xarray.DataArray:
+    """
+    Process a single parcel with the provided method.
+    """
+    log.debug("Processing parcel %s", parcel.id)
+    if method == "manual":
+        return manual.process_parcel(parcel)
+    return external.process_parcel(parcel).compute()
+
+
 def store(parcels: list[csv.Parcel]):
     """
     Store parcels in the database.
     """
-    storage: common.AbstractParcelStorage
-    if DATABASE == "postgresql":
-        storage = postgresql.ParcelStorage()
-    elif DATABASE == "minio":
-        storage = minio.ParcelStorage()
-    elif DATABASE == "mongodb":
-        storage = mongodb.ParcelStorage()
-    else:
-        log.warning("No database selected. Skipping storage.")
+    storage = open_storage()
+    if storage is None:
         return
 
     log.info("Storing parcels")
-    for parcel in parcels:
-        log.debug("Storing parcel %s", parcel.id)
-        storage.store_parcel(parcel)
+    storage.store_parcels(parcels)
     log.info("Closing DB connection")
     storage.close()
 
 
+def open_storage() -> common.AbstractParcelStorage | None:
+    """
+    Open the selected database, if any.
+    """
+    if DATABASE == "postgresql":
+        return postgresql.ParcelStorage()
+    if DATABASE == "minio":
+        return minio.ParcelStorage()
+    if DATABASE == "mongodb":
+        return mongodb.ParcelStorage()
+    if DATABASE == "zarr":
+        return zarr.ParcelStorage()
+    if DATABASE == "zarr-minio":
+        return zarr.ParcelStorage(zarr.MINIO_ROOT, zarr.MINIO_STORAGE_OPTIONS)
+    log.warning("No database selected. Skipping storage.")
+    return None
+
+
+def stream() -> list[csv.Parcel]:
+    """
+    Stream parcels through extract, process and store.
+    Parcels are released once stored, except the ones kept for display.
+    """
+    storage = open_storage()
+    parcels: Iterable[csv.Parcel] = csv.iter_parcels(
+        PARCEL_FILES, PARCEL_IDS, PARCEL_CROPS, PARCEL_BBOX
+    )
+    if PARCEL_LIMIT >= 0:
+        parcels = itertools.islice(parcels, PARCEL_LIMIT)
+
+    log.info("Streaming parcels (%s executor)", EXECUTOR)
+    # Thread workers share the storage and write concurrently, other workers
+    # send their results back to be stored here
+    worker_storage = storage if EXECUTOR == "thread" else None
+    displayed: list[csv.Parcel] = []
+    statistics: list[pyarrow.Table] = []
+    for parcel in executor.imap_parcels(
+        functools.partial(
+            stream_parcel, method=PROCESSING_METHOD, storage=worker_storage
+        ),
+        search_stream(parcels, storage if INCREMENTAL else None),
+        mode=EXECUTOR,
+        max_workers=MAX_WORKERS,
+        max_in_flight=MAX_IN_FLIGHT,
+    ):
+        if storage is not None and worker_storage is None:
+            log.debug("Storing parcel %s", parcel.id)
+            storage.store_parcel(parcel)
+        if STATISTICS_PATH is not None and parcel.timeseries.ndim:
+            statistics.append(
+                zonal.to_table(parcel.id, zonal.parcel_statistics(parcel))
+            )
+        if len(displayed) < basic.PARCEL_LIMIT:
+            displayed.append(parcel)
+
+    if STATISTICS_PATH is not None and statistics:
+        log.info("Writing zonal statistics to %s", STATISTICS_PATH)
+        zonal.write_parquet(pyarrow.concat_tables(statistics), STATISTICS_PATH)
+    if storage is not None:
+        log.info("Closing DB connection")
+        storage.close()
+    return displayed
+
+
+def search_stream(
+    parcels: Iterable[csv.Parcel],
+    storage: common.AbstractParcelStorage | None = None,
+) -> Iterator[csv.Parcel]:
+    """
+    Search Sentinel-2 items of parcels by chunks.
+    Parcels are yielded one at a time as soon as their chunk has been
+    searched, and are no longer referenced here once yielded.
+    """
+    for chunk in itertools.batched(parcels, sentinel.SEARCH_CHUNK_SIZE):
+        searched = search(list(chunk), storage)
+        del chunk
+        searched.reverse()
+        while searched:
+            yield searched.pop()
+
+
+def stream_parcel(
+    parcel: csv.Parcel,
+    method: str,
+    storage: common.AbstractParcelStorage | None = None,
+) -> csv.Parcel:
+    """
+    Process a single parcel.
+    Return a copy of the parcel with its timeseries, the searched parcel
+    being left as is so that it does not keep the timeseries alive.
+    If storage is provided, the parcel is stored by the worker.
+    """
+    parcel = dataclasses.replace(
+        parcel,
+        timeseries=process_parcel(parcel, method),
+        quicklooks=(
+            quicklook.compute_quicklooks(parcel)
+            if QUICKLOOKS
+            else xarray.DataArray()
+        ),
+    )
+    if storage is not None:
+        log.debug("Storing parcel %s", parcel.id)
+        storage.store_parcel(parcel)
+    return parcel
+
+
 def display(parcels: list[csv.Parcel]):
     """
-    Display parcels.
+    Display parcels, or export their thumbnails.
     """
+    if THUMBNAILS_PATH is not None:
+        thumbnails.export_parcels(
+            iter_stored(parcels) if DISPLAY_SOURCE == "storage" else parcels,
+            THUMBNAILS_PATH,
+        )
+        return
+    if DISPLAY_SOURCE == "storage":
+        parcels = list(iter_stored(parcels[: basic.PARCEL_LIMIT]))
+    if not parcels:
+        log.warning("No parcel to display.")
+        return
     log.info("Displaying parcels")
     basic.display_parcels(parcels)
 
 
+def iter_stored(parcels: Iterable[csv.Parcel]) -> Iterator[csv.Parcel]:
+    """
+    Lazily read back the timeseries and quicklooks of parcels from the
+    database.
+    Parcels never stored are skipped, no imagery is read.
+    """
+    storage = open_storage()
+    if storage is None:
+        return
+    log.info("Reading parcels from %s", DATABASE)
+    try:
+        for parcel in parcels:
+            with metrics.timer("read", parcel.id):
+                timeseries = storage.read_timeseries(parcel.id)
+                quicklooks = storage.read_quicklooks(parcel.id)
+            if timeseries is None:
+                log.warning("Parcel %s is not stored", parcel.id)
+                continue
+            yield csv.Parcel(
+                parcel.id,
+                parcel.polygon,
+                timeseries=timeseries,
+                quicklooks=(
+                    quicklooks
+                    if quicklooks is not None
+                    else xarray.DataArray()
+                ),
+            )
+    finally:
+        # Closed as well when the generator is not fully consumed
+        storage.close()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+"""
+Module to record timings and sizes of the pipeline steps
+Steps record their duration, and optionally the parcel, item and bytes
+they handled, and are summarized or exported as JSON and CSV reports
+Steps are aggregated by name, only the last MAX_RECORDS records being kept
+for reports, so that memory stays bounded on long runs
+Steps run in worker processes (process and dask executors) are sent back
+with the results, see process.executor
+"""
+
+import contextlib
+import cProfile
+import csv
+import json
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Iterable, Iterator, NamedTuple
+
+from crops_growth_analysis.logger import log
+
+# Set to False to disable recording
+METRICS_ENABLED = True
+
+# Number of last records kept for JSON and CSV reports
+MAX_RECORDS = 10_000
+
+
+class Record(NamedTuple):
+    """A single recorded step"""
+
+    step: str
+    start: float
+    duration: float
+    parcel_id: str | None = None
+    item_id: str | None = None
+    nbytes: int | None = None
+    thread: str | None = None
+
+
+class Metrics:
+    """
+    Thread safe collection of recorded steps
+    Steps are aggregated by name (count, total, min and max duration, and
+    bytes), and the last MAX_RECORDS records are kept
+    """
+
+    def __init__(self):
+        self.steps: dict[str, dict[str, float]] = {}
+        self.records: deque[Record] = deque(maxlen=MAX_RECORDS)
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        step: str,
+        start: float,
+        duration: float,
+        parcel_id: str | None = None,
+        item_id: str | None = None,
+        nbytes: int | None = None,
+    ):
+        """Record a step which started at start, a perf_counter time"""
+        if not METRICS_ENABLED:
+            return
+        record = Record(
+            step,
+            start,
+            duration,
+            parcel_id,
+            item_id,
+            nbytes,
+            threading.current_thread().name,
+        )
+        with self.lock:
+            self.aggregate(step, 1, duration, duration, duration, nbytes or 0)
+            self.records.append(record)
+
+    def aggregate(
+        self,
+        step: str,
+        count: int,
+        total: float,
+        minimum: float,
+        maximum: float,
+        nbytes: int,
+    ):
+        """Add durations to the aggregate of a step, under lock"""
+        if step not in self.steps:
+            self.steps[step] = {
+                "count": 0,
+                "total": 0.0,
+                "min": minimum,
+                "max": maximum,
+                "nbytes": 0,
+            }
+        aggregate = self.steps[step]
+        aggregate["count"] += count
+        aggregate["total"] += total
+        aggregate["min"] = min(aggregate["min"], minimum)
+        aggregate["max"] = max(aggregate["max"], maximum)
+        aggregate["nbytes"] += nbytes
+
+    def drain(self) -> tuple[dict[str, dict[str, float]], list[Record]]:
+        """
+        Take the aggregates and records recorded so far, clearing them
+        Used by worker processes to send their metrics back
+        """
+        with self.lock:
+            steps, self.steps = self.steps, {}
+            records = list(self.records)
+            self.records.clear()
+        return steps, records
+
+    def merge(
+        self, steps: dict[str, dict[str, float]], records: Iterable[Record]
+    ):
+        """Merge aggregates and records drained from another process"""
+        with self.lock:
+            for step, aggregate in steps.items():
+                self.aggregate(
+                    step,
+                    int(aggregate["count"]),
+                    aggregate["total"],
+                    aggregate["min"],
+                    aggregate["max"],
+                    int(aggregate["nbytes"]),
+                )
+            self.records.extend(records)
+
+    @contextlib.contextmanager
+    def timer(
+        self,
+        step: str,
+        parcel_id: str | None = None,
+        item_id: str | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Record the duration of the block
+        The yielded dict may be given the handled bytes, as "nbytes", and is
+        given the duration once the block exits, as "duration"
+        """
+        fields: dict[str, Any] = {}
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            fields["duration"] = time.perf_counter() - start
+            self.record(
+                step,
+                start,
+                fields["duration"],
+                parcel_id,
+                item_id,
+                fields.get("nbytes"),
+            )
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Count, total, mean, min and max duration, and total bytes of each
+        step
+        """
+        with self.lock:
+            return {
+                step: {
+                    **aggregate,
+                    "mean": aggregate["total"] / aggregate["count"],
+                }
+                for step, aggregate in self.steps.items()
+            }
+
+    def log_summary(self):
+        """Log the summary of every step, and the peak memory"""
+        log.info("--- Metrics ---")
+        for step, summary in self.summary().items():
+            log.info(
+                "%s : %d calls, %.2fs total, %.4fs mean, %.4fs max, %s",
+                step,
+                summary["count"],
+                summary["total"],
+                summary["mean"],
+                summary["max"],
+                format_bytes(summary["nbytes"]),
+            )
+        log.info("Peak memory : %s", format_bytes(peak_rss()))
+
+    def to_json(self, path: str):
+        """Export the summary, peak memory and the last records as JSON"""
+        with self.lock:
+            records = [record._asdict() for record in self.records]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "summary": self.summary(),
+                    "peak_rss": peak_rss(),
+                    "records": records,
+                },
+                file,
+                indent=2,
+            )
+
+    def to_csv(self, path: str):
+        """Export the last records as CSV"""
+        with self.lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(Record._fields)
+            writer.writerows(records)
+
+    def clear(self):
+        """Remove every aggregate and record"""
+        with self.lock:
+            self.steps.clear()
+            self.records.clear()
+
+
+metrics = Metrics()
+
+
+def peak_rss() -> int:
+    """Peak resident memory of the process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_bytes(nbytes: float) -> str:
+    """Human readable size"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TiB"
+
+
+@contextlib.contextmanager
+def profile(path: str | None) -> Iterator[None]:
+    """
+    Profile the block with cProfile, and dump stats to path
+    Stats can be read with pstats or snakeviz. Does nothing if path is None
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        log.info("Profile written to %s", path)
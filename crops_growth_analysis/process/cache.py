@@ -0,0 +1,105 @@
+"""
+Module providing an in-process LRU cache for computed arrays
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def nbytes(value: Any) -> int:
+    """
+    Size of a cached value in bytes
+    Handles numpy arrays, xarray objects and tuples/lists of them
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(element) for element in value)
+    if isinstance(value, dict):
+        return sum(nbytes(element) for element in value.values())
+    return int(getattr(value, "nbytes", 0))
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the size in bytes of its values
+    Thread safe, keeps hit and miss counters
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get value from cache, or None if missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Put value in cache, evicting least recently used values if needed
+        Values bigger than the cache size are not stored
+        """
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get value from cache, or compute and store it if missing
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """
+        Clear cache values and counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Cache statistics
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,137 @@
+"""
+Module to skip cloudy items before reading their bands
+Items are first filtered by their STAC cloud cover, then by the fraction of
+valid pixels of the scene classification (SCL) over each parcel
+"""
+
+import asyncio
+import contextlib
+import functools
+
+from pystac import Item, ItemCollection
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.process import images, tiles
+from crops_growth_analysis.process.images import ItemImages
+
+# Maximum cloud cover of an item (eo:cloud_cover), in percent
+# Set to None to keep every item
+MAX_CLOUD_COVER: float | None = 80
+
+# Minimum fraction of valid pixels (SCL between 2 and 6) over a parcel
+# Set to None to skip SCL reads
+MIN_VALID_FRACTION: float | None = 0.5
+
+# Maximum number of items whose SCL is read at once, each keeping its merged
+# windows in memory
+ITEM_CONCURRENCY = 8
+
+
+def filter_cloud_cover(
+    parcels: list[Parcel], max_cloud_cover: float | None = MAX_CLOUD_COVER
+):
+    """
+    Drop items of parcels with a cloud cover above max_cloud_cover
+    Items without cloud cover are kept
+    """
+    if max_cloud_cover is None:
+        return
+    count = item_count(parcels)
+    for parcel in parcels:
+        parcel.sentinel_items = ItemCollection(
+            item
+            for item in parcel.sentinel_items
+            if item.properties.get("eo:cloud_cover", 0) <= max_cloud_cover
+        )
+    log.info("Skipping %d items by cloud cover", count - item_count(parcels))
+
+
+def valid_fraction(item_images: ItemImages) -> float:
+    """
+    Fraction of valid pixels over the parcel, from the SCL band only
+    Images should be loaded at 20 meters, the SCL resolution
+    """
+    scl = item_images.load("SCL", mask=True)
+    inside = int(scl.notnull().sum())
+    if not inside:
+        return 0.0
+    return int(((scl > 1) & (scl < 7)).sum()) / inside
+
+
+def filter_valid_fraction(
+    parcels: list[Parcel],
+    min_valid_fraction: float | None = MIN_VALID_FRACTION,
+):
+    """
+    Drop items of parcels with a valid fraction below min_valid_fraction
+    The SCL band of an item is read once for all its parcels
+    Processing reads SCL again, its windows and cache keys being different
+    """
+    if min_valid_fraction is None:
+        return
+    count = item_count(parcels)
+    fractions = asyncio.run(valid_fractions(parcels))
+    for parcel in parcels:
+        parcel.sentinel_items = ItemCollection(
+            item
+            for item in parcel.sentinel_items
+            if fractions[(parcel.id, item.id)] >= min_valid_fraction
+        )
+    log.info(
+        "Skipping %d items by valid fraction", count - item_count(parcels)
+    )
+
+
+async def valid_fractions(
+    parcels: list[Parcel],
+) -> dict[tuple[str, str], float]:
+    """
+    Valid fractions of parcels items, by parcel and item ids
+    SCL of ITEM_CONCURRENCY items is read at once, failed opens and reads
+    being retried
+    Parcels of an item are read one after the other, as they share the
+    opened band
+    """
+    load_semaphore = asyncio.Semaphore(images.LOAD_CONCURRENCY)
+    item_semaphore = asyncio.Semaphore(ITEM_CONCURRENCY)
+    fractions: dict[tuple[str, str], float] = {}
+
+    async def read(item: Item, item_parcels: list[Parcel]):
+        async with item_semaphore:
+            with contextlib.ExitStack() as stack:
+                sources = await images.retry(
+                    lambda: stack.enter_context(
+                        tiles.open_item(item, item_parcels, ["SCL"])
+                    ),
+                    f"SCL of {item.id}",
+                )
+                for parcel in item_parcels:
+                    fraction = await images.retry(
+                        functools.partial(
+                            valid_fraction,
+                            ItemImages(item, parcel, sources, resolution=20),
+                        ),
+                        f"SCL of {item.id}",
+                        load_semaphore,
+                    )
+                    log.debug(
+                        "Parcel %s item %s valid fraction %.2f",
+                        parcel.id,
+                        item.id,
+                        fraction,
+                    )
+                    fractions[(parcel.id, item.id)] = fraction
+
+    await asyncio.gather(
+        *(
+            read(item, item_parcels)
+            for item, item_parcels in tiles.group_by_item(parcels).values()
+        )
+    )
+    return fractions
+
+
+def item_count(parcels: list[Parcel]) -> int:
+    """Number of items of parcels"""
+    return sum(len(parcel.sentinel_items) for parcel in parcels)
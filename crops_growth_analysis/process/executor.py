@@ -0,0 +1,193 @@
+"""
+Module to fan parcels processing out across workers
+"""
+
+import functools
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+
+# Available executor modes
+EXECUTORS = ("serial", "thread", "process", "dask")
+
+
+def worker_name() -> str:
+    """Name of the current worker, unique across processes and threads"""
+    return f"{os.getpid()}-{threading.current_thread().name}"
+
+
+def timed_call(
+    func: Callable[[Parcel], Any], parcel: Parcel, remote: bool = False
+) -> tuple[str, float, Any, Any]:
+    """
+    Call func on parcel
+    Return the worker name, the elapsed time, the result, and if remote
+    (in a worker process) the metrics recorded by the worker
+    """
+    start_time = time.perf_counter()
+    result = func(parcel)
+    elapsed = time.perf_counter() - start_time
+    metrics.record("parcel", start_time, elapsed, parcel.id)
+    return worker_name(), elapsed, result, metrics.drain() if remote else None
+
+
+def collect(
+    call_result: tuple[str, float, Any, Any],
+    timings: list[tuple[str, float]],
+) -> Any:
+    """
+    Add the timing of a call to timings, merge its worker metrics if any
+    Return the result of the call
+    """
+    name, elapsed, result, worker_metrics = call_result
+    timings.append((name, elapsed))
+    if worker_metrics is not None:
+        metrics.merge(*worker_metrics)
+    return result
+
+
+def map_parcels(
+    func: Callable[[Parcel], Any],
+    parcels: Iterable[Parcel],
+    mode: str = "serial",
+    max_workers: int | None = None,
+) -> list[Any]:
+    """
+    Apply func on every parcel with the selected executor mode
+    One of "serial", "thread", "process" or "dask" (distributed LocalCluster)
+    Results are returned in the same order as parcels
+    max_workers bounds the number of parcels processed concurrently
+    For "process" and "dask", func and parcels must be picklable
+    """
+    return list(imap_parcels(func, parcels, mode, max_workers))
+
+
+def imap_parcels(
+    func: Callable[[Parcel], Any],
+    parcels: Iterable[Parcel],
+    mode: str = "serial",
+    max_workers: int | None = None,
+    max_in_flight: int | None = None,
+) -> Iterator[Any]:
+    """
+    Lazily apply func on every parcel with the selected executor mode
+    Results are yielded in the same order as parcels, as soon as available
+    At most max_in_flight parcels are submitted and not yet yielded, so
+    parcels are only pulled from the iterable when needed
+    """
+    if mode not in EXECUTORS:
+        raise ValueError(
+            f"Unknown executor {mode}, expected one of {EXECUTORS}"
+        )
+    call = functools.partial(
+        timed_call, func, remote=mode in ("process", "dask")
+    )
+    start_time = time.perf_counter()
+    timings: list[tuple[str, float]] = []
+    if mode == "serial":
+        for parcel in parcels:
+            yield collect(call(parcel), timings)
+    else:
+        # Shut down in finally, as the generator may be closed while parcels
+        # are in flight: pending parcels are cancelled instead of processed
+        executor = pool(mode, max_workers)
+        try:
+            in_flight: deque = deque()
+            for parcel in parcels:
+                in_flight.append(executor.submit(call, parcel))
+                if (
+                    max_in_flight is not None
+                    and len(in_flight) >= max_in_flight
+                ):
+                    yield collect(in_flight.popleft().result(), timings)
+            while in_flight:
+                yield collect(in_flight.popleft().result(), timings)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    log_throughput(timings, time.perf_counter() - start_time)
+
+
+def pool(mode: str, max_workers: int | None = None) -> Any:
+    """
+    Start a pool of workers, providing submit(fn, *args) and
+    shutdown(cancel_futures) methods
+    """
+    if mode == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if mode == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return DaskPool(max_workers)
+
+
+class DaskPool:
+    """
+    Dask distributed client on a LocalCluster, submitting impure tasks like
+    an executor
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        # pylint: disable=import-outside-toplevel
+        from dask.distributed import Client, LocalCluster
+
+        # One single threaded worker process per core (or max_workers)
+        self.cluster = LocalCluster(
+            n_workers=max_workers, threads_per_worker=1, processes=True
+        )
+        self.client = Client(self.cluster)
+        # Futures not released yet, to wait for or cancel on shutdown
+        self.futures: weakref.WeakSet = weakref.WeakSet()
+
+    def submit(self, fn: Callable, *args: Any) -> Any:
+        """Submit fn(*args), returning a future"""
+        future = self.client.submit(fn, *args, pure=False)
+        self.futures.add(future)
+        return future
+
+    def shutdown(self, cancel_futures: bool = False):
+        """
+        Close the client and the cluster, once submitted tasks are done, or
+        cancelled with cancel_futures
+        """
+        # pylint: disable=import-outside-toplevel
+        from dask.distributed import wait
+
+        futures = list(self.futures)
+        if cancel_futures:
+            self.client.cancel(futures)
+        else:
+            wait(futures)
+        self.client.close()
+        self.cluster.close()
+
+
+def log_throughput(timings: list[tuple[str, float]], overall_time: float):
+    """
+    Log the number of parcels and the throughput of every worker
+    """
+    workers: dict[str, list[float]] = defaultdict(list)
+    for name, elapsed in timings:
+        workers[name].append(elapsed)
+    for name, times in sorted(workers.items()):
+        busy_time = sum(times)
+        log.info(
+            "Worker %s : %d parcels in %.2fs (%.2f parcels/s)",
+            name,
+            len(times),
+            busy_time,
+            len(times) / busy_time if busy_time else 0,
+        )
+    log.info(
+        "%d parcels on %d workers in %.2fs (%.2f parcels/s)",
+        len(timings),
+        len(workers),
+        overall_time,
+        len(timings) / overall_time if overall_time else 0,
+    )
@@ -1,12 +1,16 @@
 """Module to calculate NDVI and NDMI from Sentinel-2 data"""
 
-import numpy
+import itertools
+
+import dask
 import stackstac
 import xarray
-from shapely.geometry import Point
 
+from crops_growth_analysis import projection
 from crops_growth_analysis.extract import csv
 from crops_growth_analysis.logger import log
+from crops_growth_analysis.process import tile_cache
+from crops_growth_analysis.process.mask import mask_bands
 
 
 def process_parcel(parcel: csv.Parcel) -> xarray.DataArray:
@@ -16,7 +20,8 @@ def process_parcel(parcel: csv.Parcel) -> xarray.DataArray:
         parcel.sentinel_items,
         assets=["B04", "B08", "B11", "SCL"],
         bounds=parcel.polygon.bounds,
-        epsg=2154,
+        epsg=projection.PARCEL_EPSG,
+        reader=tile_cache.CachedRioReader,
     )
     bands = mask_parcel(parcel, bands)
     scl = bands.sel(band="SCL")
@@ -34,14 +39,29 @@ def process_parcel(parcel: csv.Parcel) -> xarray.DataArray:
     )
 
 
+def process_parcels(
+    parcels: list[csv.Parcel], batch_size: int | None = None
+) -> list[xarray.DataArray]:
+    """
+    Process parcels using stackstac, computing all parcel graphs at once
+    Graphs are evaluated together in a single dask.compute call, so reads
+    and calculations of different parcels run concurrently
+    If batch_size is provided, parcels are computed by batches of that size
+    """
+    batch_size = batch_size or max(len(parcels), 1)
+    results: list[xarray.DataArray] = []
+    for batch in itertools.batched(parcels, batch_size):
+        log.debug("Building graphs of %d parcels", len(batch))
+        graphs = [process_parcel(parcel) for parcel in batch]
+        log.debug("Computing graphs of %d parcels", len(batch))
+        results.extend(dask.compute(*graphs))
+    return results
+
+
 def mask_parcel(
     parcel: csv.Parcel, bands: xarray.DataArray
 ) -> xarray.DataArray:
-    """Mask bands with parcel"""
-    mask = xarray.apply_ufunc(
-        numpy.vectorize(lambda x, y: parcel.polygon.contains(Point(x, y))),
-        bands["x"],
-        bands["y"],
-        vectorize=True,
+    """Mask bands with parcel, masks are cached by parcel and grid"""
+    return mask_bands(
+        parcel.polygon, bands, key=(parcel.id, projection.PARCEL_EPSG)
     )
-    return bands.where(mask)
@@ -2,97 +2,253 @@
 Module to load images from Sentinel-2 data
 """
 
+import asyncio
+import contextlib
+import functools
+from typing import Any, Callable, Mapping, TypeVar
+
 import numpy
 import rasterio
 import rasterio.mask
-import shapely.ops
 import xarray
 from PIL import Image
-from pyproj import CRS, Transformer
 from pystac import Item
-from shapely.geometry import Point, Polygon
+from rasterio.errors import RasterioIOError
+from rasterio.windows import Window
+from shapely.geometry import Polygon
 
+from crops_growth_analysis import projection
+from crops_growth_analysis.extract.csv import Parcel
 from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.process import tile_cache
+from crops_growth_analysis.process.cache import LRUCache
+from crops_growth_analysis.process.mask import mask_bands
 
 Image.MAX_IMAGE_PIXELS = None
 
+T = TypeVar("T")
+
+# Size of the coordinates grid cache, in bytes
+GRID_CACHE_SIZE = 64 * 1024**2
+
+grid_cache = LRUCache(GRID_CACHE_SIZE)
+
+# Resolution of loaded images, in meters, 10 or 20
+# Bands of other resolutions are resampled by nearest neighbour, repeating
+# or striding pixels
+RESOLUTION = 10
+
+# Windows are snapped to this size, in meters, so that windows of every band
+# resolution (10, 20 and 60 meters) cover the same extent
+WINDOW_SNAP = 60
+
+# Maximum number of band windows read concurrently by asynchronous loads
+LOAD_CONCURRENCY = 16
+
+# Number of retries of a failed read, and initial backoff delay in seconds
+# The delay doubles after every failed attempt
+LOAD_RETRIES = 3
+LOAD_BACKOFF = 1.0
+
 
 class ItemImages:
     """Class to load images from a Sentinel-2 item"""
 
-    def __init__(self, item: Item, parcel: Polygon):
+    def __init__(
+        self,
+        item: Item,
+        parcel: Parcel,
+        sources: Mapping[str, Any] | None = None,
+        resolution: int = RESOLUTION,
+    ):
+        """
+        sources may provide already opened datasets by band name, sharing
+        reads between parcels (see tiles.open_item)
+        resolution is the resolution of loaded images, in meters
+        """
         self.item: Item = item
-        self.parcel: Polygon = parcel
+        self.parcel: Parcel = parcel
+        self.epsg: int = self.item.properties["proj:epsg"]
+        self.sources: Mapping[str, Any] = sources or {}
+        self.resolution: int = resolution
 
-    def load(
-        self,
-        band: str,
-        interp_like: xarray.DataArray = None,
-        mask: bool = False,
-    ) -> xarray.DataArray:
+    def load(self, band: str, mask: bool = False) -> xarray.DataArray:
         """
-        Get image from sentinel data
-        If interp_like is provided, the image will be interpolated to match the
-        resolution of interp_like
+        Get image from sentinel data, on the grid of the item images
+        Every band is resampled to the resolution of the item images, so
+        images of all bands share the same grid
         If mask is True, the image will be masked with the parcel polygon
         """
-        url = self.item.assets[band].href
         log.debug("Loading and Reading image")
         src: rasterio.DatasetReader
-        with rasterio.open(url) as src:
-            # log.debug("Reading image")
-            proj_parcel = self.project_polygon(self.parcel)
-            window = (
-                src.window(*proj_parcel.bounds).round_lengths().round_offsets()
-            )
+        with self.open(band) as src, metrics.timer(
+            f"band_read.{band}", self.parcel.id, self.item.id
+        ) as timing:
+            window = self.window(src)
             image_array = src.read(1, window=window)
-            bounds = self.project_bounds(src.window_bounds(window))
-            new_coords = {
-                "y": numpy.linspace(bounds[3], bounds[1], window.height),
-                "x": numpy.linspace(bounds[0], bounds[2], window.width),
-            }
+            timing["nbytes"] = image_array.nbytes
+            image_array = resample(
+                image_array, round(src.res[0]) / self.resolution
+            )
+            y, x = self.grid(src, window, image_array.shape)
             data_array = xarray.DataArray(
                 image_array,
                 dims=["y", "x"],
-                coords=new_coords,
+                coords={"y": y, "x": x},
                 name=band,
             )
-            if interp_like is not None:
-                data_array = data_array.interp_like(
-                    interp_like, method="nearest"
-                )
             if mask:
                 data_array = self.mask(data_array)
         return data_array
 
-    def project_polygon(self, parcel: Polygon) -> Polygon:
-        """Project parcel to image CRS"""
-        return shapely.ops.transform(
-            Transformer.from_crs(
-                CRS("EPSG:2154"),
-                CRS(f"EPSG:{self.item.properties['proj:epsg']}"),
-                always_xy=True,
-            ).transform,
-            parcel,
+    def open(self, band: str) -> contextlib.AbstractContextManager:
+        """
+        Open band dataset, or use the shared one if provided
+        Windows are read through the local tile cache
+        """
+        if band in self.sources:
+            return contextlib.nullcontext(self.sources[band])
+        return tile_cache.open_band(self.item.assets[band].href)
+
+    def window(self, src: rasterio.DatasetReader) -> Window:
+        """
+        Get parcel window in band dataset
+        The window is snapped to WINDOW_SNAP meters, so that windows of all
+        bands cover the same extent
+        """
+        proj_parcel = self.project_polygon(self.parcel.polygon)
+        window = src.window(*proj_parcel.bounds)
+        snap = max(round(WINDOW_SNAP / src.res[0]), 1)
+        col_start = numpy.floor(window.col_off / snap) * snap
+        row_start = numpy.floor(window.row_off / snap) * snap
+        col_stop = numpy.ceil((window.col_off + window.width) / snap) * snap
+        row_stop = numpy.ceil((window.row_off + window.height) / snap) * snap
+        return Window(
+            int(col_start),
+            int(row_start),
+            int(col_stop - col_start),
+            int(row_stop - row_start),
         )
 
+    def grid(
+        self,
+        src: rasterio.DatasetReader,
+        window: Window,
+        shape: tuple[int, int],
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Get pixel coordinates (y, x) in parcel CRS of window, read with shape
+        Grids are cached by image CRS, window bounds and shape
+        """
+
+        def compute_grid() -> tuple[numpy.ndarray, numpy.ndarray]:
+            bounds = self.project_bounds(src.window_bounds(window))
+            return (
+                numpy.linspace(bounds[3], bounds[1], shape[0]),
+                numpy.linspace(bounds[0], bounds[2], shape[1]),
+            )
+
+        key = (self.epsg, src.window_bounds(window), shape)
+        return grid_cache.get_or_compute(key, compute_grid)
+
+    def project_polygon(self, parcel: Polygon) -> Polygon:
+        """
+        Project parcel to image CRS
+        Use the projection computed at extract time if available
+        """
+        if (
+            parcel is self.parcel.polygon
+            and self.epsg in self.parcel.projections
+        ):
+            return self.parcel.projections[self.epsg]
+        return projection.project(parcel, projection.PARCEL_EPSG, self.epsg)
+
     def project_bounds(
         self, bounds: tuple[float, float, float, float]
     ) -> tuple[float, float, float, float]:
         """Project image CRS bounds to parcel CRS"""
-        transformer = Transformer.from_crs(
-            CRS(f"EPSG:{self.item.properties['proj:epsg']}"),
-            CRS("EPSG:2154"),
-            always_xy=True,
-        )
-        return transformer.transform_bounds(*bounds)
+        return projection.get_transformer(
+            self.epsg, projection.PARCEL_EPSG
+        ).transform_bounds(*bounds)
 
     def mask(self, bands: xarray.DataArray) -> xarray.DataArray:
-        """Mask bands with parcel"""
-        mask = xarray.apply_ufunc(
-            numpy.vectorize(lambda x, y: self.parcel.contains(Point(x, y))),
-            bands["x"],
-            bands["y"],
-            vectorize=True,
-        )
-        return bands.where(mask)
+        """Mask bands with parcel, masks are cached by parcel and grid"""
+        with metrics.timer("mask", self.parcel.id, self.item.id):
+            return mask_bands(
+                self.parcel.polygon, bands, key=(self.parcel.id, self.epsg)
+            )
+
+
+def resample(array: numpy.ndarray, factor: float) -> numpy.ndarray:
+    """
+    Resample an image by an integer factor (or its inverse), by nearest
+    neighbour without interpolation
+    Pixels are repeated if factor > 1, and strided if factor < 1
+    """
+    if factor > 1:
+        repeat = round(factor)
+        return array.repeat(repeat, axis=0).repeat(repeat, axis=1)
+    if factor < 1:
+        stride = round(1 / factor)
+        start = stride // 2
+        return array[slice(start, None, stride), slice(start, None, stride)]
+    return array
+
+
+async def load_async(
+    images: ItemImages,
+    band: str,
+    semaphore: asyncio.Semaphore,
+    **kwargs: Any,
+) -> xarray.DataArray:
+    """
+    Load image in a thread, at most semaphore reads at once
+    Failed reads are retried with an exponential backoff
+    """
+    return await retry(
+        functools.partial(images.load, band, **kwargs),
+        f"{band} of {images.item.id}",
+        semaphore,
+    )
+
+
+async def retry(
+    func: Callable[[], T],
+    name: str,
+    semaphore: asyncio.Semaphore | None = None,
+) -> T:
+    """
+    Call func in a thread, at most semaphore calls at once
+    Failed reads and opens are retried LOAD_RETRIES times, with an
+    exponential backoff
+    """
+    attempt = 0
+    while True:
+        try:
+            async with semaphore or contextlib.nullcontext():
+                return await asyncio.to_thread(func)
+        except RasterioIOError as error:
+            if attempt >= LOAD_RETRIES:
+                raise
+            delay = LOAD_BACKOFF * 2**attempt
+            attempt += 1
+            log.warning(
+                "Failed to read %s, retrying in %.1fs: %s",
+                name,
+                delay,
+                error,
+            )
+            await asyncio.sleep(delay)
+
+
+async def load_bands(
+    images: ItemImages, bands: list[str], semaphore: asyncio.Semaphore
+) -> dict[str, xarray.DataArray]:
+    """
+    Load all bands of an item concurrently
+    """
+    arrays = await asyncio.gather(
+        *(load_async(images, band, semaphore) for band in bands)
+    )
+    return dict(zip(bands, arrays))
@@ -1,46 +1,156 @@
 """Module to calculate NDVI and NDMI from Sentinel-2 data"""
 
+import asyncio
+import contextlib
+
 import numpy
 import xarray
+from pystac import Item
 
 from crops_growth_analysis.extract import csv
 from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.process import images, tiles
 from crops_growth_analysis.process.images import ItemImages
 
+# Bands needed to calculate NDVI and NDMI
+BANDS = ["B04", "B08", "B11", "SCL"]
+
+# Maximum number of items processed at once by the grouped method, each
+# keeping its merged windows in memory
+ITEM_CONCURRENCY = 4
+
 
 def process_parcel(parcel: csv.Parcel) -> xarray.DataArray:
     """
     Process a parcel. Calculate NDVI and NDMI from each time of the parcel.
+    Bands of every item are loaded concurrently.
+    """
+    return asyncio.run(process_parcel_async(parcel))
+
+
+async def process_parcel_async(parcel: csv.Parcel) -> xarray.DataArray:
+    """
+    Process a parcel, loading bands of all items concurrently.
+    NDVI and NDMI of an item are calculated as soon as its bands are loaded.
+    """
+    semaphore = asyncio.Semaphore(images.LOAD_CONCURRENCY)
+
+    async def process(item: Item) -> xarray.DataArray:
+        item_images = ItemImages(item, parcel)
+        bands = await images.load_bands(item_images, BANDS, semaphore)
+        return calculate_indexes(item_images, bands)
+
+    data_arrays = await asyncio.gather(
+        *(process(item) for item in parcel.sentinel_items)
+    )
+    return concat_items(parcel, list(data_arrays))
+
+
+def process_parcels(parcels: list[csv.Parcel]) -> list[xarray.DataArray]:
+    """
+    Process parcels, grouped by Sentinel-2 item.
+    Every band of an item is read once for all the parcels intersecting it.
+    """
+    return asyncio.run(process_parcels_async(parcels))
+
+
+async def process_parcels_async(
+    parcels: list[csv.Parcel],
+) -> list[xarray.DataArray]:
+    """
+    Process parcels grouped by item, ITEM_CONCURRENCY items at once.
+    Bands of a parcel are loaded concurrently, failed opens and reads being
+    retried.
+    Parcels of an item are processed one after the other, as they share the
+    opened bands.
     """
-    data_arrays: list[xarray.DataArray] = []
-    for item in parcel.sentinel_items:
-        images = ItemImages(item, parcel.polygon)
-        log.debug("Loading SCL and NIR")
-        nir = images.load("B08")
-        scl = images.load("SCL", interp_like=nir, mask=True)
+    load_semaphore = asyncio.Semaphore(images.LOAD_CONCURRENCY)
+    item_semaphore = asyncio.Semaphore(ITEM_CONCURRENCY)
+    results: dict[tuple[str, str], xarray.DataArray] = {}
+
+    async def process(item: Item, item_parcels: list[csv.Parcel]):
+        async with item_semaphore:
+            log.debug(
+                "Processing item %s for %d parcels",
+                item.id,
+                len(item_parcels),
+            )
+            with contextlib.ExitStack() as stack:
+                # Opens are retried like reads, opening remote bands being
+                # the most common transient failure
+                sources = await images.retry(
+                    lambda: stack.enter_context(
+                        tiles.open_item(item, item_parcels, BANDS)
+                    ),
+                    f"bands of {item.id}",
+                )
+                for parcel in item_parcels:
+                    item_images = ItemImages(item, parcel, sources)
+                    bands = await images.load_bands(
+                        item_images, BANDS, load_semaphore
+                    )
+                    results[(parcel.id, item.id)] = calculate_indexes(
+                        item_images, bands
+                    )
+
+    await asyncio.gather(
+        *(
+            process(item, item_parcels)
+            for item, item_parcels in tiles.group_by_item(parcels).values()
+        )
+    )
+    return [
+        concat_items(
+            parcel,
+            [results[(parcel.id, item.id)] for item in parcel.sentinel_items],
+        )
+        for parcel in parcels
+    ]
+
+
+def calculate_indexes(
+    item_images: ItemImages, bands: dict[str, xarray.DataArray]
+) -> xarray.DataArray:
+    """
+    Calculate NDVI and NDMI of a parcel from already loaded bands.
+    """
+    nir = bands["B08"]
+    scl = item_images.mask(bands["SCL"])
+    with metrics.timer("indexes", item_images.parcel.id, item_images.item.id):
         nir = nir.where(scl < 7).where(scl > 1)
-        del scl
         log.debug("Calculating NDVI")
-        red = images.load("B04")
+        red = bands["B04"]
         ndvi = (nir - red) / (nir + red)
-        del red
         log.debug("Calculating NDMI")
-        swir = images.load("B11", interp_like=nir)
+        swir = bands["B11"]
         ndmi = (nir - swir) / (nir + swir)
-        del swir
-        del nir
-        data_arrays.append(
-            xarray.DataArray(
-                data=[ndvi, ndmi],
-                dims=["index_type", "y", "x"],
-                coords={
-                    "index_type": ["ndvi", "ndmi"],
-                    "y": ndvi.y,
-                    "x": ndvi.x,
-                },
-            )
-        )
-        del ndvi, ndmi
+        return stack_indexes(ndvi, ndmi)
+
+
+def stack_indexes(
+    ndvi: xarray.DataArray, ndmi: xarray.DataArray
+) -> xarray.DataArray:
+    """
+    Stack NDVI and NDMI along the index_type dimension.
+    """
+    return xarray.DataArray(
+        data=[ndvi, ndmi],
+        dims=["index_type", "y", "x"],
+        coords={
+            "index_type": ["ndvi", "ndmi"],
+            "y": ndvi.y,
+            "x": ndvi.x,
+        },
+    )
+
+
+def concat_items(
+    parcel: csv.Parcel, data_arrays: list[xarray.DataArray]
+) -> xarray.DataArray:
+    """
+    Concatenate items results of a parcel along time.
+    """
     log.debug("Concatenating results")
     return xarray.concat(data_arrays, dim="time").assign_coords(
         time=[
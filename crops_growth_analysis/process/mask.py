@@ -0,0 +1,81 @@
+"""
+Module to compute parcel masks on raster grids
+"""
+
+from typing import Hashable
+
+import numpy
+import shapely
+import xarray
+from shapely import Polygon
+
+from crops_growth_analysis.process.cache import LRUCache
+
+# Size of the mask cache, in bytes
+MASK_CACHE_SIZE = 256 * 1024**2
+
+mask_cache = LRUCache(MASK_CACHE_SIZE)
+
+
+def grid_key(x: numpy.ndarray, y: numpy.ndarray) -> tuple:
+    """
+    Key identifying a regular grid, equivalent to its transform and shape
+    Empty grids (e.g. a parcel on a tile edge) only have a shape
+    """
+    if not x.size or not y.size:
+        return (len(x), len(y))
+    return (
+        float(x[0]),
+        float(x[-1]),
+        len(x),
+        float(y[0]),
+        float(y[-1]),
+        len(y),
+    )
+
+
+def polygon_mask(
+    polygon: Polygon, x: numpy.ndarray, y: numpy.ndarray
+) -> numpy.ndarray:
+    """
+    Rasterize polygon on the grid defined by x and y pixel coordinates
+    Return a boolean array of shape (len(y), len(x)), True inside polygon
+    """
+    shapely.prepare(polygon)
+    grid_x, grid_y = numpy.meshgrid(x, y)
+    return shapely.contains_xy(polygon, grid_x, grid_y)
+
+
+def cached_polygon_mask(
+    key: Hashable, polygon: Polygon, x: numpy.ndarray, y: numpy.ndarray
+) -> numpy.ndarray:
+    """
+    Rasterize polygon on the grid, reusing a previous result if any
+    key identifies the polygon and its CRS, e.g. (parcel id, epsg)
+    """
+    return mask_cache.get_or_compute(
+        (key, grid_key(x, y)), lambda: polygon_mask(polygon, x, y)
+    )
+
+
+def mask_bands(
+    polygon: Polygon, bands: xarray.DataArray, key: Hashable = None
+) -> xarray.DataArray:
+    """
+    Mask bands with polygon
+    Mask is computed once on the x/y grid and broadcast on other dimensions
+    (time, band, ...)
+    If key is provided, the mask is cached for later calls on the same grid
+    """
+    x = bands["x"].values
+    y = bands["y"].values
+    mask = xarray.DataArray(
+        (
+            polygon_mask(polygon, x, y)
+            if key is None
+            else cached_polygon_mask(key, polygon, x, y)
+        ),
+        dims=["y", "x"],
+        coords={"y": bands["y"], "x": bands["x"]},
+    )
+    return bands.where(mask)
@@ -0,0 +1,44 @@
+"""
+Module to compute RGB quicklooks of parcels, at process time
+Quicklooks are downsampled true color images, stored with the indexes so
+that parcels can be displayed without reading imagery again
+"""
+
+import stackstac
+import xarray
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.process import tile_cache
+
+# Resolution of quicklooks, in meters
+QUICKLOOK_RESOLUTION = 20
+
+# Reflectance scale of Sentinel-2 L2A bands
+REFLECTANCE_SCALE = 0.0001
+
+
+def compute_quicklooks(parcel: Parcel) -> xarray.DataArray:
+    """
+    Compute the RGB quicklooks of a parcel, at every item time
+    Return an uint8 array of dims (time, y, x, band)
+    """
+    rgb = stackstac.stack(
+        parcel.sentinel_items,
+        assets=["B04", "B03", "B02"],
+        bounds=parcel.polygon.bounds,
+        epsg=2154,
+        resolution=QUICKLOOK_RESOLUTION,
+        reader=tile_cache.CachedRioReader,
+    )
+    rgb = ((rgb * REFLECTANCE_SCALE).clip(0, 1).fillna(0) * 255).astype(
+        "uint8"
+    )
+    with metrics.timer("quicklook", parcel.id) as timing:
+        quicklooks = (
+            rgb.transpose("time", "y", "x", "band")
+            .reset_coords(drop=True)
+            .compute()
+        )
+        timing["nbytes"] = quicklooks.nbytes
+    return quicklooks
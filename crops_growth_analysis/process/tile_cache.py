@@ -0,0 +1,312 @@
+"""
+Module to cache raster windows read from Sentinel-2 assets on local disk
+Windows are stored as compressed numpy arrays, keyed by asset href (without
+SAS token), window and output shape, and evicted by least recent use once
+the cache exceeds its byte budget
+Band headers are cached as well, so that bands are only opened to read
+missing windows, and count in the byte budget like windows
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy
+import rasterio
+import rasterio.windows
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from stackstac.rio_reader import AutoParallelRioReader
+
+from crops_growth_analysis.extract.cache import unsigned_href
+from crops_growth_analysis.logger import log
+
+# Directory of the tile cache
+CACHE_DIR = Path(os.environ.get("TILE_CACHE_DIR", ".cache/tiles"))
+
+# Maximum size of the tile cache, in bytes
+CACHE_SIZE = 2 * 1024**3
+
+# Fraction of CACHE_SIZE the cache is brought down to by eviction, so that
+# the cache is not scanned again on every save
+CACHE_LOW_WATER = 0.9
+
+# Set to False to disable the tile cache
+CACHE_ENABLED = True
+
+_lock = threading.Lock()
+_size: int | None = None
+_headers: dict[str, dict[str, Any]] = {}
+
+
+def window_key(href: str, window: Window, *extra: Any) -> str:
+    """
+    Key of a window read, hash of the unsigned href, the window and any
+    extra read parameter (output shape, resampling, ...)
+    """
+    window_tuple = (
+        int(window.col_off),
+        int(window.row_off),
+        int(window.width),
+        int(window.height),
+    )
+    return hashlib.sha256(
+        f"{unsigned_href(href)}|{window_tuple}|{extra}".encode()
+    ).hexdigest()
+
+
+def cache_path(key: str) -> Path:
+    """Path of a cached window"""
+    return CACHE_DIR / key[:2] / f"{key}.npz"
+
+
+def header_path(href: str) -> Path:
+    """Path of a cached band header"""
+    key = hashlib.sha256(unsigned_href(href).encode()).hexdigest()
+    return CACHE_DIR / "headers" / f"{key}.json"
+
+
+def temp_path(path: Path) -> Path:
+    """Temporary path of a file written then renamed to path"""
+    return path.with_name(
+        f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+
+
+def cached_files() -> Iterator[Path]:
+    """Cached windows and band headers"""
+    yield from CACHE_DIR.glob("*/*.npz")
+    yield from CACHE_DIR.glob("headers/*.json")
+
+
+def cache_size() -> int:
+    """
+    Size of the cache in bytes, computed once then kept up to date
+    Must be called under lock
+    """
+    global _size  # pylint: disable=global-statement
+    if _size is None:
+        _size = sum(path.stat().st_size for path in cached_files())
+    return _size
+
+
+def load(key: str) -> numpy.ndarray | None:
+    """
+    Load a cached window, or None if missing
+    Access time is updated for least recently used eviction
+    """
+    path = cache_path(key)
+    try:
+        with numpy.load(path) as npz:
+            array = npz["data"]
+        os.utime(path)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    return array
+
+
+def save(key: str, array: numpy.ndarray):
+    """
+    Save a window in cache, then evict old files if over budget
+    """
+    path = cache_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temp_path(path)
+    with open(tmp_path, "wb") as file:
+        numpy.savez_compressed(file, data=array)
+    commit(tmp_path, path)
+
+
+def commit(tmp_path: Path, path: Path):
+    """
+    Rename a written file to its cache path, counting its size once, then
+    evict old files if over budget
+    Files are written then renamed, so concurrent readers never see partial
+    files
+    """
+    global _size  # pylint: disable=global-statement
+    added = tmp_path.stat().st_size
+    with _lock:
+        # Size the cache before adding the file, so it is counted once
+        size = cache_size()
+        with contextlib.suppress(FileNotFoundError):
+            # A file saved concurrently is replaced, not added
+            added -= path.stat().st_size
+        tmp_path.replace(path)
+        _size = size + added
+        if _size > CACHE_SIZE:
+            evict()
+
+
+def evict():
+    """
+    Remove least recently used windows and headers until the cache is under
+    its low water mark
+    Must be called under lock
+    """
+    global _size  # pylint: disable=global-statement
+    files = []
+    for path in cached_files():
+        with contextlib.suppress(FileNotFoundError):
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    size = sum(file[1] for file in files)
+    for _, file_size, path in files:
+        if size <= CACHE_SIZE * CACHE_LOW_WATER:
+            break
+        size -= file_size
+        path.unlink(missing_ok=True)
+        log.debug("Tile cache evicted %s", path.name)
+    _size = size
+
+
+def clear():
+    """Remove every cached window and header"""
+    global _size  # pylint: disable=global-statement
+    for path in cached_files():
+        path.unlink(missing_ok=True)
+    _headers.clear()
+    _size = 0
+
+
+def load_header(href: str) -> dict[str, Any] | None:
+    """
+    Load a cached band header, or None if missing
+    Access time is updated for least recently used eviction
+    """
+    if href in _headers:
+        return _headers[href]
+    path = header_path(href)
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            header = json.load(file)
+        os.utime(path)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    _headers[href] = header
+    return header
+
+
+def save_header(href: str, header: dict[str, Any]):
+    """Save a band header in cache"""
+    path = header_path(href)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(header, file)
+    commit(tmp_path, path)
+    _headers[href] = header
+
+
+def read_header(src: rasterio.DatasetReader) -> dict[str, Any]:
+    """Header of an opened band: transform, width and height"""
+    return {
+        "transform": list(src.transform)[:6],
+        "width": src.width,
+        "height": src.height,
+    }
+
+
+class CachedBand:
+    """
+    Band asset read through the tile cache
+    Behaves like a rasterio dataset for windows and reads, the dataset being
+    opened on the first cache miss only (header or window)
+    """
+
+    def __init__(self, href: str):
+        self.href = href
+        self._src: rasterio.DatasetReader | None = None
+        header = load_header(href) if CACHE_ENABLED else None
+        if header is None:
+            header = read_header(self.src)
+            if CACHE_ENABLED:
+                save_header(href, header)
+        self.transform = Affine(*header["transform"])
+        self.width: int = header["width"]
+        self.height: int = header["height"]
+
+    @property
+    def src(self) -> rasterio.DatasetReader:
+        """Band dataset, opened on first use"""
+        if self._src is None:
+            self._src = rasterio.open(self.href)
+        return self._src
+
+    @property
+    def res(self) -> tuple[float, float]:
+        """Resolution of the band"""
+        return (self.transform.a, -self.transform.e)
+
+    def window(self, *bounds: float) -> Window:
+        """Window of bounds in the band"""
+        return rasterio.windows.from_bounds(*bounds, transform=self.transform)
+
+    def window_bounds(self, window: Window) -> tuple[float, ...]:
+        """Bounds of window in the band CRS"""
+        return rasterio.windows.bounds(window, self.transform)
+
+    def window_transform(self, window: Window) -> Affine:
+        """Affine transform of window in the band"""
+        return rasterio.windows.transform(window, self.transform)
+
+    def read(self, indexes: int, window: Window, **kwargs) -> numpy.ndarray:
+        """Read a window through the tile cache"""
+        if not CACHE_ENABLED:
+            return self.src.read(indexes, window=window, **kwargs)
+        key = window_key(self.href, window, indexes, sorted(kwargs.items()))
+        array = load(key)
+        if array is None:
+            array = self.src.read(indexes, window=window, **kwargs)
+            save(key, array)
+        return array
+
+    def close(self):
+        """Close the band dataset, if opened"""
+        if self._src is not None:
+            self._src.close()
+            self._src = None
+
+
+@contextlib.contextmanager
+def open_band(href: str) -> Iterator[CachedBand]:
+    """
+    Open an asset, reading windows through the tile cache
+    The asset is only opened on cache misses
+    """
+    band = CachedBand(href)
+    try:
+        yield band
+    finally:
+        band.close()
+
+
+class CachedRioReader(AutoParallelRioReader):
+    """
+    Stackstac reader, reading windows through the tile cache
+    Cached windows are keyed by the output raster spec as well, since
+    stackstac reprojects on read
+    """
+
+    def read(self, window: Window, **kwargs) -> numpy.ndarray:
+        if not CACHE_ENABLED:
+            return super().read(window, **kwargs)
+        key = window_key(
+            self.url,
+            window,
+            self.spec,
+            self.resampling,
+            self.dtype,
+            self.fill_value,
+            sorted(kwargs.items()),
+        )
+        array = load(key)
+        if array is None:
+            array = super().read(window, **kwargs)
+            save(key, array)
+        return array
@@ -0,0 +1,169 @@
+"""
+Module to share Sentinel-2 tile reads between parcels
+Parcels intersecting the same item are grouped, their windows merged, and
+each merged window is read once per band
+"""
+
+import contextlib
+from typing import Iterator
+
+import numpy
+from pystac import Item
+from rasterio.windows import Window
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.process import tile_cache
+from crops_growth_analysis.process.images import ItemImages
+
+# Maximum gap, in pixels, between two windows merged into a single read
+MERGE_GAP = 64
+
+# Maximum width and height, in pixels, of a merged window
+MAX_WINDOW_SIZE = 2048
+
+
+class SharedBand:
+    """
+    Band of an item read once for several windows
+    Behaves like a rasterio dataset for windows and reads, reads being
+    sliced out of the merged windows buffers
+    """
+
+    def __init__(self, src: tile_cache.CachedBand, windows: list[Window]):
+        self.src = src
+        self.merged_windows = merge_windows(windows)
+        self.buffers: dict[int, numpy.ndarray] = {}
+        log.debug(
+            "Sharing %d windows in %d reads",
+            len(windows),
+            len(self.merged_windows),
+        )
+
+    @property
+    def res(self) -> tuple[float, float]:
+        """Resolution of the band"""
+        return self.src.res
+
+    def window(self, *bounds: float) -> Window:
+        """Window of bounds in the band"""
+        return self.src.window(*bounds)
+
+    def window_bounds(self, window: Window) -> tuple[float, ...]:
+        """Bounds of window in the band CRS"""
+        return self.src.window_bounds(window)
+
+    def window_transform(self, window: Window):
+        """Affine transform of window in the band"""
+        return self.src.window_transform(window)
+
+    def read(self, indexes: int, window: Window) -> numpy.ndarray:
+        """
+        Read window, from the merged window buffer containing it
+        Windows outside of the merged windows are read directly
+        """
+        for i, merged in enumerate(self.merged_windows):
+            if contains(merged, window):
+                if i not in self.buffers:
+                    self.buffers[i] = self.src.read(indexes, window=merged)
+                row = int(window.row_off - merged.row_off)
+                col = int(window.col_off - merged.col_off)
+                return self.buffers[i][
+                    slice(row, row + int(window.height)),
+                    slice(col, col + int(window.width)),
+                ]
+        return self.src.read(indexes, window=window)
+
+
+def contains(outer: Window, inner: Window) -> bool:
+    """Check if the outer window contains the inner window"""
+    return (
+        outer.col_off <= inner.col_off
+        and outer.row_off <= inner.row_off
+        and inner.col_off + inner.width <= outer.col_off + outer.width
+        and inner.row_off + inner.height <= outer.row_off + outer.height
+    )
+
+
+def union(first: Window, second: Window) -> Window:
+    """Smallest window containing both windows"""
+    col_off = min(first.col_off, second.col_off)
+    row_off = min(first.row_off, second.row_off)
+    return Window(
+        col_off,
+        row_off,
+        max(first.col_off + first.width, second.col_off + second.width)
+        - col_off,
+        max(first.row_off + first.height, second.row_off + second.height)
+        - row_off,
+    )
+
+
+def close_enough(first: Window, second: Window, gap: int) -> bool:
+    """Check if windows overlap once expanded by gap pixels"""
+    return (
+        first.col_off - gap < second.col_off + second.width
+        and second.col_off - gap < first.col_off + first.width
+        and first.row_off - gap < second.row_off + second.height
+        and second.row_off - gap < first.row_off + first.height
+    )
+
+
+def merge_windows(
+    windows: list[Window],
+    gap: int = MERGE_GAP,
+    max_size: int = MAX_WINDOW_SIZE,
+) -> list[Window]:
+    """
+    Merge windows closer than gap pixels, as long as merged windows stay
+    smaller than max_size pixels
+    """
+    merged: list[Window] = []
+    for window in sorted(windows, key=lambda w: (w.col_off, w.row_off)):
+        for i, candidate in enumerate(merged):
+            merged_window = union(candidate, window)
+            if (
+                close_enough(candidate, window, gap)
+                and merged_window.width <= max_size
+                and merged_window.height <= max_size
+            ):
+                merged[i] = merged_window
+                break
+        else:
+            merged.append(window)
+    return merged
+
+
+def group_by_item(
+    parcels: list[Parcel],
+) -> dict[str, tuple[Item, list[Parcel]]]:
+    """
+    Group parcels by the Sentinel-2 items they intersect
+    Return item id -> (item, parcels)
+    """
+    groups: dict[str, tuple[Item, list[Parcel]]] = {}
+    for parcel in parcels:
+        for item in parcel.sentinel_items:
+            groups.setdefault(item.id, (item, []))[1].append(parcel)
+    return groups
+
+
+@contextlib.contextmanager
+def open_item(
+    item: Item, parcels: list[Parcel], bands: list[str]
+) -> Iterator[dict[str, SharedBand]]:
+    """
+    Open item bands once, sharing reads between the windows of parcels
+    Yield band -> shared band, to be used as ItemImages sources
+    """
+    with contextlib.ExitStack() as stack:
+        sources: dict[str, SharedBand] = {}
+        for band in bands:
+            src = stack.enter_context(
+                tile_cache.open_band(item.assets[band].href)
+            )
+            sources[band] = SharedBand(
+                src,
+                [ItemImages(item, parcel).window(src) for parcel in parcels],
+            )
+        yield sources
@@ -0,0 +1,122 @@
+"""
+Module to reduce parcels timeseries to zonal statistics
+Statistics of every index type and date are computed in a single reduction
+over the pixels of the parcel, and exported as a columnar table
+"""
+
+import warnings
+
+import numpy
+import pyarrow
+import pyarrow.parquet
+import xarray
+
+from crops_growth_analysis import projection
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.process.mask import cached_polygon_mask
+
+# Percentiles computed, in addition to the median
+PERCENTILES = (10, 25, 75, 90)
+
+
+def parcel_mask(parcel: Parcel) -> numpy.ndarray:
+    """
+    Pixels of the timeseries grid inside the parcel polygon
+    Both processing methods output timeseries on a grid in the parcels CRS
+    """
+    return cached_polygon_mask(
+        (parcel.id, projection.PARCEL_EPSG),
+        parcel.polygon,
+        parcel.timeseries["x"].values,
+        parcel.timeseries["y"].values,
+    )
+
+
+def zonal_statistics(
+    timeseries: xarray.DataArray, mask: numpy.ndarray
+) -> xarray.Dataset:
+    """
+    Statistics of a masked timeseries, by index type and time
+    Mean, median, percentiles and count of valid pixels, and the fraction
+    of valid pixels among the pixels of mask
+    """
+    timeseries = timeseries.transpose("index_type", "time", "y", "x")
+    shape = (timeseries.sizes["index_type"], timeseries.sizes["time"])
+    if mask.any():
+        values = timeseries.values[..., mask]
+        with warnings.catch_warnings():
+            # Dates without valid pixels have NaN statistics
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = numpy.nanmean(values, axis=-1)
+            percentiles = numpy.nanpercentile(
+                values, [50, *PERCENTILES], axis=-1
+            )
+        valid_count = numpy.count_nonzero(~numpy.isnan(values), axis=-1)
+    else:
+        # No pixel inside the parcel (tiny parcel, empty grid on a tile
+        # edge), statistics are NaN
+        mean = numpy.full(shape, numpy.nan)
+        percentiles = numpy.full((len(PERCENTILES) + 1, *shape), numpy.nan)
+        valid_count = numpy.zeros(shape, int)
+    dims = ["index_type", "time"]
+    return xarray.Dataset(
+        {
+            "mean": (dims, mean),
+            "median": (dims, percentiles[0]),
+            **{
+                f"p{percentile}": (dims, percentiles[i + 1])
+                for i, percentile in enumerate(PERCENTILES)
+            },
+            "valid_count": (dims, valid_count),
+            "valid_fraction": (dims, valid_count / max(mask.sum(), 1)),
+        },
+        coords={
+            "index_type": timeseries["index_type"].values,
+            "time": timeseries["time"].values,
+        },
+    )
+
+
+def parcel_statistics(parcel: Parcel) -> xarray.Dataset:
+    """Zonal statistics of a processed parcel"""
+    return zonal_statistics(parcel.timeseries, parcel_mask(parcel))
+
+
+def to_table(parcel_id: str, statistics: xarray.Dataset) -> pyarrow.Table:
+    """
+    Table of parcel statistics, a row by index type and time
+    """
+    frame = statistics.to_dataframe().reset_index()
+    return pyarrow.table(
+        {
+            "parcel_id": pyarrow.array(
+                [parcel_id] * len(frame), pyarrow.string()
+            ),
+            "time": pyarrow.array(
+                frame["time"].values.astype("datetime64[us]"),
+                pyarrow.timestamp("us"),
+            ),
+            "index_type": pyarrow.array(
+                frame["index_type"].astype(str), pyarrow.string()
+            ),
+            **{
+                name: pyarrow.array(frame[name].values)
+                for name in statistics.data_vars
+            },
+        }
+    )
+
+
+def parcels_table(parcels: list[Parcel]) -> pyarrow.Table:
+    """Table of the statistics of many processed parcels"""
+    tables = [
+        to_table(parcel.id, parcel_statistics(parcel))
+        for parcel in parcels
+        if parcel.timeseries.ndim
+    ]
+    return pyarrow.concat_tables(tables) if tables else pyarrow.table({})
+
+
+def write_parquet(table: pyarrow.Table, path: str):
+    """Write a statistics table in a Parquet file"""
+    pyarrow.parquet.write_table(table, path)
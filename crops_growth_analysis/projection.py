@@ -0,0 +1,98 @@
+"""
+Module to share coordinate transformers and project parcels
+"""
+
+import threading
+from typing import Callable, Iterable
+
+import numpy
+import shapely
+from pyproj import CRS, Transformer
+from shapely import Polygon
+
+from crops_growth_analysis.extract.csv import Parcel
+
+# CRS of the parcels csv files
+PARCEL_EPSG = 2154
+
+# CRS of the STAC catalog
+CATALOG_EPSG = 4326
+
+# Transformers are not safe to share between threads, each thread keeps its
+# own registry
+_registry = threading.local()
+
+
+def get_transformer(src_epsg: int, dst_epsg: int) -> Transformer:
+    """
+    Get a transformer from src_epsg to dst_epsg, created once per thread
+    """
+    transformers: dict[tuple[int, int], Transformer] | None = getattr(
+        _registry, "transformers", None
+    )
+    if transformers is None:
+        transformers = _registry.transformers = {}
+    key = (src_epsg, dst_epsg)
+    if key not in transformers:
+        transformers[key] = Transformer.from_crs(
+            CRS(f"EPSG:{src_epsg}"), CRS(f"EPSG:{dst_epsg}"), always_xy=True
+        )
+    return transformers[key]
+
+
+def coordinates_transform(
+    src_epsg: int, dst_epsg: int
+) -> Callable[[numpy.ndarray], numpy.ndarray]:
+    """
+    Function projecting an (N, 2) array of coordinates from src_epsg to
+    dst_epsg, as expected by shapely.transform
+    """
+    transformer = get_transformer(src_epsg, dst_epsg)
+
+    def transform(coords: numpy.ndarray) -> numpy.ndarray:
+        return numpy.column_stack(
+            transformer.transform(coords[:, 0], coords[:, 1])
+        )
+
+    return transform
+
+
+def project_all(
+    geometries: Iterable[shapely.Geometry], src_epsg: int, dst_epsg: int
+) -> numpy.ndarray:
+    """
+    Project geometries from src_epsg to dst_epsg, in a single array operation
+    """
+    return shapely.transform(
+        numpy.asarray(list(geometries), dtype=object),
+        coordinates_transform(src_epsg, dst_epsg),
+    )
+
+
+def project(polygon: Polygon, src_epsg: int, dst_epsg: int) -> Polygon:
+    """
+    Project a single polygon from src_epsg to dst_epsg
+    """
+    return shapely.transform(
+        polygon, coordinates_transform(src_epsg, dst_epsg)
+    )
+
+
+def project_parcels(parcels: list[Parcel]):
+    """
+    Project parcels polygons to the CRS of their Sentinel-2 items
+    Projections are stored in parcel.projections, by EPSG
+    """
+    by_epsg: dict[int, list[Parcel]] = {}
+    for parcel in parcels:
+        epsgs = {
+            item.properties["proj:epsg"] for item in parcel.sentinel_items
+        }
+        for epsg in epsgs - parcel.projections.keys():
+            by_epsg.setdefault(epsg, []).append(parcel)
+    for epsg, epsg_parcels in by_epsg.items():
+        projected = project_all(
+            [parcel.polygon for parcel in epsg_parcels], PARCEL_EPSG, epsg
+        )
+        for parcel, polygon in zip(epsg_parcels, projected):
+            parcel.projections[epsg] = polygon
@@ -1,49 +1,329 @@
 """Abstract class for storing parcels."""
 
+import threading
 from abc import ABC, abstractmethod
-from datetime import datetime
-from io import BytesIO
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import Any, Callable, Hashable, Iterable, Iterator, NamedTuple
 
+import numpy
+import xarray
+from pystac import Item
 from xarray import DataArray
 
 from crops_growth_analysis.extract.csv import Parcel
 from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.store.encoding import (
+    Encoder,
+    decode,
+    decode_png,
+    encode_png,
+    get_encoder,
+)
+
+# Number of datasets written to the database in a single batch
+BATCH_SIZE = 500
+
+# Encoding of stored datasets, "netcdf" or "compact"
+ENCODER = "netcdf"
+
+# Index types of timeseries, each stored in its own table, collection or
+# bucket
+INDEX_TYPES = ("ndvi", "ndmi")
+
+# Index type of RGB quicklooks, stored as PNG images next to indexes
+QUICKLOOK = "quicklook"
+
+# Bands of RGB quicklooks
+QUICKLOOK_BANDS = ("B04", "B03", "B02")
+
+
+class DatasetRecord(NamedTuple):
+    """A single timeserie dataset, to be stored"""
+
+    parcel_id: str
+    index_type: str
+    time: datetime
+    data: bytes | None = None
+    url: str | None = None
+
+
+def record_data(record: DatasetRecord) -> bytes:
+    """
+    Data of a record, raising a ValueError if the record only has a URL
+    """
+    if record.data is None:
+        raise ValueError(
+            f"No data in the {record.index_type} record of "
+            f"{record.parcel_id} at {record.time}"
+        )
+    return record.data
+
+
+def to_records(
+    parcel_id: str,
+    index_type: str,
+    datasets: Iterable[tuple[datetime, bytes]],
+) -> list[DatasetRecord]:
+    """
+    Records of the encoded datasets of a parcel and index type, by time
+    """
+    return [
+        DatasetRecord(parcel_id, index_type, time, data)
+        for time, data in datasets
+    ]
+
+
+def utc_naive(time: datetime) -> datetime:
+    """
+    Naive UTC datetime, as stored in databases and timeseries
+    """
+    if time.tzinfo is None:
+        return time
+    return time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def item_datetime(item: Item) -> datetime:
+    """
+    Naive UTC datetime of an item
+    Sentinel-2 items always have one, items without are rejected
+    """
+    if item.datetime is None:
+        raise ValueError(f"Item {item.id} has no datetime")
+    return utc_naive(item.datetime)
+
+
+def processed_datetimes(parcel: Parcel) -> list[datetime]:
+    """Datetimes of the items processed for a parcel"""
+    return sorted({item_datetime(item) for item in parcel.sentinel_items})
+
+
+class SharedClients:
+    """
+    Database clients shared by storage instances, and threads
+    A client is created on first use of its key and closed once no storage
+    uses it anymore
+    """
+
+    def __init__(
+        self,
+        create: Callable[[Any], Any],
+        close: Callable[[Any], None] = lambda client: None,
+    ):
+        self.create = create
+        self.close = close
+        self.clients: dict[Hashable, list] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key: Hashable) -> Any:
+        """Get the client of key, creating it if needed"""
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = [self.create(key), 0]
+            self.clients[key][1] += 1
+            return self.clients[key][0]
+
+    def release(self, key: Hashable):
+        """Release the client of key, closing it if unused"""
+        with self.lock:
+            self.clients[key][1] -= 1
+            if self.clients[key][1] == 0:
+                self.close(self.clients.pop(key)[0])
 
 
 class AbstractParcelStorage(ABC):
     """
     An abstract class to interact with database to store parcels timeseries.
+    Datasets are buffered and written by batches of batch_size.
+    Storages may be shared between threads, backends writing concurrently.
+    Datasets are serialized by encoder, see store.encoding.
     """
 
+    def __init__(
+        self, batch_size: int = BATCH_SIZE, encoder: str | Encoder = ENCODER
+    ):
+        self.batch_size = batch_size
+        self.encoder = get_encoder(encoder)
+        self.pending_parcels: list[Parcel] = []
+        self.pending_records: list[DatasetRecord] = []
+        self.pending_lock = threading.Lock()
+
     def store_parcel(self, parcel: Parcel):
         """
         Store the parcel.
+        Writes are buffered, call flush (or close) to write pending data.
         """
-        # Store parcel information
-        log.debug("Storing parcel information")
-        self.store_parcel_info(parcel)
-        # Store timeseries
         log.debug("Storing timeseries")
+        records = list(self.parcel_records(parcel))
+        with self.pending_lock:
+            # Do not keep the timeseries alive until the next flush
+            self.pending_parcels.append(
+                replace(parcel, timeseries=DataArray(), quicklooks=DataArray())
+            )
+            self.pending_records.extend(records)
+            full = len(self.pending_records) >= self.batch_size
+        if full:
+            self.flush()
+        log.debug("Parcel stored")
+
+    def store_parcels(self, parcels: Iterable[Parcel]):
+        """
+        Store many parcels, then flush pending writes.
+        """
+        for parcel in parcels:
+            self.store_parcel(parcel)
+        self.flush()
+
+    def parcel_records(self, parcel: Parcel) -> Iterator[DatasetRecord]:
+        """
+        Serialize every (time, index type) dataset of the parcel timeseries.
+        """
         timeserie: DataArray
         ds: DataArray
         for timeserie in parcel.timeseries:
             for ds in timeserie:
                 index_type: str = ds["index_type"].item()
-                time: datetime = ds["time"].item()
+                time: datetime = (
+                    ds["time"].values.astype("datetime64[us]").item()
+                )
                 log.debug(
-                    "Storing index type %s and time %s",
+                    "Serializing index type %s and time %s",
                     index_type,
                     time,
                 )
-                netcdf_buffer = BytesIO()
-                ds.to_netcdf(netcdf_buffer)
-                self.store_ds(
-                    parcel.id,
-                    index_type,
-                    time,
-                    netcdf_buffer.getvalue(),
+                with metrics.timer("serialize", parcel.id) as timing:
+                    data = self.encoder.encode(ds)
+                    timing["nbytes"] = len(data)
+                yield DatasetRecord(parcel.id, index_type, time, data)
+        if parcel.quicklooks.ndim:
+            yield from self.quicklook_records(parcel)
+
+    def quicklook_records(self, parcel: Parcel) -> Iterator[DatasetRecord]:
+        """
+        Encode every RGB quicklook of the parcel as PNG.
+        """
+        quicklook: DataArray
+        for quicklook in parcel.quicklooks:
+            time: datetime = (
+                quicklook["time"].values.astype("datetime64[us]").item()
+            )
+            with metrics.timer("serialize", parcel.id) as timing:
+                data = encode_png(quicklook.values)
+                timing["nbytes"] = len(data)
+            yield DatasetRecord(parcel.id, QUICKLOOK, time, data)
+
+    def extension(self, index_type: str) -> str:
+        """
+        File extension of the datasets of an index type.
+        """
+        return "png" if index_type == QUICKLOOK else self.encoder.extension
+
+    def flush(self):
+        """
+        Write pending parcels information and datasets.
+        Pending data is taken under lock, then written without it, so
+        concurrent flushes write in parallel.
+        """
+        with self.pending_lock:
+            parcels, self.pending_parcels = self.pending_parcels, []
+            pending_records, self.pending_records = self.pending_records, []
+        if parcels:
+            log.debug("Storing %d parcels", len(parcels))
+            with metrics.timer("write.parcels"):
+                self.store_parcels_info(parcels)
+        if pending_records:
+            # Keep the last dataset of duplicated keys, as sequential
+            # writes would
+            records = {
+                (record.parcel_id, record.index_type, record.time): record
+                for record in pending_records
+            }
+            log.debug("Storing %d datasets", len(records))
+            with metrics.timer("write.datasets") as timing:
+                timing["nbytes"] = sum(
+                    len(record.data or b"") for record in records.values()
                 )
-        log.debug("Parcel stored")
+                self.store_many(list(records.values()))
+
+    def store_parcels_info(self, parcels: list[Parcel]):
+        """
+        Store information of many parcels.
+        Backends may override it with a bulk write.
+        """
+        for parcel in parcels:
+            self.store_parcel_info(parcel)
+
+    def store_many(self, records: list[DatasetRecord]):
+        """
+        Store many timeserie datasets.
+        Backends may override it with a bulk write.
+        """
+        for record in records:
+            self.store_ds(*record)
+
+    @abstractmethod
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """
+        Datetimes already stored for many parcels, as naive UTC datetimes.
+        Parcels never stored have no datetimes.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """
+        Stored datasets of a parcel and index type, sorted by time.
+        Records hold encoded data, backends storing URLs download it.
+        """
+        raise NotImplementedError
+
+    def read_timeseries(self, parcel_id: str) -> DataArray | None:
+        """
+        Read the timeseries of a parcel, of dims (index_type, time, y, x).
+        Datasets are decoded whatever the encoder used to write them.
+        Return None if the parcel was never stored.
+        Raise a ValueError if a record has no data.
+        """
+        indexes: list[DataArray] = []
+        for index_type in INDEX_TYPES:
+            records = self.read_records(parcel_id, index_type)
+            if records:
+                datasets: list[DataArray] = [
+                    decode(record_data(record)) for record in records
+                ]
+                indexes.append(xarray.concat(datasets, "time"))
+        if not indexes:
+            return None
+        return xarray.concat(indexes, "index_type")
+
+    def read_quicklooks(self, parcel_id: str) -> DataArray | None:
+        """
+        Read the RGB quicklooks of a parcel, of dims (time, y, x, band).
+        Quicklooks have no x and y coordinates, they cover the extent of
+        the timeseries.
+        Return None if the parcel has no stored quicklooks.
+        Raise a ValueError if a record has no data.
+        """
+        records = self.read_records(parcel_id, QUICKLOOK)
+        if not records:
+            return None
+        return DataArray(
+            numpy.stack(
+                [decode_png(record_data(record)) for record in records]
+            ),
+            dims=("time", "y", "x", "band"),
+            coords={
+                "time": numpy.array(
+                    [record.time for record in records], "datetime64[ns]"
+                ),
+                "band": list(QUICKLOOK_BANDS),
+            },
+        )
 
     @abstractmethod
     def store_parcel_info(self, parcel: Parcel):
@@ -58,8 +338,8 @@ class AbstractParcelStorage(ABC):
         parcel_id: str,
         index_type: str,
         time: datetime,
-        data: bytes = None,
-        url: str = None,
+        data: bytes | None = None,
+        url: str | None = None,
     ):
         """
         Store a single timeserie dataset.
@@ -70,5 +350,6 @@ class AbstractParcelStorage(ABC):
     def close(self):
         """
         Close the connection.
+        Implementations must flush pending writes first.
         """
         raise NotImplementedError
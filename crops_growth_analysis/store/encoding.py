@@ -0,0 +1,236 @@
+"""
+Module to encode timeseries datasets before storing them
+Each encoder turns a single (index type, time) 2D dataset into bytes, and
+back, RGB quicklooks being encoded as PNG images
+"""
+
+import struct
+import time
+import zlib
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Iterable
+
+import numpy
+import xarray
+from PIL import Image
+
+from crops_growth_analysis.logger import log
+
+
+class Encoder(ABC):
+    """
+    An abstract class to encode and decode a single 2D dataset
+    """
+
+    name: str
+    extension: str
+
+    @abstractmethod
+    def encode(self, ds: xarray.DataArray) -> bytes:
+        """
+        Encode a dataset with x, y, time and index_type coordinates
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, data: bytes) -> xarray.DataArray:
+        """
+        Decode a dataset encoded by this encoder
+        """
+        raise NotImplementedError
+
+
+class NetCDFEncoder(Encoder):
+    """
+    NetCDF encoding, self describing but with a large overhead per dataset
+    """
+
+    name = "netcdf"
+    extension = "nc"
+
+    def encode(self, ds: xarray.DataArray) -> bytes:
+        netcdf_buffer = BytesIO()
+        strip(ds).to_netcdf(netcdf_buffer)
+        return netcdf_buffer.getvalue()
+
+    def decode(self, data: bytes) -> xarray.DataArray:
+        return xarray.open_dataarray(BytesIO(data)).load()
+
+
+class CompactEncoder(Encoder):
+    """
+    Compact encoding, values scaled to int16 and deflate compressed
+    A small header keeps the index type, time and shape, followed by the
+    compressed x coordinates, y coordinates and values
+    """
+
+    name = "compact"
+    extension = "bin"
+
+    MAGIC = b"CGA1"
+    # magic, scale, time (ns), index type, height, width
+    HEADER = struct.Struct("<4sdq8sII")
+    # Maximum length of index types, in bytes, as struct pads or truncates
+    INDEX_TYPE_SIZE = 8
+    NODATA = numpy.iinfo(numpy.int16).min
+
+    def __init__(self, scale: float = 1e-4, level: int = 6):
+        """
+        scale is the value of one int16 step, 1e-4 keeps indexes in [-1, 1]
+        with four decimals
+        level is the deflate compression level
+        """
+        self.scale = scale
+        self.level = level
+
+    def encode(self, ds: xarray.DataArray) -> bytes:
+        index_type = str(ds["index_type"].item()).encode()
+        if len(index_type) > self.INDEX_TYPE_SIZE:
+            raise ValueError(
+                f"Index type {index_type.decode()} is longer than "
+                f"{self.INDEX_TYPE_SIZE} bytes"
+            )
+        values = ds.transpose("y", "x").values
+        scaled = numpy.clip(
+            numpy.rint(values / self.scale),
+            self.NODATA + 1,
+            numpy.iinfo(numpy.int16).max,
+        )
+        scaled = numpy.where(numpy.isnan(values), self.NODATA, scaled)
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.scale,
+            int(
+                ds["time"].values.astype("datetime64[ns]").astype(numpy.int64)
+            ),
+            index_type,
+            values.shape[0],
+            values.shape[1],
+        )
+        payload = b"".join(
+            [
+                ds["x"].values.astype("<f8").tobytes(),
+                ds["y"].values.astype("<f8").tobytes(),
+                scaled.astype("<i2").tobytes(),
+            ]
+        )
+        return header + zlib.compress(payload, self.level)
+
+    def decode(self, data: bytes) -> xarray.DataArray:
+        magic, scale, time_ns, index_type, height, width = (
+            self.HEADER.unpack_from(data)
+        )
+        if magic != self.MAGIC:
+            raise ValueError("Not a compact encoded dataset")
+        payload = zlib.decompress(data[slice(self.HEADER.size, None)])
+        x = numpy.frombuffer(payload, "<f8", width)
+        y = numpy.frombuffer(payload, "<f8", height, width * 8)
+        scaled = numpy.frombuffer(
+            payload, "<i2", height * width, (width + height) * 8
+        ).reshape(height, width)
+        values = numpy.where(scaled == self.NODATA, numpy.nan, scaled * scale)
+        return xarray.DataArray(
+            values,
+            dims=["y", "x"],
+            coords={
+                "y": y,
+                "x": x,
+                "time": numpy.datetime64(time_ns, "ns"),
+                "index_type": index_type.rstrip(b"\0").decode(),
+            },
+        )
+
+
+def strip(ds: xarray.DataArray) -> xarray.DataArray:
+    """
+    Dataset without attributes nor coordinates other than x, y, time and
+    index_type, which may not be serializable (e.g. stackstac metadata)
+    """
+    return xarray.DataArray(
+        ds.values,
+        dims=ds.dims,
+        coords={
+            name: ds[name].values
+            for name in ("y", "x", "time", "index_type")
+            if name in ds.coords
+        },
+        name=ds.name,
+    )
+
+
+ENCODERS: dict[str, Encoder] = {
+    encoder.name: encoder for encoder in (NetCDFEncoder(), CompactEncoder())
+}
+
+
+def get_encoder(encoder: str | Encoder) -> Encoder:
+    """Get an encoder from its name"""
+    return ENCODERS[encoder] if isinstance(encoder, str) else encoder
+
+
+def decode(data: bytes) -> xarray.DataArray:
+    """
+    Decode a dataset, whatever the encoder used
+    """
+    if data.startswith(CompactEncoder.MAGIC):
+        return ENCODERS["compact"].decode(data)
+    return ENCODERS["netcdf"].decode(data)
+
+
+def encode_png(image: numpy.ndarray) -> bytes:
+    """
+    Encode an RGB image of shape (y, x, band) as PNG
+    """
+    buffer = BytesIO()
+    Image.fromarray(numpy.asarray(image, dtype="uint8"), "RGB").save(
+        buffer, format="PNG"
+    )
+    return buffer.getvalue()
+
+
+def decode_png(data: bytes) -> numpy.ndarray:
+    """
+    Decode a PNG image, as an uint8 array of shape (y, x, band)
+    """
+    with Image.open(BytesIO(data)) as image:
+        return numpy.asarray(image.convert("RGB"))
+
+
+def benchmark(
+    timeseries: Iterable[xarray.DataArray], encoders: list[str] | None = None
+) -> dict[str, dict[str, float]]:
+    """
+    Compare encoders on every dataset of parcel timeseries
+    Return bytes written, encode and decode time of each encoder
+    """
+    datasets = [
+        ds
+        for parcel_timeseries in timeseries
+        for index_timeseries in parcel_timeseries
+        for ds in index_timeseries
+    ]
+    results: dict[str, dict[str, float]] = {}
+    for name in encoders or list(ENCODERS):
+        encoder = ENCODERS[name]
+        start_time = time.perf_counter()
+        encoded = [encoder.encode(ds) for ds in datasets]
+        encode_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for data in encoded:
+            encoder.decode(data)
+        decode_time = time.perf_counter() - start_time
+        results[name] = {
+            "datasets": len(datasets),
+            "bytes": sum(len(data) for data in encoded),
+            "encode_time": encode_time,
+            "decode_time": decode_time,
+        }
+        log.info(
+            "Encoder %s : %d bytes, encoded in %.3fs, decoded in %.3fs",
+            name,
+            results[name]["bytes"],
+            encode_time,
+            decode_time,
+        )
+    return results
@@ -3,7 +3,10 @@ Module to store parcels and their NDVI and NDMI values in Minio
 backed by Postgresql or MongoDB metadata
 """
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 
 import minio
 
@@ -11,7 +14,47 @@ import crops_growth_analysis.store.mongodb as mongodb
 import crops_growth_analysis.store.postgresql as postgresql
 from crops_growth_analysis.extract.csv import Parcel
 from crops_growth_analysis.logger import log
-from crops_growth_analysis.store.common import AbstractParcelStorage
+from crops_growth_analysis.store.common import (
+    BATCH_SIZE,
+    ENCODER,
+    INDEX_TYPES,
+    QUICKLOOK,
+    AbstractParcelStorage,
+    DatasetRecord,
+    SharedClients,
+    record_data,
+)
+from crops_growth_analysis.store.encoding import Encoder
+
+# Number of objects uploaded or downloaded concurrently, by all storages
+UPLOAD_WORKERS = 8
+
+# Minio clients are thread safe, a single client is shared by all storages
+# of the same server
+clients = SharedClients(
+    lambda key: minio.Minio(
+        key[0],
+        access_key="minio",
+        secret_key="netcarbon",
+        secure=key[1],
+    )
+)
+
+_upload_executor: ThreadPoolExecutor | None = None
+_upload_executor_lock = threading.Lock()
+
+
+def upload_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool uploading and downloading objects, shared by all storages
+    """
+    global _upload_executor  # pylint: disable=global-statement
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(
+                UPLOAD_WORKERS, thread_name_prefix="minio-upload"
+            )
+        return _upload_executor
 
 
 class ParcelStorage(AbstractParcelStorage):
@@ -19,6 +62,8 @@ class ParcelStorage(AbstractParcelStorage):
     Parcel storage class
     Init client and create tables
     Provides methods to store parcels and timeseries
+    Client, upload threads and metadata connections are shared between
+    storages, which may be used from several threads
     """
 
     def __init__(
@@ -26,28 +71,25 @@ class ParcelStorage(AbstractParcelStorage):
         metadata_backend: str = "mongodb",
         url: str = "localhost:9000",
         secure: bool = False,
+        batch_size: int = BATCH_SIZE,
+        encoder: str | Encoder = ENCODER,
     ):
         """Init clients and create buckets"""
+        super().__init__(batch_size, encoder)
         self.backend = (
-            postgresql.ParcelStorage()
+            postgresql.ParcelStorage(batch_size)
             if metadata_backend == "postgresql"
-            else mongodb.ParcelStorage()
+            else mongodb.ParcelStorage(batch_size)
         )
         log.debug("Init Minio Client")
-        self.minio_client = minio.Minio(
-            url,
-            access_key="minio",
-            secret_key="netcarbon",
-            secure=secure,
-        )
+        self.client_key = (url, secure)
+        self.minio_client: minio.Minio = clients.acquire(self.client_key)
         scheme = "https" if secure else "http"
         self.base_url = f"{scheme}://{url}"
-        log.debug("Get Minio NDVI Bucket")
-        if not self.minio_client.bucket_exists("ndvi"):
-            self.minio_client.make_bucket("ndvi")
-        log.debug("Get Minio NDMI Bucket")
-        if not self.minio_client.bucket_exists("ndmi"):
-            self.minio_client.make_bucket("ndmi")
+        for bucket in (*INDEX_TYPES, QUICKLOOK):
+            log.debug("Get Minio %s Bucket", bucket)
+            if not self.minio_client.bucket_exists(bucket):
+                self.minio_client.make_bucket(bucket)
 
     def store_parcel_info(self, parcel: Parcel):
         """
@@ -55,33 +97,100 @@ class ParcelStorage(AbstractParcelStorage):
         """
         self.backend.store_parcel_info(parcel)
 
+    def store_parcels_info(self, parcels: list[Parcel]):
+        """
+        Store information of many parcels in backend
+        """
+        self.backend.store_parcels_info(parcels)
+
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """
+        Processed datetimes of many parcels, from backend
+        """
+        return self.backend.stored_datetimes(parcel_ids)
+
     def store_ds(
         self,
         parcel_id: str,
         index_type: str,
         time: datetime,
-        data: bytes = None,
-        url: str = None,
+        data: bytes | None = None,
+        url: str | None = None,
     ):
         """
         Store a single timeserie dataset in Minio and metadata in backend
         """
-        time_dir = time.strftime("%Y/%m/%d")
+        self.store_many([DatasetRecord(parcel_id, index_type, time, data)])
+
+    def store_many(self, records: list[DatasetRecord]):
+        """
+        Upload many timeserie datasets concurrently in Minio
+        Then store their metadata in backend, in bulk
+        """
+        urls = list(upload_executor().map(self.upload, records))
+        self.backend.store_many(
+            [
+                record._replace(data=None, url=url)
+                for record, url in zip(records, urls)
+            ]
+        )
+
+    def upload(self, record: DatasetRecord) -> str:
+        """
+        Upload a single timeserie dataset in Minio, return its URL
+        """
+        data = record_data(record)
+        time_dir = record.time.strftime("%Y/%m/%d")
         object_name = (
-            f"{parcel_id}/{time_dir}/{parcel_id}-{index_type}-{time}.nc"
+            f"{record.parcel_id}/{time_dir}/"
+            f"{record.parcel_id}-{record.index_type}-{record.time}"
+            f".{self.extension(record.index_type)}"
         )
         self.minio_client.put_object(
-            index_type,
+            record.index_type,
             object_name,
-            data,
+            BytesIO(data),
             len(data),
             "application/octet-stream",
         )
-        object_url = f"{self.base_url}/{index_type}/{object_name}"
-        self.backend.store_ds(parcel_id, index_type, time, url=object_url)
+        return f"{self.base_url}/{record.index_type}/{object_name}"
+
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """
+        Read metadata of stored datasets from backend
+        Then download their objects concurrently from Minio
+        """
+        records = self.backend.read_records(parcel_id, index_type)
+        data = upload_executor().map(self.download, records)
+        return [
+            record._replace(data=downloaded)
+            for record, downloaded in zip(records, data)
+        ]
+
+    def download(self, record: DatasetRecord) -> bytes:
+        """
+        Download a single timeserie dataset from its Minio URL
+        """
+        if record.url is None:
+            raise ValueError(f"No URL to download for {record.parcel_id}")
+        object_name = record.url.removeprefix(
+            f"{self.base_url}/{record.index_type}/"
+        )
+        response = self.minio_client.get_object(record.index_type, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
 
     def close(self):
         """
-        Close the backend
+        Flush, release the client and close the backend
         """
+        self.flush()
+        clients.release(self.client_key)
         self.backend.close()
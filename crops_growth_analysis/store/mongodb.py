@@ -1,12 +1,35 @@
 """Module to store parcels and their NDVI and NDMI values in MongoDB"""
 
+import itertools
 from datetime import datetime
 
 import pymongo
+from pymongo import ReplaceOne, UpdateOne
 
 from crops_growth_analysis.extract.csv import Parcel
 from crops_growth_analysis.logger import log
-from crops_growth_analysis.store.common import AbstractParcelStorage
+from crops_growth_analysis.store.common import (
+    BATCH_SIZE,
+    ENCODER,
+    AbstractParcelStorage,
+    DatasetRecord,
+    SharedClients,
+    processed_datetimes,
+)
+from crops_growth_analysis.store.encoding import Encoder
+
+# Connection URL
+MONGO_URL = "mongodb://localhost:27017/"
+
+# Maximum number of pooled connections of a client
+MAX_POOL_SIZE = 16
+
+# Clients are thread safe and pool their connections, a single client is
+# shared by all storages
+clients = SharedClients(
+    lambda url: pymongo.MongoClient(url, maxPoolSize=MAX_POOL_SIZE),
+    lambda client: client.close(),
+)
 
 
 class ParcelStorage(AbstractParcelStorage):
@@ -14,61 +37,127 @@ class ParcelStorage(AbstractParcelStorage):
     Parcel storage class
     Init client and create collections
     Provides methods to store parcels and timeseries
+    The client is shared between storages, which may be used from several
+    threads
     """
 
-    def __init__(self):
+    def __init__(
+        self, batch_size: int = BATCH_SIZE, encoder: str | Encoder = ENCODER
+    ):
         """
         Init client and create collections
         """
+        super().__init__(batch_size, encoder)
         # Connect to MongoDB
         log.debug("Connecting to MongoDB")
-        self.client = pymongo.MongoClient("mongodb://localhost:27017/")
+        self.client = clients.acquire(MONGO_URL)
         self.db = self.client["mongo-netcarbon"]
         self.parcels = self.db["parcels"]
-        self.ndvi = self.db["ndvi"]
-        self.ndmi = self.db["ndmi"]
 
     def store_parcel_info(self, parcel: Parcel):
         """
         Store parcel information in Mongo DB
         """
-        document = {
-            "_id": parcel.id,
-            "polygon": parcel.polygon.wkt,
-            "processed_datetimes": [
-                item.datetime for item in parcel.sentinel_items
-            ],
+        self.store_parcels_info([parcel])
+
+    def store_parcels_info(self, parcels: list[Parcel]):
+        """
+        Store information of many parcels in a single bulk write
+        """
+        operations = []
+        for parcel in parcels:
+            operations.append(
+                UpdateOne(
+                    {"_id": parcel.id},
+                    {
+                        "$set": {"polygon": parcel.polygon.wkt},
+                        "$addToSet": {
+                            "processed_datetimes": {
+                                "$each": processed_datetimes(parcel)
+                            }
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+        if operations:
+            self.parcels.bulk_write(operations)
+
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """
+        Processed datetimes of many parcels, in a single query
+        """
+        return {
+            document["_id"]: set(document.get("processed_datetimes", []))
+            for document in self.parcels.find(
+                {"_id": {"$in": list(parcel_ids)}},
+                {"processed_datetimes": 1},
+            )
         }
-        self.parcels.update_one(
-            {"_id": parcel.id}, {"$set": document}, upsert=True
-        )
 
     def store_ds(
         self,
         parcel_id: str,
         index_type: str,
         time: datetime,
-        data: bytes = None,
-        url: str = None,
+        data: bytes | None = None,
+        url: str | None = None,
     ):
         """
         Store a single timeserie dataset in Mongo DB
         Either with binary data or with a URL
         """
-        document = {
-            "parcel_id": parcel_id,
-            "datetime": time,
-        }
-        collection = self.ndvi if index_type == "ndvi" else self.ndmi
-        collection.replace_one(
-            document,
-            {**document, "data": data, "url": url},
-            upsert=True,
+        self.store_many(
+            [DatasetRecord(parcel_id, index_type, time, data, url)]
         )
 
+    def store_many(self, records: list[DatasetRecord]):
+        """
+        Store many timeserie datasets, one bulk write per collection
+        """
+        operations: dict[str, list[ReplaceOne]] = {}
+        for record in records:
+            document = {
+                "parcel_id": record.parcel_id,
+                "datetime": record.time,
+            }
+            operations.setdefault(record.index_type, []).append(
+                ReplaceOne(
+                    document,
+                    {**document, "data": record.data, "url": record.url},
+                    upsert=True,
+                )
+            )
+        for index_type, index_operations in operations.items():
+            collection = self.db[index_type]
+            for batch in itertools.batched(index_operations, self.batch_size):
+                collection.bulk_write(list(batch), ordered=False)
+
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """
+        Stored datasets of a parcel and index type, in a single query
+        """
+        return [
+            DatasetRecord(
+                parcel_id,
+                index_type,
+                document["datetime"],
+                document.get("data"),
+                document.get("url"),
+            )
+            for document in self.db[index_type]
+            .find({"parcel_id": parcel_id})
+            .sort("datetime", pymongo.ASCENDING)
+        ]
+
     def close(self):
         """
-        Close the client
+        Flush and release the client
         """
-        self.client.close()
-        log.debug("MongoDB client closed")
+        self.flush()
+        clients.release(MONGO_URL)
+        log.debug("MongoDB client released")
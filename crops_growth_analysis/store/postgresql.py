@@ -1,12 +1,72 @@
 """Module to store parcels and their NDVI and NDMI values in PostgreSQL"""
 
+import contextlib
+import threading
 from datetime import datetime
+from typing import Iterator
 
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import cursor as Cursor
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 from crops_growth_analysis.extract.csv import Parcel
 from crops_growth_analysis.logger import log
-from crops_growth_analysis.store.common import AbstractParcelStorage
+from crops_growth_analysis.store.common import (
+    BATCH_SIZE,
+    ENCODER,
+    INDEX_TYPES,
+    QUICKLOOK,
+    AbstractParcelStorage,
+    DatasetRecord,
+    SharedClients,
+    processed_datetimes,
+)
+from crops_growth_analysis.store.encoding import Encoder
+
+# Connection parameters
+CONNECTION = {
+    "dbname": "postgres-netcarbon",
+    "user": "postgres",
+    "password": "netcarbon",
+    "host": "localhost",
+}
+
+# Number of connections kept open, and maximum number of connections
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 8
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    Thread safe connection pool, waiting for a free connection instead of
+    failing when all connections are in use
+    """
+
+    def __init__(self, minconn: int, maxconn: int, **kwargs):
+        super().__init__(minconn, maxconn, **kwargs)
+        self.available = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        self.available.acquire()  # pylint: disable=consider-using-with
+        try:
+            return super().getconn(key)
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self.available.release()
+
+
+pools = SharedClients(
+    lambda key: BlockingConnectionPool(
+        POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **dict(key)
+    ),
+    lambda pool: pool.closeall(),
+)
 
 
 class ParcelStorage(AbstractParcelStorage):
@@ -14,111 +74,203 @@ class ParcelStorage(AbstractParcelStorage):
     Parcel storage class
     Init client and create tables
     Provides methods to store parcels and timeseries
+    Connections are pooled and shared between storages, so that storages
+    may be used from several threads
     """
 
-    def __init__(self):
+    def __init__(
+        self, batch_size: int = BATCH_SIZE, encoder: str | Encoder = ENCODER
+    ):
         """
         Init client and create tables
         """
+        super().__init__(batch_size, encoder)
         # Connect to PostgreSQL
         log.debug("Connecting to PostgreSQL")
-        self.conn = psycopg2.connect(
-            dbname="postgres-netcarbon",
-            user="postgres",
-            password="netcarbon",
-            host="localhost",
-        )
-        self.cursor = self.conn.cursor()
+        self.pool_key = tuple(sorted(CONNECTION.items()))
+        self.pool: BlockingConnectionPool = pools.acquire(self.pool_key)
 
         # Create tables
         log.debug("Creating tables")
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS parcels (
-                id TEXT PRIMARY KEY,
-                polygon GEOMETRY(Polygon),
-                processed_datetimes TIMESTAMP[]
-            )
-            """
-        )
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ndvi (
-                parcel_id TEXT,
-                datetime TIMESTAMP,
-                data BYTEA,
-                url TEXT,
-                PRIMARY KEY (parcel_id, datetime)
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS parcels (
+                    id TEXT PRIMARY KEY,
+                    polygon GEOMETRY(Polygon),
+                    processed_datetimes TIMESTAMP[]
+                )
+                """
             )
-            """
-        )
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ndmi (
-                parcel_id TEXT,
-                datetime TIMESTAMP,
-                data BYTEA,
-                url TEXT,
-                PRIMARY KEY (parcel_id, datetime)
-            )
-            """
-        )
+            for index_type in (*INDEX_TYPES, QUICKLOOK):
+                cursor.execute(
+                    sql.SQL(
+                        """
+                        CREATE TABLE IF NOT EXISTS {} (
+                            parcel_id TEXT,
+                            datetime TIMESTAMP,
+                            data BYTEA,
+                            url TEXT,
+                            PRIMARY KEY (parcel_id, datetime)
+                        )
+                        """
+                    ).format(sql.Identifier(index_type))
+                )
+
+    @contextlib.contextmanager
+    def cursor(self) -> Iterator[Cursor]:
+        """
+        Borrow a pooled connection
+        Changes are committed on success, so every batch is committed
+        """
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
 
     def store_parcel_info(self, parcel: Parcel):
         """
         Store parcel information in PostgreSQL
         """
-        document = {
-            "id": parcel.id,
-            "polygon": parcel.polygon.wkt,
-            "datetimes": [item.datetime for item in parcel.sentinel_items],
-        }
-        self.cursor.execute(
-            """
-            INSERT INTO parcels (id, polygon, processed_datetimes)
-            VALUES (%(id)s, ST_GeomFromText(%(polygon)s), %(datetimes)s)
-            ON CONFLICT (id) DO UPDATE
-            SET polygon = excluded.polygon,
-                processed_datetimes = excluded.processed_datetimes
-            """,
-            document,
-        )
+        self.store_parcels_info([parcel])
+
+    def store_parcels_info(self, parcels: list[Parcel]):
+        """
+        Store information of many parcels in a single statement
+        """
+        # Keep the last polygon of duplicated parcels, and all datetimes
+        rows: dict[str, tuple] = {}
+        for parcel in parcels:
+            datetimes = processed_datetimes(parcel)
+            if parcel.id in rows:
+                datetimes = sorted(set(rows[parcel.id][2]) | set(datetimes))
+            rows[parcel.id] = (parcel.id, parcel.polygon.wkt, datetimes)
+        with self.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO parcels (id, polygon, processed_datetimes)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE
+                SET polygon = excluded.polygon,
+                    processed_datetimes = ARRAY(
+                        SELECT DISTINCT unnest(
+                            parcels.processed_datetimes
+                            || excluded.processed_datetimes
+                        )
+                        ORDER BY 1
+                    )
+                """,
+                list(rows.values()),
+                template="(%s, ST_GeomFromText(%s), %s::TIMESTAMP[])",
+                page_size=self.batch_size,
+            )
+
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """
+        Processed datetimes of many parcels, in a single query
+        """
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, processed_datetimes
+                FROM parcels
+                WHERE id = ANY(%s)
+                """,
+                (list(parcel_ids),),
+            )
+            return {
+                parcel_id: set(datetimes or [])
+                for parcel_id, datetimes in cursor.fetchall()
+            }
 
     def store_ds(
         self,
         parcel_id: str,
         index_type: str,
         time: datetime,
-        data: bytes = None,
-        url: str = None,
+        data: bytes | None = None,
+        url: str | None = None,
     ):
         """
         Store a single timeserie dataset in PostgreSQL
         Either with binary data or with a URL
         """
-        document = {
-            "parcel_id": parcel_id,
-            "index_type": index_type,
-            "datetime": time,
-            "data": data,
-            "url": url,
-        }
-        self.cursor.execute(
-            """
-            INSERT INTO %(index_type)s (parcel_id, datetime, data, url)
-            VALUES (%(parcel_id)s, %(datetime)s, %(data)s, %(url)s)
-            ON CONFLICT (parcel_id, datetime) DO UPDATE
-            SET value = excluded.value
-            """,
-            document,
+        self.store_many(
+            [DatasetRecord(parcel_id, index_type, time, data, url)]
         )
 
+    def store_many(self, records: list[DatasetRecord]):
+        """
+        Store many timeserie datasets, one statement per index type
+        """
+        by_index_type: dict[str, list[tuple]] = {}
+        for record in records:
+            by_index_type.setdefault(record.index_type, []).append(
+                (
+                    record.parcel_id,
+                    record.time,
+                    (
+                        psycopg2.Binary(record.data)
+                        if record.data is not None
+                        else None
+                    ),
+                    record.url,
+                )
+            )
+        with self.cursor() as cursor:
+            for index_type, rows in by_index_type.items():
+                query = sql.SQL(
+                    """
+                    INSERT INTO {} (parcel_id, datetime, data, url)
+                    VALUES %s
+                    ON CONFLICT (parcel_id, datetime) DO UPDATE
+                    SET data = excluded.data, url = excluded.url
+                    """
+                ).format(sql.Identifier(index_type))
+                execute_values(cursor, query, rows, page_size=self.batch_size)
+
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """
+        Stored datasets of a parcel and index type, in a single query
+        """
+        with self.cursor() as cursor:
+            cursor.execute(
+                sql.SQL(
+                    """
+                    SELECT datetime, data, url
+                    FROM {}
+                    WHERE parcel_id = %s
+                    ORDER BY datetime
+                    """
+                ).format(sql.Identifier(index_type)),
+                (parcel_id,),
+            )
+            return [
+                DatasetRecord(
+                    parcel_id,
+                    index_type,
+                    time,
+                    bytes(data) if data is not None else None,
+                    url,
+                )
+                for time, data, url in cursor.fetchall()
+            ]
+
     def close(self):
         """
-        Close connection
+        Flush and release the connection pool
         """
-        # Commit and close connection
-        log.debug("Committing and closing connection")
-        self.conn.commit()
-        self.cursor.close()
-        self.conn.close()
+        self.flush()
+        log.debug("Releasing connection pool")
+        pools.release(self.pool_key)
@@ -0,0 +1,416 @@
+"""
+Module to store parcels and their NDVI and NDMI values in Zarr stores
+Each parcel has its own store, on local disk or on Minio, holding an ndvi
+and an ndmi array chunked along time, new dates being appended
+RGB quicklooks, if any, are kept in a store of their own, their grid being
+coarser than the indexes one
+"""
+
+from datetime import datetime
+
+import numpy
+import xarray
+import zarr
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.logger import log
+from crops_growth_analysis.metrics import metrics
+from crops_growth_analysis.store.common import (
+    BATCH_SIZE,
+    ENCODER,
+    QUICKLOOK,
+    QUICKLOOK_BANDS,
+    AbstractParcelStorage,
+    DatasetRecord,
+    record_data,
+    to_records,
+)
+from crops_growth_analysis.store.encoding import (
+    Encoder,
+    decode,
+    decode_png,
+    encode_png,
+)
+
+# Root of the local stores
+LOCAL_ROOT = ".data/zarr"
+
+# Root of the stores on Minio, and its connection options (see s3fs)
+MINIO_ROOT = "s3://parcels"
+MINIO_STORAGE_OPTIONS = {
+    "key": "minio",
+    "secret": "netcarbon",
+    "client_kwargs": {"endpoint_url": "http://localhost:9000"},
+}
+
+# Number of dates per chunk, a whole parcel extent being a single chunk
+TIME_CHUNK = 16
+
+
+class ParcelStorage(AbstractParcelStorage):
+    """
+    Parcel storage class
+    Provides methods to store parcels and timeseries
+    Timeseries are written on store, a parcel store being a few chunk
+    writes, and can be read back lazily with dask
+    A parcel must not be stored by two threads at once
+    """
+
+    def __init__(
+        self,
+        root: str = LOCAL_ROOT,
+        storage_options: dict | None = None,
+        batch_size: int = BATCH_SIZE,
+        encoder: str | Encoder = ENCODER,
+    ):
+        """
+        root is a local directory, or an fsspec url such as MINIO_ROOT
+        storage_options are passed to fsspec for remote roots
+        """
+        super().__init__(batch_size, encoder)
+        self.root = root.rstrip("/")
+        self.storage_options = storage_options
+
+    def store_path(self, parcel_id: str) -> str:
+        """Path of the store of a parcel"""
+        return f"{self.root}/{parcel_id}.zarr"
+
+    def quicklook_path(self, parcel_id: str) -> str:
+        """Path of the quicklooks store of a parcel"""
+        return f"{self.root}/{parcel_id}.{QUICKLOOK}.zarr"
+
+    def store_parcel(self, parcel: Parcel):
+        """
+        Store the parcel timeseries, then its information
+        """
+        log.debug("Storing timeseries")
+        if parcel.timeseries.ndim:
+            with metrics.timer("write.datasets", parcel.id) as timing:
+                timing["nbytes"] = parcel.timeseries.nbytes
+                self.write(parcel.id, parcel.timeseries)
+        if parcel.quicklooks.ndim:
+            with metrics.timer("write.datasets", parcel.id) as timing:
+                timing["nbytes"] = parcel.quicklooks.nbytes
+                self.write_quicklooks(parcel.id, parcel.quicklooks)
+        with metrics.timer("write.parcels", parcel.id):
+            self.store_parcel_info(parcel)
+        log.debug("Parcel stored")
+
+    def store_parcel_info(self, parcel: Parcel):
+        """
+        Store parcel information as attributes of its store
+        Processed datetimes are the dates of the store
+        Metadata is consolidated again, xarray reading consolidated attributes
+        """
+        times = store_dates(self.open(parcel.id))
+        group = zarr.open_group(
+            self.store_path(parcel.id),
+            mode="a",
+            storage_options=self.storage_options,
+        )
+        group.attrs.update(
+            {
+                "id": parcel.id,
+                "polygon": parcel.polygon.wkt,
+                "processed_datetimes": [str(time) for time in sorted(times)],
+            }
+        )
+        zarr.consolidate_metadata(group.store)
+
+    def stored_datetimes(
+        self, parcel_ids: list[str]
+    ) -> dict[str, set[datetime]]:
+        """
+        Dates of the stores of many parcels
+        Stores holding parcel information only have no dates
+        """
+        datetimes = {}
+        for parcel_id in parcel_ids:
+            times = store_dates(self.open(parcel_id))
+            if times.size:
+                datetimes[parcel_id] = set(
+                    times.astype("datetime64[us]").tolist()
+                )
+        return datetimes
+
+    def store_ds(
+        self,
+        parcel_id: str,
+        index_type: str,
+        time: datetime,
+        data: bytes | None = None,
+        url: str | None = None,
+    ):
+        """
+        Store a single encoded timeserie dataset
+        """
+        self.store_many([DatasetRecord(parcel_id, index_type, time, data)])
+
+    def store_many(self, records: list[DatasetRecord]):
+        """
+        Store many encoded timeserie datasets, parcel by parcel
+        """
+        by_parcel: dict[str, list[xarray.DataArray]] = {}
+        quicklooks: dict[str, list[xarray.DataArray]] = {}
+        for record in records:
+            if record.index_type == QUICKLOOK:
+                quicklooks.setdefault(record.parcel_id, []).append(
+                    xarray.DataArray(
+                        decode_png(record_data(record)),
+                        dims=["y", "x", "band"],
+                        coords={"time": numpy.datetime64(record.time, "ns")},
+                    )
+                )
+                continue
+            by_parcel.setdefault(record.parcel_id, []).append(
+                decode(record_data(record))
+            )
+        for parcel_id, images in quicklooks.items():
+            self.write_quicklooks(parcel_id, xarray.concat(images, "time"))
+        for parcel_id, datasets in by_parcel.items():
+            timeseries = xarray.combine_by_coords(
+                [ds.expand_dims(["index_type", "time"]) for ds in datasets]
+            )
+            if not isinstance(timeseries, xarray.DataArray):
+                raise TypeError(
+                    f"Datasets of {parcel_id} combine to a Dataset, "
+                    "decoded datasets must be unnamed"
+                )
+            self.write(parcel_id, timeseries)
+
+    def write(self, parcel_id: str, timeseries: xarray.DataArray):
+        """
+        Write a timeseries in the store of a parcel
+        New dates are appended, stored dates are overwritten
+        The store is rewritten if the parcel grid changed
+        """
+        dataset = to_dataset(timeseries).sortby("time")
+        path = self.store_path(parcel_id)
+        stored = self.open(parcel_id)
+        if stored is None or store_dates(stored).size == 0:
+            log.debug("Creating Zarr store %s", path)
+            if stored is not None:
+                # Keep parcel information stored before any timeseries
+                dataset.attrs = {**stored.attrs, **dataset.attrs}
+            self.write_new(path, dataset)
+            return
+        if not (
+            stored["x"].equals(dataset["x"])
+            and stored["y"].equals(dataset["y"])
+        ):
+            log.debug("Rewriting Zarr store %s", path)
+            self.write_new(
+                path, dataset.combine_first(stored.load()).sortby("time")
+            )
+            return
+        stored_times = stored["time"].values
+        is_stored = dataset["time"].isin(stored_times)
+        new_times = dataset["time"].values[~is_stored.values]
+        if not stored["time"].to_index().is_monotonic_increasing or (
+            len(new_times) and new_times.min() < stored_times.max()
+        ):
+            # Dates can only be appended after the last stored date
+            log.debug("Rewriting Zarr store %s, sorted by time", path)
+            self.write_new(
+                path, dataset.combine_first(stored.load()).sortby("time")
+            )
+            return
+        if is_stored.any():
+            log.debug("Overwriting stored dates of %s", path)
+            overwritten = dataset.sel(time=is_stored).drop_vars(["y", "x"])
+            positions = numpy.searchsorted(
+                stored_times, overwritten["time"].values
+            )
+            # Regions are contiguous, write each run of dates separately
+            for run in numpy.split(
+                numpy.arange(positions.size),
+                numpy.flatnonzero(numpy.diff(positions) != 1) + 1,
+            ):
+                overwritten.isel(time=run).to_zarr(
+                    path,
+                    region={
+                        "time": slice(
+                            int(positions[run[0]]), int(positions[run[-1]]) + 1
+                        )
+                    },
+                    storage_options=self.storage_options,
+                )
+        if not is_stored.all():
+            log.debug("Appending dates to %s", path)
+            dataset.sel(time=~is_stored).to_zarr(
+                path,
+                append_dim="time",
+                storage_options=self.storage_options,
+            )
+
+    def write_new(self, path: str, dataset: xarray.Dataset):
+        """Write a new store, chunked by TIME_CHUNK dates"""
+        dataset.to_zarr(
+            path,
+            mode="w",
+            encoding={
+                name: {"chunks": (TIME_CHUNK, *variable.shape[1:])}
+                for name, variable in dataset.data_vars.items()
+            },
+            storage_options=self.storage_options,
+        )
+
+    def write_quicklooks(self, parcel_id: str, quicklooks: xarray.DataArray):
+        """
+        Write RGB quicklooks in the quicklooks store of a parcel
+        Stored dates are kept unless overwritten, the store being small
+        enough to be rewritten as a whole
+        """
+        dataset = xarray.Dataset(
+            {
+                QUICKLOOK: quicklooks.transpose("time", "y", "x", "band")
+                .reset_coords(drop=True)
+                .drop_vars(["y", "x", "band"], errors="ignore")
+            }
+        )
+        dataset["time"] = dataset["time"].astype("datetime64[ns]")
+        dataset[QUICKLOOK].attrs = {}
+        path = self.quicklook_path(parcel_id)
+        stored = self.open_quicklooks(parcel_id)
+        if stored is not None and stored[QUICKLOOK].shape[1:] == (
+            dataset[QUICKLOOK].shape[1:]
+        ):
+            dataset = dataset.combine_first(stored.load())
+        log.debug("Writing Zarr quicklooks %s", path)
+        dataset.to_zarr(
+            path,
+            mode="w",
+            encoding={
+                QUICKLOOK: {
+                    "chunks": (TIME_CHUNK, *dataset[QUICKLOOK].shape[1:])
+                }
+            },
+            storage_options=self.storage_options,
+        )
+
+    def open(self, parcel_id: str) -> xarray.Dataset | None:
+        """
+        Lazily open the store of a parcel, or None if missing
+        """
+        try:
+            return xarray.open_zarr(
+                self.store_path(parcel_id),
+                storage_options=self.storage_options,
+            )
+        except (FileNotFoundError, KeyError):
+            return None
+
+    def open_quicklooks(self, parcel_id: str) -> xarray.Dataset | None:
+        """
+        Lazily open the quicklooks store of a parcel, or None if missing
+        """
+        try:
+            return xarray.open_zarr(
+                self.quicklook_path(parcel_id),
+                storage_options=self.storage_options,
+            )
+        except (FileNotFoundError, KeyError):
+            return None
+
+    def read(self, parcel_id: str) -> xarray.DataArray | None:
+        """
+        Lazily read the timeseries of a parcel, sorted by time
+        """
+        stored = self.open(parcel_id)
+        if stored is None or store_dates(stored).size == 0:
+            return None
+        index_types = list(stored.attrs.get("index_types", stored.data_vars))
+        return stored[index_types].to_dataarray("index_type").sortby("time")
+
+    def read_records(
+        self, parcel_id: str, index_type: str
+    ) -> list[DatasetRecord]:
+        """
+        Stored datasets of a parcel and index type, encoded from its stores
+        """
+        if index_type == QUICKLOOK:
+            quicklooks = self.read_quicklooks(parcel_id)
+            if quicklooks is None:
+                return []
+            return to_records(
+                parcel_id,
+                index_type,
+                (
+                    (
+                        quicklook["time"]
+                        .values.astype("datetime64[us]")
+                        .item(),
+                        encode_png(quicklook.values),
+                    )
+                    for quicklook in quicklooks
+                ),
+            )
+        timeseries = self.read_timeseries(parcel_id)
+        if timeseries is None or index_type not in timeseries["index_type"]:
+            return []
+        return to_records(
+            parcel_id,
+            index_type,
+            (
+                (
+                    ds["time"].values.astype("datetime64[us]").item(),
+                    self.encoder.encode(ds),
+                )
+                for ds in timeseries.sel(index_type=index_type)
+            ),
+        )
+
+    def read_timeseries(self, parcel_id: str) -> xarray.DataArray | None:
+        """
+        Read the timeseries of a parcel from its store
+        """
+        timeseries = self.read(parcel_id)
+        return None if timeseries is None else timeseries.load()
+
+    def read_quicklooks(self, parcel_id: str) -> xarray.DataArray | None:
+        """
+        Read the RGB quicklooks of a parcel from its quicklooks store
+        """
+        stored = self.open_quicklooks(parcel_id)
+        if stored is None:
+            return None
+        return (
+            stored[QUICKLOOK]
+            .sortby("time")
+            .assign_coords(band=list(QUICKLOOK_BANDS))
+            .load()
+        )
+
+    def close(self):
+        """
+        Flush pending writes, stores are written on store_parcel
+        """
+        self.flush()
+
+
+def store_dates(stored: xarray.Dataset | None) -> numpy.ndarray:
+    """
+    Dates of a parcel store, none if missing or holding parcel information
+    only
+    """
+    if stored is None or "time" not in stored.coords:
+        return numpy.array([], "datetime64[ns]")
+    return stored["time"].values
+
+
+def to_dataset(timeseries: xarray.DataArray) -> xarray.Dataset:
+    """
+    Dataset of a parcel timeseries, an array by index type
+    Coordinates and attributes other than time, y and x are dropped, the
+    order of index types is kept in attributes
+    """
+    dataset = (
+        timeseries.to_dataset(dim="index_type")
+        .transpose("time", "y", "x")
+        .reset_coords(drop=True)
+    )
+    dataset["time"] = dataset["time"].astype("datetime64[ns]")
+    dataset.attrs = {"index_types": list(dataset.data_vars)}
+    for variable in dataset.data_vars.values():
+        variable.attrs = {}
+    return dataset
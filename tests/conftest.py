@@ -0,0 +1,28 @@
+"""Fixtures shared by tests"""
+
+import pytest
+import shapely
+from pystac import ItemCollection
+
+from crops_growth_analysis import projection
+from crops_growth_analysis.benchmark import synthetic
+from crops_growth_analysis.extract.csv import Parcel
+
+
+@pytest.fixture(name="synthetic_parcels", scope="session")
+def fixture_synthetic_parcels(tmp_path_factory) -> list[Parcel]:
+    """
+    Two parcels close to each other, with the synthetic items of 2 dates of
+    the tile they share, projected to its CRS
+    """
+    parcels = [
+        Parcel(str(i), shapely.box(x, 6860020, x + 130, 6860170))
+        for i, x in enumerate((650010, 650230))
+    ]
+    items = synthetic.generate(
+        parcels, 2, tmp_path_factory.mktemp("synthetic")
+    )
+    for parcel in parcels:
+        parcel.sentinel_items = ItemCollection(items)
+    projection.project_parcels(parcels)
+    return parcels
@@ -0,0 +1,51 @@
+"""Tests of the index color tables"""
+
+import numpy
+import xarray
+
+from crops_growth_analysis.display import basic
+
+# Colors of the table ends and of NaN
+BLACK = (0, 0, 0, 1)
+GREEN = (0, 1, 0, 1)
+BLUE = (0, 0, 1, 1)
+TRANSPARENT = (0, 0, 0, 0)
+
+
+def colors(values: list[float], index_type: str = "ndvi") -> list[tuple]:
+    """Colors of index values, as tuples"""
+    return [
+        tuple(color)
+        for color in basic.apply_color_function(
+            xarray.DataArray(values), index_type
+        )
+    ]
+
+
+def test_nan_transparent():
+    """NaN values are transparent, other values opaque"""
+    rgba = basic.apply_color_function(
+        xarray.DataArray([[0.5, numpy.nan], [numpy.nan, -0.5]])
+    )
+    assert rgba.shape == (2, 2, 4)
+    assert tuple(rgba[0, 1]) == tuple(rgba[1, 0]) == TRANSPARENT
+    assert rgba[0, 0, 3] == rgba[1, 1, 3] == 1
+
+
+def test_clipped():
+    """Values out of the index range get the colors of its ends"""
+    assert colors([-5, -1, 1, 5]) == [BLACK, BLACK, GREEN, GREEN]
+
+
+def test_ndmi():
+    """NDMI is mapped to a blue gradient, black below 0"""
+    assert colors([-0.5, 1, numpy.nan], "ndmi") == [BLACK, BLUE, TRANSPARENT]
+    assert numpy.allclose(colors([0.5], "ndmi"), [(0, 0, 0.5, 1)], atol=0.01)
+
+
+def test_range_changed(monkeypatch):
+    """Tables are built again for changed index ranges"""
+    assert numpy.allclose(colors([0.5]), [(0, 0.5, 0, 1)], atol=0.01)
+    monkeypatch.setitem(basic.INDEX_RANGES, "ndvi", (0.0, 0.5))
+    assert colors([0.5, 1]) == [(0, 0.5, 0, 1), (0, 0.5, 0, 1)]
+    assert numpy.allclose(colors([0.25]), [(0, 0.25, 0, 1)], atol=0.01)
@@ -0,0 +1,54 @@
+"""Tests of the in-process LRU cache"""
+
+import numpy
+
+from crops_growth_analysis.process.cache import LRUCache
+
+
+def array(size: int) -> numpy.ndarray:
+    """Array of size bytes"""
+    return numpy.zeros(size, "uint8")
+
+
+def test_evicts_least_recently_used():
+    """Least recently used values are evicted beyond the cache size"""
+    cache = LRUCache(300)
+    for key in "abc":
+        cache.put(key, array(100))
+    cache.get("a")
+    cache.put("d", array(100))
+    assert "b" not in cache
+    assert all(key in cache for key in "acd")
+    assert cache.stats() == {
+        "entries": 3,
+        "bytes": 300,
+        "hits": 1,
+        "misses": 0,
+        "evictions": 1,
+    }
+
+
+def test_replace_and_oversized():
+    """Replaced values are counted once, oversized values are not stored"""
+    cache = LRUCache(300)
+    cache.put("a", array(100))
+    cache.put("a", array(200))
+    cache.put("b", array(400))
+    assert cache.current_bytes == 200
+    assert "b" not in cache
+
+
+def test_get_or_compute():
+    """Values are computed once"""
+    cache = LRUCache(300)
+    calls = []
+
+    def compute() -> tuple[numpy.ndarray, numpy.ndarray]:
+        calls.append(1)
+        return array(50), array(50)
+
+    assert cache.get_or_compute("grid", compute) is cache.get_or_compute(
+        "grid", compute
+    )
+    assert len(calls) == 1
+    assert cache.current_bytes == 100
@@ -0,0 +1,99 @@
+"""Tests of the cloudy items filters"""
+
+import asyncio
+import dataclasses
+
+import numpy
+import pytest
+import rasterio
+import shapely
+from pystac import ItemCollection
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.process import clouds, images, tile_cache
+
+
+@pytest.fixture(name="parcels")
+def fixture_parcels(synthetic_parcels, tmp_path, monkeypatch) -> list[Parcel]:
+    """
+    Copies of the synthetic parcels, with a clear and a cloudy item
+    The SCL of the clear item is vegetation (4), the SCL of the cloudy item
+    being cloudy (9) east of the middle of parcels
+    """
+    monkeypatch.setattr(tile_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(images, "LOAD_BACKOFF", 0)
+    clear, cloudy = (
+        item.clone() for item in synthetic_parcels[0].sentinel_items
+    )
+    epsg = cloudy.properties["proj:epsg"]
+    middle = shapely.get_x(
+        shapely.union_all(
+            [parcel.projections[epsg] for parcel in synthetic_parcels]
+        ).centroid
+    )
+    for item, cloud_cover, cloudy_from in [
+        (clear, 10, numpy.inf),
+        (cloudy, 90, middle),
+    ]:
+        item.properties["eo:cloud_cover"] = cloud_cover
+        item.assets["SCL"].href = write_scl(
+            item.assets["SCL"].href, tmp_path / f"{item.id}.tif", cloudy_from
+        )
+    return [
+        dataclasses.replace(
+            parcel,
+            sentinel_items=ItemCollection([clear, cloudy]),
+            projections=dict(parcel.projections),
+        )
+        for parcel in synthetic_parcels
+    ]
+
+
+def write_scl(href: str, path, cloudy_from: float) -> str:
+    """
+    Write a synthetic SCL on the grid of href, cloudy east of cloudy_from
+    """
+    with rasterio.open(href) as src:
+        profile = src.profile
+        columns = (numpy.arange(src.width) + 0.5) * src.res[0]
+        scl = numpy.broadcast_to(
+            numpy.where(columns + src.bounds.left > cloudy_from, 9, 4),
+            src.shape,
+        ).astype("uint8")
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(scl, 1)
+    return str(path)
+
+
+def item_ids(parcels: list[Parcel]) -> list[list[str]]:
+    """Ids of the items of each parcel"""
+    return [[item.id for item in parcel.sentinel_items] for parcel in parcels]
+
+
+def test_filter_cloud_cover(parcels):
+    """Items above the maximum cloud cover are dropped, unless it is unset"""
+    clear = parcels[0].sentinel_items[0].id
+    del parcels[0].sentinel_items[0].properties["eo:cloud_cover"]
+    clouds.filter_cloud_cover(parcels, 5)
+    assert item_ids(parcels) == [[clear], []]
+    clouds.filter_cloud_cover(parcels, None)
+    assert item_ids(parcels) == [[clear], []]
+
+
+def test_filter_valid_fraction(parcels):
+    """Items of a parcel are dropped where their SCL is cloudy"""
+    clear, cloudy = (item.id for item in parcels[0].sentinel_items)
+    clouds.filter_valid_fraction(parcels, 0.5)
+    assert item_ids(parcels) == [[clear, cloudy], [clear]]
+
+
+def test_valid_fractions(parcels):
+    """Valid fractions of every parcel and item"""
+    clear, cloudy = (item.id for item in parcels[0].sentinel_items)
+    fractions = asyncio.run(clouds.valid_fractions(parcels))
+    assert fractions == {
+        ("0", clear): 1.0,
+        ("1", clear): 1.0,
+        ("0", cloudy): 1.0,
+        ("1", cloudy): 0.0,
+    }
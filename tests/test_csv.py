@@ -0,0 +1,60 @@
+"""Tests of the parcel files loader"""
+
+import numpy
+import shapely
+
+from crops_growth_analysis.extract import csv
+
+
+def write_parcels(path) -> str:
+    """Write a CSV file of 3 square parcels, 10 m apart"""
+    rows = [
+        f'{i},{crop},"{shapely.box(i * 20, 0, i * 20 + 10, 10).wkt}"'
+        for i, crop in enumerate(["MIS", "TRN", "MIS"])
+    ]
+    path.write_text(
+        f",{csv.CROP_COLUMN},{csv.GEOMETRY_COLUMN}\n" + "\n".join(rows)
+    )
+    return str(path)
+
+
+def test_filters(tmp_path):
+    """Parcels selected by ids, crops and bounding box"""
+    file_path = write_parcels(tmp_path / "parcels.csv")
+    assert [parcel.id for parcel in csv.load_parcels([file_path])] == [
+        "0",
+        "1",
+        "2",
+    ]
+    assert [
+        parcel.id for parcel in csv.load_parcels([file_path], ids=["2"])
+    ] == ["2"]
+    assert [
+        parcel.id for parcel in csv.load_parcels([file_path], crops=["MIS"])
+    ] == ["0", "2"]
+    assert [
+        parcel.id
+        for parcel in csv.load_parcels([file_path], bbox=(15, 0, 45, 5))
+    ] == ["1", "2"]
+
+
+def test_parcel_arrays(tmp_path):
+    """Every parcel gets its own empty arrays"""
+    first, second = csv.load_parcels([write_parcels(tmp_path / "p.csv")])[:2]
+    assert first.timeseries is not second.timeseries
+    assert first.quicklooks is not second.quicklooks
+
+
+def test_index_query_all():
+    """Pairs of geometries and intersecting polygons"""
+    index = csv.ParcelIndex(
+        numpy.array([shapely.box(0, 0, 1, 1), shapely.box(2, 0, 3, 1)])
+    )
+    geometry_indexes, polygon_indexes = index.query_all(
+        numpy.array([shapely.box(2.5, 0, 4, 1), shapely.box(0, 0, 3, 1)])
+    )
+    assert sorted(zip(geometry_indexes, polygon_indexes)) == [
+        (0, 1),
+        (1, 0),
+        (1, 1),
+    ]
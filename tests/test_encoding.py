@@ -0,0 +1,48 @@
+"""Tests of timeseries encoders"""
+
+import numpy
+import pytest
+import xarray
+
+from crops_growth_analysis.store import encoding
+
+
+def dataset(index_type: str = "ndvi") -> xarray.DataArray:
+    """Single (index type, time) dataset, with a nodata pixel"""
+    values = numpy.random.default_rng(0).uniform(-1, 1, (3, 4))
+    values[0, 0] = numpy.nan
+    return xarray.DataArray(
+        values,
+        dims=("y", "x"),
+        coords={
+            "y": numpy.arange(3.0),
+            "x": numpy.arange(4.0),
+            "time": numpy.datetime64("2024-06-01T10:00:00", "ns"),
+            "index_type": index_type,
+        },
+    )
+
+
+def test_compact_round_trip():
+    """Compact encoding keeps coordinates, and values to the scale"""
+    ds = dataset()
+    decoded = encoding.decode(encoding.CompactEncoder().encode(ds))
+    numpy.testing.assert_allclose(decoded, ds, atol=1e-4)
+    assert numpy.isnan(decoded.values[0, 0])
+    for name in ("y", "x", "time", "index_type"):
+        numpy.testing.assert_array_equal(decoded[name], ds[name])
+
+
+def test_compact_long_index_type():
+    """Index types not fitting the header are refused"""
+    with pytest.raises(ValueError):
+        encoding.CompactEncoder().encode(dataset("ndvi_smoothed"))
+
+
+def test_benchmark():
+    """Every encoder is compared on every dataset"""
+    timeseries = dataset().expand_dims(index_type=1).expand_dims(time=1)
+    timeseries = timeseries.transpose("index_type", "time", "y", "x")
+    results = encoding.benchmark([timeseries, timeseries])
+    assert set(results) == set(encoding.ENCODERS)
+    assert all(result["datasets"] == 2 for result in results.values())
@@ -0,0 +1,51 @@
+"""Tests of the parcels executor"""
+
+import threading
+import time
+
+import pytest
+import shapely
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.process import executor
+
+# Ids of the parcels processed by slow_id, in thread mode
+processed: list[str] = []
+processed_lock = threading.Lock()
+
+
+def parcels(count: int) -> list[Parcel]:
+    """Parcels of ids 0 to count - 1"""
+    return [Parcel(str(i), shapely.box(i, 0, i + 1, 1)) for i in range(count)]
+
+
+def parcel_id(parcel: Parcel) -> str:
+    """Id of a parcel"""
+    return parcel.id
+
+
+def slow_id(parcel: Parcel) -> str:
+    """Id of a parcel, after a while"""
+    time.sleep(0.05)
+    with processed_lock:
+        processed.append(parcel.id)
+    return parcel.id
+
+
+@pytest.mark.parametrize("mode", ["serial", "thread", "process"])
+def test_order(mode):
+    """Results in the order of parcels"""
+    assert executor.map_parcels(
+        parcel_id, parcels(20), mode, max_workers=2
+    ) == [str(i) for i in range(20)]
+
+
+def test_close_cancels():
+    """Closing the iterator early cancels pending parcels"""
+    processed.clear()
+    results = executor.imap_parcels(
+        slow_id, parcels(50), "thread", max_workers=1
+    )
+    assert next(results) == "0"
+    results.close()
+    assert len(processed) < 50
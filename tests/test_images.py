@@ -0,0 +1,112 @@
+"""Tests of band loading"""
+
+import asyncio
+
+import numpy
+import pytest
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.windows import Window
+
+from crops_growth_analysis.process import images, tile_cache
+
+# Snapped window of the first synthetic parcel, in its item CRS (EPSG:32631)
+# The synthetic tile starts at (449400, 5410500), on the 60 meters grid
+WINDOW_BOUNDS = (450000.0, 5409660.0, 450180.0, 5409900.0)
+
+
+class FlakyReader:
+    """Reader failing a number of times, then succeeding"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def read(self) -> str:
+        """Fail until failures calls were made"""
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RasterioIOError("flaky")
+        return "data"
+
+
+@pytest.fixture(autouse=True, name="no_backoff")
+def fixture_no_backoff(monkeypatch):
+    """Retries without delay"""
+    monkeypatch.setattr(images, "LOAD_BACKOFF", 0)
+
+
+def test_retry_succeeds():
+    """Failed reads are retried up to LOAD_RETRIES times"""
+    reader = FlakyReader(images.LOAD_RETRIES)
+    assert asyncio.run(images.retry(reader.read, "band")) == "data"
+    assert reader.calls == images.LOAD_RETRIES + 1
+
+
+def test_retry_gives_up():
+    """Reads failing more than LOAD_RETRIES times raise"""
+    reader = FlakyReader(images.LOAD_RETRIES + 1)
+    with pytest.raises(RasterioIOError):
+        asyncio.run(images.retry(reader.read, "band"))
+    assert reader.calls == images.LOAD_RETRIES + 1
+
+
+def test_retry_backoff(monkeypatch):
+    """Delays double after every failed attempt"""
+    monkeypatch.setattr(images, "LOAD_BACKOFF", 0.5)
+    delays = []
+
+    async def sleep(delay: float):
+        delays.append(delay)
+
+    monkeypatch.setattr(images.asyncio, "sleep", sleep)
+    asyncio.run(images.retry(FlakyReader(3).read, "band"))
+    assert delays == [0.5, 1.0, 2.0]
+
+
+def read_window(href: str, window: Window) -> numpy.ndarray:
+    """Band values of a window, read without resampling"""
+    with rasterio.open(href) as src:
+        return src.read(1, window=window)
+
+
+def test_windows_snapped(synthetic_parcels):
+    """Windows of 10 and 20 meters bands cover the same snapped extent"""
+    item = synthetic_parcels[0].sentinel_items[0]
+    item_images = images.ItemImages(item, synthetic_parcels[0])
+    windows = {}
+    for band in ["B04", "B11", "SCL"]:
+        with rasterio.open(item.assets[band].href) as src:
+            windows[band] = item_images.window(src)
+            assert src.window_bounds(windows[band]) == WINDOW_BOUNDS
+    assert windows == {
+        "B04": Window(60, 60, 18, 24),
+        "B11": Window(30, 30, 9, 12),
+        "SCL": Window(30, 30, 9, 12),
+    }
+    assert all(bound % images.WINDOW_SNAP == 0 for bound in WINDOW_BOUNDS)
+
+
+@pytest.mark.parametrize("resolution", [10, 20])
+def test_resampled_bands_aligned(synthetic_parcels, monkeypatch, resolution):
+    """Bands resampled to a resolution share a grid, pixel for pixel"""
+    monkeypatch.setattr(tile_cache, "CACHE_ENABLED", False)
+    item = synthetic_parcels[0].sentinel_items[0]
+    item_images = images.ItemImages(
+        item, synthetic_parcels[0], resolution=resolution
+    )
+    b04, b11 = item_images.load("B04"), item_images.load("B11")
+    assert b04.shape == b11.shape == (240 // resolution, 180 // resolution)
+    assert (b04["x"].values == b11["x"].values).all()
+    assert (b04["y"].values == b11["y"].values).all()
+    raw_b04 = read_window(item.assets["B04"].href, Window(60, 60, 18, 24))
+    raw_b11 = read_window(item.assets["B11"].href, Window(30, 30, 9, 12))
+    if resolution == 10:
+        # 20 meters pixels are repeated over 2 by 2 pixels
+        assert (b04.values == raw_b04).all()
+        assert (b11.values[::2, ::2] == raw_b11).all()
+        assert (b11.values[1::2, 1::2] == raw_b11).all()
+    else:
+        # 10 meters pixels are strided, keeping the last of 2 by 2 pixels
+        assert (b04.values == raw_b04[1::2, 1::2]).all()
+        assert (b11.values == raw_b11).all()
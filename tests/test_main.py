@@ -0,0 +1,65 @@
+"""Tests of the streaming pipeline"""
+
+import gc
+import threading
+from typing import Iterator
+
+import numpy
+import pytest
+import shapely
+import xarray
+
+from crops_growth_analysis import main
+from crops_growth_analysis.display import basic
+from crops_growth_analysis.extract import sentinel
+from crops_growth_analysis.extract.csv import Parcel
+
+# Number of streamed parcels, and parcels searched at once
+PARCELS = 60
+SEARCH_CHUNK_SIZE = 20
+MAX_IN_FLIGHT = 4
+
+
+# Counts are serialized, as objects listed by a count are kept alive by it
+count_lock = threading.Lock()
+
+
+def processed_parcels() -> int:
+    """Number of live parcels holding a timeseries"""
+    with count_lock:
+        return sum(
+            1
+            for obj in gc.get_objects()
+            if isinstance(obj, Parcel) and obj.timeseries.ndim
+        )
+
+
+@pytest.mark.parametrize("mode", ["serial", "thread"])
+def test_stream_memory(mode, monkeypatch):
+    """Parcels holding a timeseries are bounded by concurrency"""
+    counts = []
+
+    def iter_parcels(*_) -> Iterator[Parcel]:
+        for i in range(PARCELS):
+            yield Parcel(str(i), shapely.box(i, 0, i + 1, 1))
+
+    def process_parcel(parcel: Parcel, method: str) -> xarray.DataArray:
+        counts.append(processed_parcels())
+        return xarray.DataArray(numpy.zeros((2, 1, 4, 4)))
+
+    monkeypatch.setattr(main.csv, "iter_parcels", iter_parcels)
+    monkeypatch.setattr(main, "search", lambda parcels, storage: parcels)
+    monkeypatch.setattr(main, "process_parcel", process_parcel)
+    monkeypatch.setattr(main, "DATABASE", None)
+    monkeypatch.setattr(main, "PARCEL_LIMIT", -1)
+    monkeypatch.setattr(main, "EXECUTOR", mode)
+    monkeypatch.setattr(main, "MAX_IN_FLIGHT", MAX_IN_FLIGHT)
+    monkeypatch.setattr(main, "STATISTICS_PATH", None)
+    monkeypatch.setattr(main, "QUICKLOOKS", False)
+    monkeypatch.setattr(sentinel, "SEARCH_CHUNK_SIZE", SEARCH_CHUNK_SIZE)
+    monkeypatch.setattr(basic, "PARCEL_LIMIT", 0)
+
+    assert main.stream() == []
+    assert len(counts) == PARCELS
+    # In flight results, and the one being consumed
+    assert max(counts) <= MAX_IN_FLIGHT + 1
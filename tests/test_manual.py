@@ -0,0 +1,53 @@
+"""Tests of the manual processing method"""
+
+import pytest
+import xarray
+from rasterio.errors import RasterioIOError
+
+from crops_growth_analysis.process import images, manual, tile_cache
+
+
+@pytest.fixture(autouse=True, name="no_tile_cache")
+def fixture_no_tile_cache(monkeypatch):
+    """Bands are read without tile cache, and retried without delay"""
+    monkeypatch.setattr(tile_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(images, "LOAD_BACKOFF", 0)
+
+
+def test_grouped_matches_single(synthetic_parcels):
+    """Grouped processing matches processing parcels one by one"""
+    for grouped, parcel in zip(
+        manual.process_parcels(synthetic_parcels), synthetic_parcels
+    ):
+        xarray.testing.assert_identical(grouped, manual.process_parcel(parcel))
+
+
+@pytest.mark.parametrize("failures", [1, images.LOAD_RETRIES])
+def test_open_retried(synthetic_parcels, monkeypatch, failures):
+    """Bands that fail to open are opened again"""
+    open_band = tile_cache.open_band
+    opens = {"failed": 0}
+
+    def flaky_open(href: str):
+        if opens["failed"] < failures:
+            opens["failed"] += 1
+            raise RasterioIOError("flaky")
+        return open_band(href)
+
+    monkeypatch.setattr(tile_cache, "open_band", flaky_open)
+    timeseries = manual.process_parcels(synthetic_parcels)
+    assert opens["failed"] == failures
+    assert [
+        len(parcel_timeseries["time"]) for parcel_timeseries in timeseries
+    ] == [2, 2]
+
+
+def test_open_fails_after_retries(synthetic_parcels, monkeypatch):
+    """Bands failing more than LOAD_RETRIES times fail the parcels"""
+
+    def failing_open(href: str):
+        raise RasterioIOError("down")
+
+    monkeypatch.setattr(tile_cache, "open_band", failing_open)
+    with pytest.raises(RasterioIOError):
+        manual.process_parcels(synthetic_parcels)
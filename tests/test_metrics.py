@@ -0,0 +1,46 @@
+"""Tests of pipeline metrics"""
+
+from crops_growth_analysis import metrics as metrics_module
+from crops_growth_analysis.metrics import Metrics
+
+
+def test_summary():
+    """Steps are aggregated by name"""
+    metrics = Metrics()
+    metrics.record("read", 0.0, 1.0, nbytes=10)
+    metrics.record("read", 1.0, 3.0, nbytes=20)
+    metrics.record("mask", 4.0, 0.5)
+    summary = metrics.summary()
+    assert summary["read"] == {
+        "count": 2,
+        "total": 4.0,
+        "mean": 2.0,
+        "min": 1.0,
+        "max": 3.0,
+        "nbytes": 30,
+    }
+    assert summary["mask"]["count"] == 1
+
+
+def test_records_bounded(monkeypatch):
+    """Only the last records are kept, aggregates count every step"""
+    monkeypatch.setattr(metrics_module, "MAX_RECORDS", 3)
+    metrics = Metrics()
+    for i in range(10):
+        metrics.record("read", float(i), 1.0)
+    assert [record.start for record in metrics.records] == [7.0, 8.0, 9.0]
+    assert metrics.summary()["read"]["count"] == 10
+
+
+def test_drain_and_merge():
+    """Metrics drained from a worker are merged in the main process"""
+    worker = Metrics()
+    worker.record("read", 0.0, 2.0, nbytes=5)
+    main = Metrics()
+    main.record("read", 0.0, 1.0)
+    main.merge(*worker.drain())
+    assert main.summary()["read"]["count"] == 2
+    assert main.summary()["read"]["max"] == 2.0
+    assert main.summary()["read"]["nbytes"] == 5
+    assert len(main.records) == 2
+    assert not worker.summary()
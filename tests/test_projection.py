@@ -0,0 +1,44 @@
+"""Tests of shared transformers and bulk projection"""
+
+import threading
+
+import numpy
+import shapely
+from pyproj import Transformer
+
+from crops_growth_analysis import projection
+
+
+def test_project_all_matches_transformer():
+    """Bulk projection matches per geometry transforms"""
+    polygons = [
+        shapely.box(x, 6860000, x + 100, 6860150)
+        for x in range(650000, 700000, 10000)
+    ]
+    projected = projection.project_all(polygons, 2154, 4326)
+    transformer = Transformer.from_crs(2154, 4326, always_xy=True)
+    for polygon, result in zip(polygons, projected):
+        x, y = transformer.transform(*polygon.exterior.xy)
+        numpy.testing.assert_allclose(
+            numpy.column_stack([x, y]),
+            shapely.get_coordinates(result),
+        )
+    assert projection.project(polygons[0], 2154, 4326).equals_exact(
+        projected[0], 0
+    )
+
+
+def test_transformers_reused_per_thread():
+    """Transformers are created once per thread and CRS pair"""
+    first = projection.get_transformer(2154, 32631)
+    assert projection.get_transformer(2154, 32631) is first
+    assert projection.get_transformer(32631, 2154) is not first
+    other_thread = []
+    thread = threading.Thread(
+        target=lambda: other_thread.append(
+            projection.get_transformer(2154, 32631)
+        )
+    )
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not first
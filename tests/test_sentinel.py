@@ -0,0 +1,97 @@
+"""Tests of the bulk STAC search, against recorded items"""
+
+from datetime import datetime, timezone
+
+import pytest
+import shapely
+from pystac import Item, ItemCollection
+
+from crops_growth_analysis import projection
+from crops_growth_analysis.benchmark.synthetic import RecordedCatalog
+from crops_growth_analysis.extract import cache, sentinel
+from crops_growth_analysis.extract.csv import Parcel
+
+# Date of recorded items, within the searched dates
+DATE = datetime(2024, 6, 1, 10, 30, tzinfo=timezone.utc)
+
+
+class CountingCatalog(RecordedCatalog):
+    """Recorded catalog counting its searches"""
+
+    searches = 0
+
+    def search(self, **kwargs) -> RecordedCatalog:
+        CountingCatalog.searches += 1
+        return super().search(**kwargs)
+
+
+def parcels(count: int) -> list[Parcel]:
+    """Parcels of 100 m, 10 km apart from west to east, in parcels CRS"""
+    return [
+        Parcel(str(i), shapely.box(x, 6860000, x + 100, 6860100))
+        for i, x in enumerate(range(650000, 650000 + count * 10000, 10000))
+    ]
+
+
+def item(item_id: str, covered: list[Parcel]) -> Item:
+    """Item whose footprint covers parcels, with a 1 km margin"""
+    footprint = projection.project(
+        shapely.box(*shapely.total_bounds([p.polygon for p in covered]))
+        .buffer(1000)
+        .envelope,
+        projection.PARCEL_EPSG,
+        projection.CATALOG_EPSG,
+    )
+    return Item(
+        item_id,
+        shapely.geometry.mapping(footprint),
+        list(footprint.bounds),
+        DATE,
+        {},
+    )
+
+
+@pytest.fixture(autouse=True, name="no_cache")
+def fixture_no_cache(monkeypatch):
+    """Searches are not read from nor saved to the search cache"""
+    monkeypatch.setattr(cache, "CACHE_ENABLED", False)
+    CountingCatalog.searches = 0
+
+
+def test_search_parcels():
+    """Chunked searches, parcels only getting the items they intersect"""
+    selected = parcels(5)
+    catalog = CountingCatalog(
+        ItemCollection(
+            [
+                item("west", selected[0:2]),
+                item("middle", selected[1:2]),
+                item("east", selected[3:4]),
+            ]
+        )
+    )
+    # Parcels not sorted from west to east, chunks are sorted
+    results = sentinel.search_parcels(
+        selected[::-1], chunk_size=2, client=catalog
+    )
+    assert CountingCatalog.searches == 3
+    assert [[item.id for item in items] for items in results] == [
+        [],
+        ["east"],
+        [],
+        ["west", "middle"],
+        ["west"],
+    ]
+    assert all(isinstance(items, ItemCollection) for items in results)
+
+
+def test_assign_items_empty():
+    """Every parcel gets an empty collection without items"""
+    polygons = projection.project_all(
+        [parcel.polygon for parcel in parcels(2)],
+        projection.PARCEL_EPSG,
+        projection.CATALOG_EPSG,
+    )
+    results = sentinel.assign_items(polygons, ItemCollection([]))
+    assert [len(items) for items in results] == [0, 0]
+    assert results[0] is not results[1]
@@ -0,0 +1,78 @@
+"""Tests of the on-disk STAC search cache"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+import shapely
+from pystac import Asset, Item, ItemCollection
+
+from crops_growth_analysis.extract import cache
+
+# Signed href of the recorded asset
+SIGNED_HREF = "https://account.blob.core.windows.net/tile/B04.tif?sv=1&sig=2"
+
+
+@pytest.fixture(name="items")
+def fixture_items(tmp_path, monkeypatch) -> ItemCollection:
+    """An item with a signed asset, and an empty cache in tmp_path"""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(cache, "CACHE_TTL", 3600)
+    # Signing is left to the STAC client, not tested here
+    monkeypatch.setattr(cache.planetary_computer, "sign", lambda items: items)
+    item = Item(
+        "item",
+        shapely.geometry.mapping(shapely.box(0, 0, 1, 1)),
+        [0, 0, 1, 1],
+        datetime(2024, 6, 1, tzinfo=timezone.utc),
+        {},
+    )
+    item.add_asset("B04", Asset(SIGNED_HREF))
+    return ItemCollection([item])
+
+
+def key() -> str:
+    """Key of a test search"""
+    return cache.search_key(shapely.box(0, 0, 1, 1), "s2", "2024-06")
+
+
+def test_save_strips_tokens(items):
+    """Assets are saved without their query string"""
+    cache.save(key(), items)
+    with open(cache.cache_path(key()), "r", encoding="utf-8") as file:
+        saved = json.load(file)
+    assert saved["features"][0]["assets"]["B04"]["href"] == (
+        "https://account.blob.core.windows.net/tile/B04.tif"
+    )
+    assert [item.id for item in cache.load(key())] == ["item"]
+
+
+def test_expired(items):
+    """Searches older than the TTL are removed"""
+    cache.save(key(), items)
+    old = time.time() - 7200
+    os.utime(cache.cache_path(key()), (old, old))
+    assert cache.load(key()) is None
+    assert not cache.cache_path(key()).exists()
+
+
+def test_no_ttl(items, monkeypatch):
+    """Searches never expire without TTL"""
+    monkeypatch.setattr(cache, "CACHE_TTL", None)
+    cache.save(key(), items)
+    os.utime(cache.cache_path(key()), (0, 0))
+    assert cache.load(key()) is not None
+
+
+def test_invalidate(items):
+    """Searches are removed one by one, or all at once"""
+    other = cache.search_key((0, 0, 1, 1), "s2", "2024-06")
+    cache.save(key(), items)
+    cache.save(other, items)
+    cache.invalidate(key())
+    assert cache.load(key()) is None
+    assert cache.load(other) is not None
+    cache.invalidate()
+    assert cache.load(other) is None
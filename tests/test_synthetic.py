@@ -0,0 +1,84 @@
+"""Tests of the recorded catalog of synthetic items"""
+
+from datetime import datetime, timezone
+
+import pytest
+import shapely
+from pystac import Item, ItemCollection
+
+from crops_growth_analysis.benchmark.synthetic import RecordedCatalog
+
+
+def item(item_id: str, day: int, collection: str | None = None) -> Item:
+    """Item over (0, 0, 1, 1), acquired on a day of June 2024"""
+    return Item(
+        item_id,
+        shapely.geometry.mapping(shapely.box(0, 0, 1, 1)),
+        [0, 0, 1, 1],
+        datetime(2024, 6, day, 10, 30, tzinfo=timezone.utc),
+        {},
+        collection=collection,
+    )
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog() -> RecordedCatalog:
+    """Items of the 1st, 15th and 30th of June, and of another collection"""
+    return RecordedCatalog(
+        ItemCollection(
+            [
+                item("first", 1),
+                item("middle", 15, "sentinel-2-l2a"),
+                item("last", 30),
+                item("landsat", 15, "landsat-c2-l2"),
+            ]
+        )
+    )
+
+
+def found(catalog: RecordedCatalog, **kwargs) -> list[str]:
+    """Ids of the items found by a search over (0, 0, 1, 1)"""
+    return [
+        item.id
+        for item in catalog.search(bbox=(0, 0, 1, 1), **kwargs)
+        .item_collection()
+        .items
+    ]
+
+
+def test_search_geometry(catalog):
+    """Only items intersecting the searched geometry are found"""
+    assert found(catalog) == ["first", "middle", "last", "landsat"]
+    assert not catalog.search(bbox=(2, 2, 3, 3)).item_collection().items
+    assert (
+        not catalog.search(intersects=shapely.box(2, 2, 3, 3))
+        .item_collection()
+        .items
+    )
+
+
+def test_search_collections(catalog):
+    """Items of other collections are skipped, items without are kept"""
+    assert found(catalog, collections=["sentinel-2-l2a"]) == [
+        "first",
+        "middle",
+        "last",
+    ]
+
+
+@pytest.mark.parametrize(
+    "datetime_range, expected",
+    [
+        ("2024-06-01/2024-06-30", ["first", "middle", "last"]),
+        ("2024-06-02/2024-06-29", ["middle"]),
+        ("2024-06-15T12:00:00Z/..", ["last"]),
+        ("../2024-06-01", ["first"]),
+        ("2024-06-30", ["last"]),
+    ],
+)
+def test_search_datetime(catalog, datetime_range, expected):
+    """Items acquired out of the datetime range are skipped"""
+    assert (
+        found(catalog, collections=["sentinel-2-l2a"], datetime=datetime_range)
+        == expected
+    )
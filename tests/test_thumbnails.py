@@ -0,0 +1,104 @@
+"""Tests of the headless thumbnails export"""
+
+import threading
+
+import numpy
+import pystac
+import shapely
+import xarray
+
+from crops_growth_analysis.display import basic, thumbnails
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.process import quicklook
+
+# Dates of test timeseries
+DATES = numpy.array(["2024-06-01", "2024-06-11"], dtype="datetime64[ns]")
+
+
+def parcel(parcel_id: str, with_quicklooks: bool) -> Parcel:
+    """Processed parcel of 2 dates, with an item per date"""
+    y = numpy.arange(4.0, 0, -1)
+    x = numpy.arange(5.0)
+    return Parcel(
+        parcel_id,
+        shapely.box(0, 1, 4, 4),
+        sentinel_items=pystac.ItemCollection(
+            [
+                pystac.Item(str(date), None, None, date.item(), {})
+                for date in DATES.astype("datetime64[s]")
+            ]
+        ),
+        timeseries=xarray.DataArray(
+            numpy.random.default_rng(0).uniform(-1, 1, (2, 2, 4, 5)),
+            dims=("index_type", "time", "y", "x"),
+            coords={
+                "index_type": ["ndvi", "ndmi"],
+                "time": DATES,
+                "y": y,
+                "x": x,
+            },
+        ),
+        quicklooks=(quicklooks() if with_quicklooks else xarray.DataArray()),
+    )
+
+
+def quicklooks() -> xarray.DataArray:
+    """Grey quicklooks of every date"""
+    return xarray.DataArray(
+        numpy.full((2, 2, 3, 3), 128, "uint8"),
+        dims=("time", "y", "x", "band"),
+        coords={"time": DATES},
+    )
+
+
+def test_export(tmp_path, monkeypatch):
+    """A thumbnail per date and a contact sheet, without reading imagery"""
+    computed = []
+    monkeypatch.setattr(
+        quicklook,
+        "compute_quicklooks",
+        lambda parcel: computed.append(parcel.id) or quicklooks(),
+    )
+
+    def fail(*args):
+        raise AssertionError("imagery read")
+
+    monkeypatch.setattr(basic, "get_visual", fail)
+    count = thumbnails.export_parcels(
+        [parcel("computed", False), parcel("stored", True)],
+        tmp_path,
+        mode="serial",
+    )
+    assert count == 4
+    assert computed == ["computed"]
+    for parcel_id in ("computed", "stored"):
+        assert len(list((tmp_path / parcel_id).glob("*.png"))) == 3
+
+
+def test_quicklooks_computed_by_workers(tmp_path, monkeypatch):
+    """Missing quicklooks are computed in worker threads, not when pulled"""
+    threads = []
+    monkeypatch.setattr(
+        quicklook,
+        "compute_quicklooks",
+        lambda parcel: threads.append(threading.current_thread())
+        or quicklooks(),
+    )
+    monkeypatch.setattr(basic, "get_visual", None)
+    count = thumbnails.export_parcels(
+        [parcel(str(i), False) for i in range(3)], tmp_path, mode="thread"
+    )
+    assert count == 6
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
+
+
+def test_without_items():
+    """Items are only sent to workers to compute missing quicklooks"""
+    stored, computed = list(
+        thumbnails.without_items(
+            [parcel("stored", True), parcel("computed", False)]
+        )
+    )
+    assert len(stored.sentinel_items) == 0
+    assert len(computed.sentinel_items) == 2
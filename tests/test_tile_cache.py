@@ -0,0 +1,98 @@
+"""Tests of the local tile cache"""
+
+import os
+
+import numpy
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from crops_growth_analysis.process import tile_cache
+
+
+@pytest.fixture(name="band")
+def fixture_band(tmp_path, monkeypatch) -> str:
+    """A 100x100 band, and an empty tile cache in tmp_path"""
+    monkeypatch.setattr(tile_cache, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(tile_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(tile_cache, "_size", None)
+    monkeypatch.setattr(tile_cache, "_headers", {})
+    path = tmp_path / "band.tif"
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=100,
+        height=100,
+        count=1,
+        dtype="uint16",
+        crs="EPSG:32631",
+        transform=from_origin(500000, 4800000, 10, 10),
+    ) as dst:
+        dst.write(numpy.arange(10000, dtype="uint16").reshape(100, 100), 1)
+    return str(path)
+
+
+def on_disk_size() -> int:
+    """Size of cached windows and headers on disk"""
+    return sum(path.stat().st_size for path in tile_cache.cached_files())
+
+
+def test_cached_read_does_not_open(band, monkeypatch):
+    """Cached windows and headers are read without opening the band"""
+    window = Window(10, 20, 30, 40)
+    with tile_cache.open_band(band) as src:
+        expected = src.read(1, window=window)
+        bounds = src.window_bounds(window)
+    tile_cache._headers.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("band opened")
+
+    monkeypatch.setattr(rasterio, "open", fail)
+    with tile_cache.open_band(band) as src:
+        assert src.res == (10, 10)
+        assert src.window(*bounds) == window
+        assert (src.read(1, window=window) == expected).all()
+
+
+def test_size_counted_once(band):
+    """Saved windows are counted once in the cache size"""
+    with tile_cache.open_band(band) as src:
+        src.read(1, window=Window(0, 0, 50, 50))
+        src.read(1, window=Window(50, 50, 50, 50))
+    assert tile_cache._size == on_disk_size()
+
+
+def test_evict_to_low_water(band, monkeypatch):
+    """Eviction brings the cache under its low water mark"""
+    with tile_cache.open_band(band) as src:
+        for i in range(10):
+            src.read(1, window=Window(i * 10, 0, 10, 100))
+        size = tile_cache._size
+        monkeypatch.setattr(tile_cache, "CACHE_SIZE", size)
+        src.read(1, window=Window(0, 0, 100, 100))
+    assert tile_cache._size <= size * tile_cache.CACHE_LOW_WATER
+    assert tile_cache._size == on_disk_size()
+
+
+def test_headers_evicted(band, monkeypatch):
+    """Headers count in the cache size, and are evicted when least used"""
+    with tile_cache.open_band(band) as src:
+        assert tile_cache._size == on_disk_size() > 0
+        tile_cache._headers.clear()
+        os.utime(tile_cache.header_path(band), (0, 0))
+        monkeypatch.setattr(tile_cache, "CACHE_SIZE", 1)
+        src.read(1, window=Window(0, 0, 10, 10))
+    assert not tile_cache.header_path(band).exists()
+    assert tile_cache._size == on_disk_size()
+
+
+def test_disabled(band, monkeypatch):
+    """Nothing is read from nor written to a disabled cache"""
+    monkeypatch.setattr(tile_cache, "CACHE_ENABLED", False)
+    with tile_cache.open_band(band) as src:
+        assert src.read(1, window=Window(0, 0, 10, 10)).shape == (10, 10)
+    assert not list(tile_cache.CACHE_DIR.glob("**/*"))
+    assert not tile_cache._headers
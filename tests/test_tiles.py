@@ -0,0 +1,33 @@
+"""Tests of shared tile reads"""
+
+from rasterio.windows import Window
+
+from crops_growth_analysis.process import tiles
+
+
+def test_merge_close_windows():
+    """Windows closer than the gap are merged, others are kept"""
+    merged = tiles.merge_windows(
+        [Window(0, 0, 10, 10), Window(200, 0, 10, 10), Window(15, 5, 10, 10)],
+        gap=8,
+    )
+    assert merged == [Window(0, 0, 25, 15), Window(200, 0, 10, 10)]
+
+
+def test_merge_max_size():
+    """Merged windows stay smaller than the maximum size"""
+    merged = tiles.merge_windows(
+        [Window(0, 0, 10, 10), Window(12, 0, 10, 10)], gap=8, max_size=20
+    )
+    assert merged == [Window(0, 0, 10, 10), Window(12, 0, 10, 10)]
+
+
+def test_merged_windows_contain_windows():
+    """Every window is contained in a merged window"""
+    windows = [Window(i * 37 % 300, i * 53 % 300, 20, 30) for i in range(50)]
+    merged = tiles.merge_windows(windows, gap=16, max_size=200)
+    assert all(
+        any(tiles.contains(outer, window) for outer in merged)
+        for window in windows
+    )
+    assert len(merged) < len(windows)
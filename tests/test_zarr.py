@@ -0,0 +1,159 @@
+"""Tests of the Zarr parcel storage"""
+
+import numpy
+import pytest
+import shapely
+import xarray
+
+from crops_growth_analysis.extract.csv import Parcel
+from crops_growth_analysis.store import zarr
+from crops_growth_analysis.store.common import AbstractParcelStorage
+from crops_growth_analysis.store.encoding import decode
+
+# Dates of test timeseries
+DATES = numpy.array(
+    ["2024-06-01", "2024-06-06", "2024-06-11", "2024-06-16", "2024-06-21"],
+    "datetime64[ns]",
+)
+
+
+def timeseries(days: list[int], value: float) -> xarray.DataArray:
+    """Timeseries at DATES[days], every pixel of date i being value + i"""
+    values = numpy.ones((2, len(days), 3, 4)) * (
+        value + numpy.array(days)[None, :, None, None]
+    )
+    return xarray.DataArray(
+        values,
+        dims=("index_type", "time", "y", "x"),
+        coords={
+            "index_type": ["ndvi", "ndmi"],
+            "time": DATES[days],
+            "y": [30.0, 20.0, 10.0],
+            "x": [0.0, 10.0, 20.0, 30.0],
+        },
+    )
+
+
+@pytest.fixture(name="storage")
+def fixture_storage(tmp_path) -> zarr.ParcelStorage:
+    """Storage in a temporary directory"""
+    return zarr.ParcelStorage(str(tmp_path))
+
+
+def stored_values(storage: zarr.ParcelStorage) -> dict:
+    """Stored NDVI value of each date"""
+    stored = storage.read("parcel").load()
+    assert list(stored["index_type"].values) == ["ndvi", "ndmi"]
+    return {
+        time: float(stored.sel(index_type="ndvi", time=time)[0, 0])
+        for time in stored["time"].values
+    }
+
+
+def test_append(storage):
+    """New dates are appended"""
+    storage.write("parcel", timeseries([0, 1], 0))
+    storage.write("parcel", timeseries([2, 3], 0))
+    assert stored_values(storage) == {DATES[i]: i for i in range(4)}
+
+
+def test_overwrite_non_contiguous(storage):
+    """Stored dates are overwritten, even if not contiguous"""
+    storage.write("parcel", timeseries([0, 1, 2, 3], 0))
+    storage.write("parcel", timeseries([0, 2, 3], 10))
+    assert stored_values(storage) == {
+        DATES[0]: 10,
+        DATES[1]: 1,
+        DATES[2]: 12,
+        DATES[3]: 13,
+    }
+
+
+def test_overwrite_and_append(storage):
+    """Stored dates are overwritten and new dates appended at once"""
+    storage.write("parcel", timeseries([0, 1], 0))
+    storage.write("parcel", timeseries([1, 2], 10))
+    assert stored_values(storage) == {DATES[0]: 0, DATES[1]: 11, DATES[2]: 12}
+
+
+def test_earlier_dates(storage):
+    """Dates earlier than stored ones keep the store sorted"""
+    storage.write("parcel", timeseries([2, 4], 0))
+    storage.write("parcel", timeseries([0, 3], 0))
+    stored = storage.open("parcel")
+    assert (stored["time"].values == DATES[[0, 2, 3, 4]]).all()
+    storage.write("parcel", timeseries([0, 2], 10))
+    assert stored_values(storage) == {
+        DATES[0]: 10,
+        DATES[2]: 12,
+        DATES[3]: 3,
+        DATES[4]: 4,
+    }
+
+
+def test_stored_datetimes(storage):
+    """Stored dates of parcels, parcels never stored having none"""
+    storage.write("parcel", timeseries([0, 1], 0))
+    assert storage.stored_datetimes(["parcel", "other"]) == {
+        "parcel": set(DATES[[0, 1]].astype("datetime64[us]").tolist())
+    }
+
+
+def test_parcel_info(storage):
+    """Parcel information is read back from consolidated metadata"""
+    storage.write("parcel", timeseries([0, 1], 0))
+    storage.store_parcel_info(Parcel("parcel", shapely.box(0, 0, 1, 1)))
+    attrs = storage.open("parcel").attrs
+    assert attrs["id"] == "parcel"
+    assert len(attrs["processed_datetimes"]) == 2
+
+
+def test_parcel_info_only(storage):
+    """Stores holding parcel information only have no dates"""
+    storage.store_parcel_info(Parcel("parcel", shapely.box(0, 0, 1, 1)))
+    storage.store_parcel_info(Parcel("parcel", shapely.box(0, 0, 1, 1)))
+    assert storage.stored_datetimes(["parcel"]) == {}
+    assert storage.read("parcel") is None
+    storage.write("parcel", timeseries([0], 0))
+    assert stored_values(storage) == {DATES[0]: 0}
+    assert storage.open("parcel").attrs["id"] == "parcel"
+
+
+def test_store_many(storage):
+    """Encoded datasets are combined into a timeseries"""
+    storage.write("other", timeseries([0, 1], 0))
+    storage.store_many(
+        [
+            record._replace(parcel_id="parcel")
+            for index_type in ["ndvi", "ndmi"]
+            for record in storage.read_records("other", index_type)
+        ]
+    )
+    stored = storage.read("parcel").sel(index_type=["ndvi", "ndmi"])
+    assert stored.load().equals(storage.read("other").load())
+
+
+def test_read_records(storage):
+    """Records read from the store decode to the stored timeseries"""
+    storage.write("parcel", timeseries([0, 1], 0))
+    records = storage.read_records("parcel", "ndmi")
+    assert [record.time for record in records] == DATES[[0, 1]].astype(
+        "datetime64[us]"
+    ).tolist()
+    assert [float(decode(record.data)[0, 0]) for record in records] == [0, 1]
+    assert storage.read_records("other", "ndvi") == []
+
+
+def test_read_timeseries_without_data(storage, monkeypatch):
+    """Records holding only a URL are not decoded by the base storage"""
+    storage.write("parcel", timeseries([0], 0))
+    records = storage.read_records("parcel", "ndvi")
+    monkeypatch.setattr(
+        storage,
+        "read_records",
+        lambda *_: [
+            record._replace(data=None, url="s3://") for record in records
+        ],
+    )
+    with pytest.raises(ValueError, match="No data in the ndvi record"):
+        AbstractParcelStorage.read_timeseries(storage, "parcel")
@@ -0,0 +1,65 @@
+"""Tests of zonal statistics"""
+
+import numpy
+import shapely
+import xarray
+
+from crops_growth_analysis.process import mask, zonal
+
+
+def timeseries(height: int = 4, width: int = 5) -> xarray.DataArray:
+    """Random timeseries of 2 index types and 3 dates"""
+    return xarray.DataArray(
+        numpy.random.default_rng(0).random((2, 3, height, width)),
+        dims=("index_type", "time", "y", "x"),
+        coords={
+            "index_type": ["ndvi", "ndmi"],
+            "time": numpy.arange(3).astype("datetime64[D]"),
+            "y": numpy.arange(float(height)),
+            "x": numpy.arange(float(width)),
+        },
+    )
+
+
+def test_statistics():
+    """Statistics of the masked pixels"""
+    values = timeseries()
+    parcel_mask = numpy.zeros((4, 5), bool)
+    parcel_mask[1:3, 1:3] = True
+    statistics = zonal.zonal_statistics(values, parcel_mask)
+    expected = values.values[..., parcel_mask]
+    numpy.testing.assert_allclose(
+        statistics["mean"].values, expected.mean(axis=-1)
+    )
+    numpy.testing.assert_allclose(
+        statistics["p90"].values, numpy.percentile(expected, 90, axis=-1)
+    )
+    assert (statistics["valid_count"] == 4).all()
+    assert (statistics["valid_fraction"] == 1).all()
+
+
+def test_empty_mask():
+    """A parcel without pixels has NaN statistics and no valid pixel"""
+    statistics = zonal.zonal_statistics(
+        timeseries(), numpy.zeros((4, 5), bool)
+    )
+    for name in ("mean", "median", "p10", "p90"):
+        assert statistics[name].shape == (2, 3)
+        assert statistics[name].isnull().all()
+    assert (statistics["valid_count"] == 0).all()
+    assert (statistics["valid_fraction"] == 0).all()
+
+
+def test_empty_grid():
+    """A parcel on an empty grid has NaN statistics"""
+    values = timeseries(height=0)
+    parcel_mask = mask.cached_polygon_mask(
+        ("empty", 2154),
+        shapely.box(0, 0, 1, 1),
+        values["x"].values,
+        values["y"].values,
+    )
+    assert parcel_mask.shape == (0, 5)
+    statistics = zonal.zonal_statistics(values, parcel_mask)
+    assert statistics["mean"].isnull().all()
+    assert (statistics["valid_count"] == 0).all()